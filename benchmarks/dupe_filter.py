@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Compare the DupeFilter modes: keeping raw keys in a set, keeping their 64 bits
+hashes in an array backed hash table, and keeping them in a scalable Bloom
+filter. Reports items/sec, and the memory used per key after filtering.
+
+Usage: python -m benchmarks.dupe_filter [number_of_items]
+"""
+from __future__ import print_function
+import sys
+
+from exporters.filters.dupe_filter import DupeFilter
+from exporters.meta import ExportMeta
+from exporters.records.base_record import BaseRecord
+
+from .utils import measure, report
+
+
+MODES = ['set', 'hash', 'bloom']
+
+KEY = 'https://www.example.com/products/category/item-%d.html'
+
+
+def make_items(count):
+    # Half of the items are dupes, with URL like keys
+    return [BaseRecord({'_key': KEY % (i // 2)}) for i in range(count)]
+
+
+def filtering(mode, filters):
+    def filter_items(items):
+        options = {'mode': mode, 'initial_capacity': 1024}
+        dupe_filter = DupeFilter({'options': options}, ExportMeta(None))
+        for _ in dupe_filter.filter_batch(items):
+            pass
+        filters.append(dupe_filter)
+    return filter_items
+
+
+def main(count=200000):
+    items = make_items(count)
+    results = []
+    memory = []
+    for mode in MODES:
+        filters = []
+        results.append(('{} mode'.format(mode), measure(filtering(mode, filters), items)))
+        key_set = filters[-1].key_set
+        memory.append((mode, float(key_set.memory_usage()) / len(key_set)))
+    report('DupeFilter ({} items, {} unique keys)'.format(count, count // 2), results)
+    print('Memory per key')
+    for mode, bytes_per_key in memory:
+        print('  {:<40} {:>14,.1f} bytes'.format('{} mode'.format(mode), bytes_per_key))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
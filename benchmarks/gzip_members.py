@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Compare ZLibDecompressor inflating a gzip stream made of many concatenated
+members serially against inflating them on a thread pool.
+
+Usage: python -m benchmarks.gzip_members [number_of_members]
+"""
+import gzip
+import json
+import sys
+from io import BytesIO
+
+from exporters.decompressors import ZLibDecompressor
+from exporters.iterio import IterIO
+
+from .utils import measure, report
+
+
+def make_member(index, lines=1000):
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as f:
+        for i in range(lines):
+            f.write(json.dumps({'_key': '%d-%d' % (index, i), 'value': i * index}) + '\n')
+    return out.getvalue()
+
+
+def decompressing(threads):
+    def decompress(members):
+        compressed = b''.join(members)
+        decompressor = ZLibDecompressor({'options': {'threads': threads}}, None)
+        for _ in decompressor.decompress(IterIO(BytesIO(compressed))):
+            pass
+    return decompress
+
+
+def main(count=2000):
+    members = [make_member(i) for i in range(count)]
+    report('ZLibDecompressor ({} members, {} compressed bytes)'.format(
+        count, sum(len(member) for member in members)), [
+        ('serial', measure(decompressing(0), members)),
+        ('2 threads', measure(decompressing(2), members)),
+        ('4 threads', measure(decompressing(4), members)),
+    ])
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
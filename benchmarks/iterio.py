@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Compare line splitting in IterIO against the previous implementation, which
+read files in 1024 bytes chunks and built every line by concatenating chunks
+and pushing the remainder back.
+
+Usage: python -m benchmarks.iterio [total_megabytes]
+"""
+import sys
+from io import BytesIO
+
+from exporters.iterio import IterIO
+
+from .utils import measure, report
+
+
+LINE_SIZES = [100, 1000, 10000, 100000]
+
+
+class ConcatLineReader(object):
+    """
+    The line reading algorithm IterIO used before buffering chunks.
+    """
+
+    def __init__(self, file_obj, chunk_size=1024):
+        self._file = file_obj
+        self._chunk_size = chunk_size
+        self._unconsumed = []
+
+    def next_chunk(self):
+        if self._unconsumed:
+            return self._unconsumed.pop()
+        data = self._file.read(self._chunk_size)
+        if not data:
+            raise StopIteration
+        return data
+
+    def readline(self):
+        line = ""
+        n_pos = -1
+        try:
+            while n_pos < 0:
+                line += self.next_chunk()
+                n_pos = line.find('\n')
+        except StopIteration:
+            pass
+        if n_pos >= 0:
+            line, extra = line[:n_pos+1], line[n_pos+1:]
+            if extra:
+                self._unconsumed.append(extra)
+        return line
+
+    def iterlines(self):
+        line = self.readline()
+        while line:
+            yield line
+            line = self.readline()
+
+
+def make_lines(line_size, total_bytes):
+    line = '{"data": "%s"}\n' % ('x' * (line_size - 12))
+    return [line] * max(1, total_bytes // line_size)
+
+
+def reading(reader_class, data):
+    def read_lines(lines):
+        for _ in reader_class(BytesIO(data)).iterlines():
+            pass
+    return read_lines
+
+
+def main(total_megabytes=20):
+    for line_size in LINE_SIZES:
+        lines = make_lines(line_size, total_megabytes * 2**20)
+        data = ''.join(lines)
+        report('Line splitting ({} bytes lines, {} lines)'.format(line_size, len(lines)), [
+            ('concatenating 1KB chunks', measure(reading(ConcatLineReader, data), lines)),
+            ('IterIO buffered chunks', measure(reading(IterIO, data), lines)),
+        ])
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
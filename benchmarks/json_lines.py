@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Compare JsonLinesDeserializer decoding lines one by one and in batches,
+with the JSON libraries installed, over lines of typical scraped items of
+about 2KB. Then compare reading and writing them back with
+JsonExportFormatter, with decoded records and with lazy records.
+
+Usage: python -m benchmarks.json_lines [number_of_items]
+"""
+import json
+import sys
+from io import BytesIO
+
+from exporters.deserializers import JSON_DECODERS, JsonLinesDeserializer
+from exporters.exceptions import ConfigurationError
+from exporters.export_formatter.json_export_formatter import JsonExportFormatter
+from exporters.iterio import IterIO
+
+from .utils import measure, report
+
+
+BATCH_LINES = 1000
+
+
+def make_lines(count):
+    lines = []
+    for i in range(count):
+        item = {
+            '_key': 'https://www.example.com/products/%d' % i,
+            'url': 'https://www.example.com/products/%d' % i,
+            'name': 'Product %d' % i,
+            'description': 'A product description that goes on for a while. ' * 28,
+            'price': 10 + i % 100 / 10.0,
+            'currency': 'EUR',
+            'in_stock': i % 3 != 0,
+            'categories': ['home', 'kitchen', 'tools'],
+            'images': ['https://img.example.com/%d/%d.jpg' % (i, n) for n in range(8)],
+            'attributes': {'color': 'red', 'size': 'M', 'weight': '1kg', 'brand': 'ACME'},
+        }
+        lines.append(json.dumps(item) + '\n')
+    return lines
+
+
+def deserializing(data, **options):
+    deserializer = JsonLinesDeserializer({'options': options}, None)
+
+    def deserialize(lines):
+        for _ in deserializer.deserialize_with_positions(IterIO(BytesIO(data))):
+            pass
+    return deserialize
+
+
+def copying(data, **options):
+    deserializer = JsonLinesDeserializer({'options': options}, None)
+    formatter = JsonExportFormatter({}, None)
+
+    def copy(lines):
+        for item, _ in deserializer.deserialize_with_positions(IterIO(BytesIO(data))):
+            formatter.format(item)
+    return copy
+
+
+def main(count=50000):
+    lines = make_lines(count)
+    data = b''.join(lines)
+    results = []
+    for decoder in reversed(JSON_DECODERS):
+        try:
+            JsonLinesDeserializer({'options': {'decoder': decoder}}, None)
+        except ConfigurationError:
+            continue
+        results.append(('{} line by line'.format(decoder),
+                        measure(deserializing(data, decoder=decoder), lines)))
+        results.append(('{} in batches of {} lines'.format(decoder, BATCH_LINES),
+                        measure(deserializing(data, decoder=decoder, batch_lines=BATCH_LINES),
+                                lines)))
+    report('JSON lines ({} items, {} bytes per line)'.format(count, len(data) // count), results)
+    report('JSON lines read and written back ({} items)'.format(count), [
+        ('decoded records', measure(copying(data), lines)),
+        ('lazy records', measure(copying(data, lazy_records=True), lines)),
+    ])
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
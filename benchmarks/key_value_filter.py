@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Compare KeyValueFilter with its keys compiled once (nested paths split,
+operators looked up, regexes compiled and value lists turned into sets)
+against the previous implementation, which did all of that for every item.
+
+Usage: python -m benchmarks.key_value_filter [number_of_items]
+"""
+import re
+import sys
+
+from exporters.filters.key_value_filters import (KeyValueFilter, OPERATORS, DEFAULT_OPERATOR,
+                                                 nested_dict_value)
+from exporters.meta import ExportMeta
+from exporters.records.base_record import BaseRecord
+
+from .utils import measure, report
+
+
+COUNTRIES = ['es', 'uk', 'us', 'fr', 'de', 'it', 'pt', 'nl', 'be', 'se', 'no', 'dk']
+
+KEYS = {
+    'in': [{'name': 'address.country_code', 'value': COUNTRIES[:8], 'operator': 'in'}],
+    '==': [{'name': 'address.country_code', 'value': 'es'}],
+    're_match': [{'name': 'url', 'value': r'https?://[^/]+/products/\d+[05]$',
+                  'operator': 're_match'}],
+}
+
+
+class PerItemKeyValueFilter(KeyValueFilter):
+    """
+    The filtering algorithm KeyValueFilter used before compiling its keys.
+    """
+
+    def filter(self, item):
+        for key in self.keys:
+            nested_fields = key['name'].split(self.nested_field_separator)
+            try:
+                value = nested_dict_value(item, nested_fields)
+            except KeyError:
+                return False
+            op = OPERATORS[key.get('operator', DEFAULT_OPERATOR)]
+            if key.get('operator') == 're_match':
+                if not bool(re.match(key['value'], u'%s' % value)):
+                    return False
+            elif not op(value, key['value']):
+                return False
+        return True
+
+
+def make_items(count):
+    return [BaseRecord({'url': 'http://example.com/products/%d' % i,
+                        'address': {'country_code': COUNTRIES[i % len(COUNTRIES)]}})
+            for i in range(count)]
+
+
+def filtering(filter_class, keys):
+    def filter_items(items):
+        key_value_filter = filter_class({'options': {'keys': keys}}, ExportMeta(None))
+        for _ in key_value_filter.filter_batch(items):
+            pass
+    return filter_items
+
+
+def main(count=100000):
+    items = make_items(count)
+    for operator, keys in sorted(KEYS.items()):
+        report('KeyValueFilter with {} operator ({} items)'.format(operator, count), [
+            ('split and look up per item', measure(filtering(PerItemKeyValueFilter, keys), items)),
+            ('compiled keys', measure(filtering(KeyValueFilter, keys), items)),
+        ])
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
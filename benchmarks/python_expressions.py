@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Compare per-item python expression evaluation (parse, check and eval of the
+source string for every item) against the compiled expression engine used by
+PythonexpFilter, PythonexpTransform, PythonMapTransform and PythonExpGrouper.
+
+Usage: python -m benchmarks.python_expressions [number_of_items]
+"""
+import sys
+
+from exporters.python_interpreter import Interpreter, create_context, ExpressionEvaluator
+from exporters.records.base_record import BaseRecord
+
+from .utils import measure, report
+
+
+EXPRESSION = "item.get('country_code') in ['es', 'uk'] and item['price'] > 10"
+
+
+def make_items(count):
+    return [BaseRecord({'name': 'item%d' % i,
+                        'country_code': ['es', 'uk', 'us'][i % 3],
+                        'price': i % 50})
+            for i in range(count)]
+
+
+def per_item_eval(items):
+    interpreter = Interpreter()
+    for item in items:
+        context = create_context(item=item)
+        interpreter.eval(EXPRESSION, context=context)
+
+
+def compiled_eval(items):
+    evaluator = ExpressionEvaluator([EXPRESSION])
+    for item in items:
+        evaluator.eval(item)
+
+
+def main(count=100000):
+    items = make_items(count)
+    report('Python expressions ({} items)'.format(count), [
+        ('parse and eval per item', measure(per_item_eval, items)),
+        ('compiled expression', measure(compiled_eval, items)),
+    ])
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Compare deserializing every JSON line and filtering the items with a
+selective KeyValueFilter, against skipping the lines its raw line filter
+rejects before deserializing them.
+
+Usage: python -m benchmarks.raw_line_filter [number_of_items]
+"""
+import sys
+from io import BytesIO
+
+from exporters.deserializers import JsonLinesDeserializer
+from exporters.filters.key_value_filters import KeyValueFilter
+from exporters.iterio import IterIO
+from exporters.meta import ExportMeta
+
+from .json_lines import make_lines
+from .utils import measure, report
+
+
+KEYS = [{'name': 'name', 'value': ['Product 7', 'Product 1234', 'Product 4321'],
+         'operator': 'in'}]
+
+
+def filtering(data, pushdown):
+    deserializer = JsonLinesDeserializer({}, None)
+    key_value_filter = KeyValueFilter({'options': {'keys': KEYS}}, ExportMeta(None))
+    line_filter = key_value_filter.get_raw_line_filter() if pushdown else None
+
+    def filter_items(lines):
+        items = deserializer.deserialize_with_positions(IterIO(BytesIO(data)), line_filter)
+        records = (item for item, _ in items if item is not None)
+        for _ in key_value_filter.filter_batch(records):
+            pass
+    return filter_items
+
+
+def main(count=50000):
+    lines = make_lines(count)
+    data = b''.join(lines)
+    report('Selective KeyValueFilter ({} items)'.format(count), [
+        ('deserialize and filter', measure(filtering(data, False), lines)),
+        ('skip rejected raw lines', measure(filtering(data, True), lines)),
+    ])
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,26 @@
+from __future__ import print_function
+import time
+
+
+def measure(fn, items, repeat=3):
+    """
+    Run fn over items `repeat` times and return the best items/sec rate.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn(items)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(items) / best if best else float('inf')
+
+
+def report(title, results):
+    """
+    Print a table of (name, rate) pairs, relative to the first one.
+    """
+    print(title)
+    baseline = results[0][1]
+    for name, rate in results:
+        print('  {:<40} {:>14,.0f} items/sec  ({:.2f}x)'.format(name, rate, rate / baseline))
@@ -1,5 +1,6 @@
 import logging
 
+from exporters.module_loader import ModuleLoader
 from exporters.utils import read_option
 
 
@@ -43,3 +44,40 @@ class BaseBypass(object):
 
     def close(self):
         pass
+
+
+class BaseBypassState(object):
+    """
+    Persisted progress of a bypass.
+
+    The whole state is committed as the persistence position when the bypass
+    starts, and then compacted every compact_every copied files. Files copied
+    in between are appended to the persistence journal, so persisting every
+    copy doesn't depend on the number of files. Persistence modules without
+    journal support commit the whole state for every copied file.
+    """
+
+    compact_every = 1000
+
+    def __init__(self, config, metadata):
+        module_loader = ModuleLoader()
+        self.state = module_loader.load_persistence(config.persistence_options, metadata)
+        self.state_position = self.state.get_last_position()
+        self.journaled = 0
+
+    def _get_state(self):
+        raise NotImplementedError
+
+    def commit(self):
+        self.state.commit_position(self._get_state())
+        self.journaled = 0
+
+    def _commit_copied(self, entry):
+        if self.state.journal_support and self.journaled < self.compact_every:
+            self.state.append_to_journal(entry)
+            self.journaled += 1
+        else:
+            self.commit()
+
+    def delete(self):
+        self.state.delete()
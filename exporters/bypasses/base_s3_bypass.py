@@ -1,8 +1,11 @@
 import logging
+from collections import deque
 from copy import deepcopy
+from multiprocessing.pool import ThreadPool
 from exporters.bypasses.base import BaseBypass
+from exporters.default_retries import retry_short
 from exporters.bypasses.s3_bypass_state import S3BypassState
-from exporters.readers.s3_reader import get_bucket
+from exporters.readers.s3_reader import S3KeysDeleter, get_bucket
 
 
 class BaseS3Bypass(BaseBypass):
@@ -17,6 +20,15 @@ class BaseS3Bypass(BaseBypass):
         - writer has no option items_limit set in configuration.
         - writer has default items_per_buffer_write and size_per_buffer_write per default.
         - writer has default write_buffer.
+
+    Keys are copied one at a time, unless the bypass_concurrency exporter
+    option sets how many of them are copied at the same time. Every key is
+    retried on its own, and the bypass state is committed in the order keys
+    are listed, so a resumed export never skips a key that wasn't copied.
+
+    With the reader delete_keys option, copied keys are deleted in batches in
+    the background. Keys not deleted yet are kept in the bypass state, and
+    deleted when resuming.
     """
 
     def __init__(self, config, metadata):
@@ -25,6 +37,8 @@ class BaseS3Bypass(BaseBypass):
         self.set_metadata('keys_written', [])
         self.set_metadata('items_count', 0)
         self.delete_keys = config.reader_options['options'].get('delete_keys')
+        self.bypass_concurrency = config.exporter_options.get('bypass_concurrency', 0)
+        self.keys_deleter = None
 
     @classmethod
     def meets_conditions(cls, config):
@@ -68,38 +82,83 @@ class BaseS3Bypass(BaseBypass):
         self.total_items = self.bypass_state.stats['total_count']
         source_bucket = get_bucket(
             self.read_option('reader', 'bucket'), reader_aws_key, reader_aws_secret)
+        if self.delete_keys:
+            self.keys_deleter = S3KeysDeleter(source_bucket, self.logger)
+            for key_name in self.bypass_state.pending_deletes:
+                self._delete_key(source_bucket, key_name)
+            self.bypass_state.keys_deleter = self.keys_deleter
         keys_to_copy = deepcopy(self.bypass_state.pending_keys())
-        for key in keys_to_copy:
-            self._copy_key(source_bucket, key)
-            self.bypass_state.commit_copied_key(key)
-            logging.log(logging.INFO, 'Copied key {}'.format(key))
-            if self.delete_keys:
-                self.logger.debug("BaseS3Bypass: DELETING key {}".format(key))
-                self._delete_key(source_bucket, key)
+        if self.bypass_concurrency > 1:
+            self._copy_keys_concurrently(source_bucket, keys_to_copy)
+        else:
+            for key in keys_to_copy:
+                self._key_copied(source_bucket, key, self._copy_key(source_bucket, key))
+        if self.delete_keys:
+            self.keys_deleter.flush()
+
+    def _copy_keys_concurrently(self, source_bucket, keys):
+        """
+        Copy keys in a pool of bypass_concurrency threads. Copies are
+        committed in order as they finish, so a failed copy stops the bypass
+        before any later key is committed.
+        """
+        pool = ThreadPool(self.bypass_concurrency)
+        pending = deque()
+        try:
+            for key in keys:
+                if len(pending) >= 2 * self.bypass_concurrency:
+                    self._wait_for_oldest_copy(source_bucket, pending)
+                pending.append((key, pool.apply_async(self._copy_key, (source_bucket, key))))
+            while pending:
+                self._wait_for_oldest_copy(source_bucket, pending)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _wait_for_oldest_copy(self, source_bucket, pending):
+        key, result = pending.popleft()
+        self._key_copied(source_bucket, key, result.get())
+
+    def _key_copied(self, source_bucket, key_name, total):
+        if total:
+            total = int(total)
+            self.increment_items(total)
+            self.bypass_state.increment_items(total)
+            self._update_count_metadata(key_name, total)
+        else:
+            self.valid_total_count = False
+        self.bypass_state.commit_copied_key(key_name)
+        logging.log(logging.INFO, 'Copied key {}'.format(key_name))
+        if self.delete_keys:
+            self.logger.debug("BaseS3Bypass: DELETING key {}".format(key_name))
+            self._delete_key(source_bucket, key_name)
 
     def _update_count_metadata(self, key, total):
         items_count = self.get_metadata('items_count')
         items_count += total
         self.set_metadata('items_count', items_count)
 
+    @retry_short
+    def _get_key(self, source_bucket, key_name):
+        return source_bucket.get_key(key_name)
+
     def _copy_key(self, source_bucket, key_name):
-        key = source_bucket.get_key(key_name)
-        if key.get_metadata('total'):
-            total = int(key.get_metadata('total'))
-            self.increment_items(total)
-            self.bypass_state.increment_items(total)
-            self._update_count_metadata(key, total)
-        else:
-            self.valid_total_count = False
+        """
+        Copy a key, returning its items count from its metadata. With
+        bypass_concurrency, it runs in the copy pool.
+        """
+        key = self._get_key(source_bucket, key_name)
         self._copy_s3_key(key)
+        return key.get_metadata('total')
 
     def _delete_key(self, source_bucket, key_name):
-        key = source_bucket.get_key(key_name)
-        key.delete()
+        self.keys_deleter.delete(key_name)
 
     def _copy_s3_key(self, key):
         raise NotImplementedError
 
     def close(self):
+        if self.keys_deleter is not None:
+            self.keys_deleter.close()
         if self.bypass_state:
             self.bypass_state.delete()
@@ -1,42 +1,52 @@
-from exporters.module_loader import ModuleLoader
+from exporters.bypasses.base import BaseBypassState
 from exporters.readers.s3_reader import S3BucketKeysFetcher
 
 
-class S3BypassState(object):
+class S3BypassState(BaseBypassState):
 
     def __init__(self, config, metadata, aws_key, aws_secret):
+        super(S3BypassState, self).__init__(config, metadata)
         self.config = config
-        module_loader = ModuleLoader()
-        self.state = module_loader.load_persistence(config.persistence_options, metadata)
-        self.state_position = self.state.get_last_position()
+        self.done = []
+        self.delete_keys = config.reader_options['options'].get('delete_keys')
+        # Keys copied since pending was listed
+        self.copied = set()
+        # Set by the bypass when deleting keys, to persist the keys being deleted
+        self.keys_deleter = None
         if not self.state_position:
             self.pending = S3BucketKeysFetcher(
                 self.config.reader_options['options'], aws_key, aws_secret).pending_keys()
-            self.done = []
             self.skipped = []
             self.stats = {'total_count': 0}
-            self.state.commit_position(self._get_state())
+            self.pending_deletes = []
+            self.commit()
         else:
             self.pending = self.state_position['pending']
-            self.done = []
             self.skipped = self.state_position['done']
-            self.keys = self.pending
             self.stats = self.state_position.get('stats', {'total_count': 0})
+            self.pending_deletes = self.state_position.get('pending_deletes', [])
+            for key, stats in self.state.get_journal():
+                self.copied.add(key)
+                self.skipped.append(key)
+                if self.delete_keys:
+                    self.pending_deletes.append(key)
+                self.stats = stats
 
     def _get_state(self):
-        return dict(pending=self.pending, done=self.done, skipped=self.skipped,
-                    stats=self.stats)
+        if self.keys_deleter is not None:
+            pending_deletes = self.keys_deleter.pending_keys()
+        else:
+            pending_deletes = self.pending_deletes
+        return dict(pending=self.pending_keys(), done=self.done, skipped=self.skipped,
+                    stats=self.stats, pending_deletes=pending_deletes)
 
     def commit_copied_key(self, key):
-        self.pending.remove(key)
+        self.copied.add(key)
         self.done.append(key)
-        self.state.commit_position(self._get_state())
+        self._commit_copied((key, dict(self.stats)))
 
     def increment_items(self, items_number):
         self.stats['total_count'] += items_number
 
     def pending_keys(self):
-        return self.pending
-
-    def delete(self):
-        self.state.delete()
+        return [key for key in self.pending if key not in self.copied]
@@ -1,12 +1,31 @@
 import datetime
+import hashlib
 import logging
 from contextlib import closing, contextmanager
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
 from exporters.bypasses.base_s3_bypass import BaseS3Bypass
-from exporters.default_retries import retry_long
+from exporters.default_retries import initialized_retry, retry_long
 from exporters.progress_callback import BotoUploadProgress, BotoDownloadProgress
 from exporters.readers.s3_reader import get_bucket
-from exporters.utils import TmpFile, split_file, calculate_multipart_etag, CHUNK_SIZE
-from exporters.writers.s3_writer import should_use_multipart_upload, multipart_upload
+from exporters.utils import TmpFile
+from exporters.writers.s3_writer import can_complete_multipart_upload, multipart_upload
+
+
+def _is_transient_error(exception):
+    from boto.exception import S3ResponseError
+    if isinstance(exception, S3ResponseError):
+        return exception.status >= 500 or exception.status in (408, 429)
+    return True
+
+
+# retry_long, except for client errors such as denied requests, which fall
+# back to other ways of copying right away
+retry_long_on_transient_errors = initialized_retry(
+    wait_exponential_multiplier=5000,
+    stop_max_attempt_number=8,
+    retry_on_exception=_is_transient_error,
+)
 
 
 def _add_permissions(user_id, key):
@@ -61,11 +80,18 @@ class S3Bypass(BaseS3Bypass):
     This bypass tries to directly copy the S3 keys between the read and write buckets. If
     is is not possible due to permission issues, it will download the key from the read bucket
     and directly upload it to the write bucket.
+
+    Keys bigger than the writer multipart_part_size are copied as multipart uploads, with
+    multipart_concurrency parts copied at the same time. Without permissions to copy them,
+    those parts are downloaded into memory and uploaded.
     """
 
     def __init__(self, config, metadata):
         super(S3Bypass, self).__init__(config, metadata)
         self.bypass_state = None
+        self.dest_user_id = None
+        self.part_size = self.read_option('writer', 'multipart_part_size')
+        self.multipart_concurrency = max(1, self.read_option('writer', 'multipart_concurrency'))
         self.logger = logging.getLogger('bypass_logger')
         self.logger.setLevel(logging.INFO)
 
@@ -104,22 +130,33 @@ class S3Bypass(BaseS3Bypass):
         filebase = datetime.datetime.now().strftime(filebase)
         self._write_s3_pointer(dest_bucket, save_pointer, filebase)
 
-    def _ensure_copy_key(self, dest_bucket, dest_key_name, source_bucket, key_name):
+    def _get_dest_user_id(self, dest_bucket):
+        if self.dest_user_id is None:
+            self.dest_user_id = dest_bucket.connection.get_canonical_user_id()
+        return self.dest_user_id
+
+    def _ensure_copy_key(self, dest_bucket, dest_key_name, key):
         from boto.exception import S3ResponseError
-        key = source_bucket.get_key(key_name)
         try:
-            user_id = dest_bucket.connection.get_canonical_user_id()
+            user_id = self._get_dest_user_id(dest_bucket)
+            copy_in_parts = self._should_copy_in_parts(key, dest_bucket)
             with key_permissions(user_id, key):
-                dest_bucket.copy_key(dest_key_name, source_bucket.name, key_name)
+                if copy_in_parts:
+                    self._copy_key_in_parts(dest_bucket, dest_key_name, key)
+                else:
+                    dest_bucket.copy_key(dest_key_name, key.bucket.name, key.name)
         except S3ResponseError as e:
-            self.logger.warning('No direct copy supported for key {}.'.format(key_name))
+            self.logger.warning('No direct copy supported for key {}.'.format(key.name))
             self.logger.warning("Message: %s, Error code: %s, Reason: %s, Status: %s, Body: %s",
                                 e.message,
                                 e.error_code, e.reason,
                                 e.status, e.body)
-            self._copy_without_permissions(dest_bucket, dest_key_name, source_bucket, key_name)
+            self._copy_without_permissions(dest_bucket, dest_key_name, key)
         else:
-            self._check_copy_integrity(key, dest_bucket, dest_key_name)
+            if copy_in_parts:
+                self._check_copy_size(key, dest_bucket, dest_key_name)
+            else:
+                self._check_copy_integrity(key, dest_bucket, dest_key_name)
         # Using a second try catch, as they are independent operations
         try:
             dest_key = dest_bucket.get_key(dest_key_name)
@@ -128,6 +165,39 @@ class S3Bypass(BaseS3Bypass):
             self.logger.warning(
                 'Skipping key permissions set. We have no READ_ACP/WRITE_ACP permissions')
 
+    def _should_copy_in_parts(self, key, dest_bucket):
+        return key.size > self.part_size and can_complete_multipart_upload(dest_bucket)
+
+    def _get_part_ranges(self, size):
+        """
+        Yields the number, first and last byte of every part of a key of the given size.
+        """
+        for part_num, start in enumerate(xrange(0, size, self.part_size), 1):
+            yield part_num, start, min(start + self.part_size, size) - 1
+
+    def _run_for_parts(self, function, mp, key):
+        """
+        Calls function(mp, key, part_num, start, end) for every part of key, in
+        a pool of multipart_concurrency threads. Returns their results in order.
+        """
+        pool = ThreadPool(self.multipart_concurrency)
+        try:
+            results = [pool.apply_async(function, (mp, key) + part_range)
+                       for part_range in self._get_part_ranges(key.size)]
+            return [result.get() for result in results]
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @retry_long_on_transient_errors
+    def _copy_part(self, mp, key, part_num, start, end):
+        mp.copy_part_from_key(key.bucket.name, key.name, part_num, start, end)
+
+    def _copy_key_in_parts(self, dest_bucket, dest_key_name, key):
+        self.logger.info('Using multipart S3 copy for key {}'.format(key.name))
+        with multipart_upload(dest_bucket, dest_key_name, metadata=key.metadata) as mp:
+            self._run_for_parts(self._copy_part, mp, key)
+
     def _warn_if_etags_differ(self, source_key, dest_key, source_md5=None):
         source_md5 = source_md5 or source_key.etag
         if source_md5 != dest_key.etag:
@@ -144,6 +214,17 @@ class S3Bypass(BaseS3Bypass):
             self.logger.warning(
                 'Skipping copy integrity. We have no READ_ACP/WRITE_ACP permissions')
 
+    def _check_copy_size(self, source_key, dest_bucket, dest_key_name):
+        # Multipart copies get a new ETag, so only their size can be checked
+        from boto.exception import S3ResponseError
+        try:
+            dest_key = dest_bucket.get_key(dest_key_name)
+            if dest_key.size != source_key.size:
+                self.logger.warn('Size of key {} differs from destination key {}: {} != {}'.format(
+                    source_key.name, dest_key.name, source_key.size, dest_key.size))
+        except S3ResponseError:
+            self.logger.warning('Skipping copy integrity. We have no READ permissions')
+
     def _ensure_proper_key_permissions(self, key):
         key.set_acl('bucket-owner-full-control')
 
@@ -164,17 +245,24 @@ class S3Bypass(BaseS3Bypass):
         return md5
 
     @retry_long
-    def _upload_chunk(self, mp, chunk):
-        mp.upload_part_from_file(chunk.bytes, part_num=chunk.number)
-
-    def _upload_large_file(self, bucket, dump_path, key_name):
+    def _upload_part_from_key(self, mp, key, part_num, start, end):
+        # Keys keep the state of their last request, so every thread uses its own
+        source_key = key.bucket.new_key(key.name)
+        data = source_key.get_contents_as_string(
+            headers={'Range': 'bytes={}-{}'.format(start, end)})
+        mp.upload_part_from_file(BytesIO(data), part_num=part_num)
+        self.logger.info('Uploaded part number {} of key {}'.format(part_num, key.name))
+        return hashlib.md5(data).digest()
+
+    def _upload_key_in_parts(self, bucket, key_name, key):
+        """
+        Uploads a key as a multipart upload, downloading its parts into memory.
+        Returns the ETag of the upload.
+        """
         from boto.exception import S3ResponseError
         self.logger.info('Using multipart S3 uploader')
         with multipart_upload(bucket, key_name) as mp:
-            for chunk in split_file(dump_path):
-                self._upload_chunk(mp, chunk)
-                self.logger.info(
-                    'Uploaded chunk number {}'.format(chunk.number))
+            digests = self._run_for_parts(self._upload_part_from_key, mp, key)
         try:
             with closing(bucket.get_key(key_name)) as key:
                 self._ensure_proper_key_permissions(key)
@@ -182,31 +270,30 @@ class S3Bypass(BaseS3Bypass):
             self.logger.warning(
                 'We could not ensure proper permissions. '
                 'We have no READ_ACP/WRITE_ACP permissions')
+        return '"%s-%s"' % (hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
 
-    def _check_multipart_copy_integrity(self, key, dest_bucket, dest_key_name, path):
+    def _check_multipart_copy_integrity(self, key, dest_bucket, dest_key_name, md5):
         from boto.exception import S3ResponseError
         try:
             dest_key = dest_bucket.get_key(dest_key_name)
-            md5 = calculate_multipart_etag(path, CHUNK_SIZE)
             self._warn_if_etags_differ(key, dest_key, source_md5=md5)
         except S3ResponseError:
             self.logger.warning(
                 'Skipping copy integrity. We have no READ_ACP/WRITE_ACP permissions')
 
-    def _copy_without_permissions(self, dest_bucket, dest_key_name, source_bucket, key_name):
-        key = source_bucket.get_key(key_name)
-        with TmpFile() as tmp_filename:
-            download_progress = BotoDownloadProgress(self.logger)
-            key.get_contents_to_filename(tmp_filename, cb=download_progress)
-            if should_use_multipart_upload(tmp_filename, dest_bucket):
-                self._upload_large_file(dest_bucket, tmp_filename, dest_key_name)
-                self._check_multipart_copy_integrity(key, dest_bucket, dest_key_name, tmp_filename)
-            else:
+    def _copy_without_permissions(self, dest_bucket, dest_key_name, key):
+        if self._should_copy_in_parts(key, dest_bucket):
+            md5 = self._upload_key_in_parts(dest_bucket, dest_key_name, key)
+            self._check_multipart_copy_integrity(key, dest_bucket, dest_key_name, md5)
+        else:
+            with TmpFile() as tmp_filename:
+                download_progress = BotoDownloadProgress(self.logger)
+                key.get_contents_to_filename(tmp_filename, cb=download_progress)
                 dest_key = dest_bucket.new_key(dest_key_name)
                 progress = BotoUploadProgress(self.logger)
                 md5 = self._get_md5(key, tmp_filename)
                 dest_key.set_contents_from_filename(tmp_filename, cb=progress, md5=md5)
-                self._check_copy_integrity(key, dest_bucket, dest_key_name)
+            self._check_copy_integrity(key, dest_bucket, dest_key_name)
         self.logger.info('Uploaded key {}'.format(dest_key_name))
 
     def _update_metadata(self, dest_key_name, total):
@@ -222,13 +309,9 @@ class S3Bypass(BaseS3Bypass):
     @retry_long
     def _copy_s3_key(self, key):
         dest_key_name = self.get_dest_key_name(key.name)
-        self._ensure_copy_key(self.dest_bucket, dest_key_name, key.bucket, key.name)
+        self._ensure_copy_key(self.dest_bucket, dest_key_name, key)
         self._update_metadata(dest_key_name, key.get_metadata('total'))
 
-    def close(self):
-        if self.bypass_state:
-            self.bypass_state.delete()
-
     def get_dest_key_name(self, name):
         file_name = name.split('/')[-1]
         return '{}{}'.format(self.dest_filebase, file_name)
@@ -2,27 +2,29 @@ import logging
 from collections import namedtuple
 from contextlib import closing
 
-from exporters.bypasses.base import BaseBypass
+from exporters.bypasses.base import BaseBypass, BaseBypassState
 from exporters.module_loader import ModuleLoader
 from exporters.iterio import cohere_stream
 
 Stream = namedtuple('Stream', 'filename size meta')
 
 
-class StreamBypassState(object):
+class StreamBypassState(BaseBypassState):
     def __init__(self, config, metadata):
-        module_loader = ModuleLoader()
-        self.state = module_loader.load_persistence(config.persistence_options, metadata)
-        self.state_position = self.state.get_last_position()
+        super(StreamBypassState, self).__init__(config, metadata)
+        self.done = []
         if not self.state_position:
-            self.done = []
             self.skipped = []
             self.stats = {'bytes_copied': 0}
-            self.state.commit_position(self._get_state())
+            self.commit()
         else:
-            self.done = []
-            self.skipped = self.state_position['done']
+            # Streams copied before the last resume are kept as skipped
+            self.skipped = self.state_position.get('skipped', []) + self.state_position['done']
             self.stats = self.state_position.get('stats', {'bytes_copied': 0})
+            for stream, stats in self.state.get_journal():
+                self.skipped.append(stream)
+                self.stats = stats
+        self.skipped_streams = set(self.skipped)
 
     def _get_state(self):
         return dict(done=self.done, skipped=self.skipped, stats=self.stats)
@@ -30,13 +32,13 @@ class StreamBypassState(object):
     def commit_copied(self, stream):
         self.increment_bytes(stream.size)
         self.done.append(stream)
-        self.state.commit_position(self._get_state())
+        self._commit_copied((stream, dict(self.stats)))
 
     def increment_bytes(self, cnt):
         self.stats['bytes_copied'] += cnt
 
-    def delete(self):
-        self.state.delete()
+    def is_skipped(self, stream):
+        return stream in self.skipped_streams
 
 
 class StreamBypass(BaseBypass):
@@ -116,7 +118,7 @@ class StreamBypass(BaseBypass):
         writer = module_loader.load_writer(self.config.writer_options, self.metadata)
         with closing(reader), closing(writer):
             for stream in reader.get_read_streams():
-                if stream not in self.bypass_state.skipped:
+                if not self.bypass_state.is_skipped(stream):
                     file_obj = cohere_stream(reader.open_stream(stream))
                     logging.log(logging.INFO, 'Starting to copy file {}'.format(stream.filename))
                     try:
@@ -34,6 +34,12 @@ FILE_COMPRESSION = {
     'none': lambda path: open(path, 'a'),
 }
 
+# Compressors writing their output to an already open file object
+STREAM_COMPRESSION = {
+    'gz': lambda fileobj: gzip.GzipFile(fileobj.name, 'ab', fileobj=fileobj),
+    'none': lambda fileobj: fileobj,
+}
+
 
 try:
     from bz2file import BZ2File
@@ -42,3 +48,4 @@ except ImportError:
     logging.info('Install bz2file to enable BZ2 compression.')
 else:
     FILE_COMPRESSION['bz2'] = lambda path: BZ2File(path, 'a')
+    STREAM_COMPRESSION['bz2'] = lambda fileobj: BZ2File(fileobj, 'a')
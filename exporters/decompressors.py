@@ -1,15 +1,43 @@
+from exporters.iterio import IterIO
 from exporters.pipeline.base_pipeline_item import BasePipelineItem
+from collections import deque
+from io import BytesIO
+from itertools import chain
+from multiprocessing.pool import ThreadPool
+from exporters.exceptions import ConfigurationError
+import bz2
+import re
 import sys
 import zlib
 import six
 
-__all__ = ['BaseDecompressor', 'ZLibDecompressor', 'NoDecompressor']
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+__all__ = ['BaseDecompressor', 'ZLibDecompressor', 'ZstdDecompressor', 'LZ4Decompressor',
+           'Bz2Decompressor', 'AutoDecompressor', 'NoDecompressor']
 
 
 class BaseDecompressor(BasePipelineItem):
     def decompress(self):
         raise NotImplementedError()
 
+    def decompress_with_offsets(self, stream):
+        """
+        Like decompress, but yields (chunk, offset) pairs. offset is the
+        position in the compressed stream where decompression can be
+        restarted from after that chunk, or None if it can't.
+        """
+        for chunk in self.decompress(stream):
+            yield chunk, None
+
 
 def create_decompressor():
     # create zlib decompressor enabling automatic header detection:
@@ -18,24 +46,358 @@ def create_decompressor():
     return zlib.decompressobj(AUTOMATIC_HEADER_DETECTION_MASK | zlib.MAX_WBITS)
 
 
-class ZLibDecompressor(BaseDecompressor):
+GZIP_MAGIC = b'\x1f\x8b\x08'
+GZIP_HEADER_SIZE = 10
+
+
+def find_gzip_member(data, start=0):
+    """
+    Returns the position of the first gzip member header found in data from
+    start, or -1 if there is none. Compressed data may happen to look like a
+    header, so a position returned is only a candidate member start.
+    """
+    index = data.find(GZIP_MAGIC, start)
+    while 0 <= index <= len(data) - GZIP_HEADER_SIZE:
+        header = bytearray(data[index:index + GZIP_HEADER_SIZE])
+        flags, extra_flags, os_type = header[3], header[8], header[9]
+        if not flags & 0xe0 and extra_flags in (0, 2, 4) and (os_type <= 13 or os_type == 255):
+            return index
+        index = data.find(GZIP_MAGIC, index + 1)
+    return -1
+
+
+def decompress_members(stream, create=create_decompressor):
+    """
+    Decompresses the members in stream one after another, with a new
+    decompressor from create() for every member, yielding (chunk, offset)
+    pairs as decompress_with_offsets does. Decompressors tell where their
+    member ends with unused_data, and with eof or by raising EOFError if it
+    ends with a chunk.
+    """
+    dec = create()
+    for chunk in stream:
+        try:
+            rv = dec.decompress(chunk)
+        except EOFError:
+            stream.unshift(chunk)
+            dec = create()
+            yield b'', stream.tell()
+            continue
+        if dec.unused_data:
+            stream.unshift(dec.unused_data)
+            dec = create()
+            yield rv, stream.tell()
+        elif getattr(dec, 'eof', False):
+            dec = create()
+            yield rv, stream.tell()
+        elif rv:
+            yield rv, None
+
+
+def inflate_segment(segment, lookahead):
+    """
+    Inflates the gzip members in a segment of the compressed stream, returning
+    the list of (chunk, offset) pairs, with offsets relative to the segment,
+    and whether the segment held whole members. That is known when the last
+    member ends right where the lookahead bytes, the start of the next
+    segment, begin. The last segment has no lookahead.
+    """
+    chunks = []
+    try:
+        for chunk, offset in decompress_members(IterIO(BytesIO(segment + lookahead))):
+            chunks.append((chunk, offset))
+    except zlib.error:
+        return chunks, False
+    if not lookahead:
+        return chunks, True
+    return chunks, bool(chunks) and chunks[-1][1] == len(segment)
+
+
+class _SerialFallback(Exception):
+    def __init__(self, offset, segments):
+        super(_SerialFallback, self).__init__()
+        self.offset = offset
+        self.segments = segments
+
+
+class MembersDecompressor(BaseDecompressor):
+    """
+    Base class of decompressors of formats whose streams may be made of several
+    concatenated members, such as gzip members or bz2 streams. Decompression
+    can be restarted at the start of every member.
+    """
+
+    def create_decompressor(self):
+        """
+        Returns a new decompressor object for a single member
+        """
+        raise NotImplementedError()
+
     def decompress(self, stream):
+        for chunk, _ in self.decompress_with_offsets(stream):
+            if chunk:
+                yield chunk
+
+    def decompress_with_offsets(self, stream):
+        return decompress_members(stream, self.create_decompressor)
+
+
+class ZLibDecompressor(MembersDecompressor):
+    """
+    Decompresses zlib and gzip streams, which may be made of several
+    concatenated members.
+
+        - threads (int)
+            Number of threads inflating gzip members in parallel. The stream is
+            split in segments at gzip member headers, which are inflated on a
+            thread pool and yielded in order. If a segment turns out not to be
+            made of whole members (a member bigger than max_buffered_segments
+            segments, a header look alike inside compressed data or zlib
+            input), the rest of the stream is inflated serially. 0 or 1 inflate
+            all of it serially
+
+        - segment_size (int)
+            Minimum size in bytes of the compressed segments inflated by each
+            thread
+    """
+    supported_options = {
+        'threads': {'type': six.integer_types, 'default': 0},
+        'segment_size': {'type': six.integer_types, 'default': 2**20},
+    }
+
+    # Compressed bytes buffered without finding a member header, in segments,
+    # before inflating the stream serially
+    max_buffered_segments = 8
+
+    def __init__(self, *args, **kwargs):
+        super(ZLibDecompressor, self).__init__(*args, **kwargs)
+        self.threads = self.read_option('threads')
+        self.segment_size = self.read_option('segment_size')
+
+    def create_decompressor(self):
+        return create_decompressor()
+
+    def decompress_with_offsets(self, stream):
         try:
-            dec = create_decompressor()
-            for chunk in stream:
-                rv = dec.decompress(chunk)
-                if rv:
-                    yield rv
-                if dec.unused_data:
-                    stream.unshift(dec.unused_data)
-                    dec = create_decompressor()
+            if self.threads > 1:
+                for chunk in self._decompress_in_parallel(stream):
+                    yield chunk
+            else:
+                for chunk in decompress_members(stream):
+                    yield chunk
         except zlib.error as e:
             msg = str(e)
             if msg.startswith('Error -3 '):
                 msg += ". Use NoDecompressor if you're using uncompressed input."
             six.reraise(zlib.error, zlib.error(msg), sys.exc_info()[2])
 
+    def _decompress_in_parallel(self, stream):
+        pool = ThreadPool(self.threads)
+        pending = deque()
+        buf = bytearray()
+        start = stream.tell()
+        scan_from = self.segment_size
+
+        def submit(segment, lookahead):
+            result = pool.apply_async(inflate_segment, (segment, lookahead))
+            pending.append((start, segment, result))
+
+        try:
+            try:
+                for data in stream:
+                    buf += data
+                    index = find_gzip_member(buf, scan_from)
+                    while index >= 0:
+                        segment = bytes(buf[:index])
+                        del buf[:index]
+                        submit(segment, bytes(buf[:GZIP_HEADER_SIZE]))
+                        start += index
+                        index = find_gzip_member(buf, self.segment_size)
+                    # Headers at the end of the buffer are checked when complete
+                    scan_from = max(self.segment_size, len(buf) - GZIP_HEADER_SIZE + 1)
+                    for chunk in self._inflated(pending, 2 * self.threads):
+                        yield chunk
+                    if len(buf) > self.max_buffered_segments * self.segment_size:
+                        offset = pending[0][0] if pending else start
+                        raise _SerialFallback(offset, [entry[1] for entry in pending])
+                submit(bytes(buf), b'')
+                del buf[:]
+                for chunk in self._inflated(pending, 0):
+                    yield chunk
+            except _SerialFallback as fallback:
+                head = b''.join(fallback.segments) + bytes(buf)
+                rest = IterIO(chain(IterIO(BytesIO(head)), stream))
+                for chunk, offset in decompress_members(rest):
+                    yield chunk, None if offset is None else fallback.offset + offset
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _inflated(self, pending, keep):
+        # Chunks are yielded as segments are taken from pending, so the ones
+        # of the segments before an incomplete one are never lost
+        while len(pending) > keep:
+            start, _, result = pending[0]
+            inflated, complete = result.get()
+            if not complete:
+                raise _SerialFallback(start, [entry[1] for entry in pending])
+            pending.popleft()
+            for chunk, offset in inflated:
+                yield chunk, None if offset is None else start + offset
+
+
+class ZstdDecompressor(MembersDecompressor):
+    """
+    Decompresses Zstandard streams, which may be made of several frames.
+    Needs zstandard 0.18 or later, the first version telling where a frame
+    ends (older ones silently drop the frames after the first one). It only
+    supports python 3.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ZstdDecompressor, self).__init__(*args, **kwargs)
+        if zstandard is None:
+            raise ConfigurationError('Install zstandard to decompress zstd streams')
+        self.zstd = zstandard.ZstdDecompressor()
+        if not hasattr(self.create_decompressor(), 'unused_data'):
+            raise ConfigurationError(
+                'zstandard 0.18 or later is needed to decompress zstd streams, '
+                'found {}'.format(zstandard.__version__))
+
+    def create_decompressor(self):
+        return self.zstd.decompressobj()
+
+
+class LZ4Decompressor(MembersDecompressor):
+    """
+    Decompresses LZ4 frame streams, which may be made of several frames.
+    Needs lz4 0.19 or later, the first version telling where a frame ends.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LZ4Decompressor, self).__init__(*args, **kwargs)
+        if lz4_frame is None:
+            raise ConfigurationError('Install lz4 to decompress lz4 streams')
+        if not hasattr(self.create_decompressor(), 'unused_data'):
+            raise ConfigurationError(
+                'lz4 0.19 or later is needed to decompress lz4 streams')
+
+    def create_decompressor(self):
+        return lz4_frame.LZ4FrameDecompressor()
+
+
+class Bz2Decompressor(MembersDecompressor):
+    """
+    Decompresses bz2 streams, which may be made of several concatenated streams.
+    """
+
+    def create_decompressor(self):
+        return bz2.BZ2Decompressor()
+
+
+def is_zlib_header(head):
+    """
+    Whether head starts with a zlib header followed by valid compressed data.
+    Many text lines start with a valid header (e.g. "H,id"), so the data after
+    it is decompressed too, which fails for text most of the time.
+    """
+    header = bytearray(head[:2])
+    if len(header) < 2 or header[0] & 0x0f != 8 or (header[0] << 8 | header[1]) % 31:
+        return False
+    try:
+        zlib.decompressobj().decompress(head)
+    except zlib.error:
+        return False
+    return True
+
+
+# A bz2 stream header followed by the magic of its first block, or the end of
+# stream magic if it's empty
+BZ2_HEADER = re.compile(b'BZh[1-9](1AY&SY|\x17rE8P\x90)')
+
+# Decompressors for the streams starting with the given magic bytes
+MAGIC_DECOMPRESSORS = [
+    (b'\x1f\x8b', ZLibDecompressor),
+    (b'\x28\xb5\x2f\xfd', ZstdDecompressor),
+    (b'\x04\x22\x4d\x18', LZ4Decompressor),
+]
+
+
+def detect_decompressor(head):
+    """
+    Returns the decompressor class for a stream starting with the given
+    bytes, or NoDecompressor if they don't match any known format.
+    """
+    for magic, decompressor_class in MAGIC_DECOMPRESSORS:
+        if head.startswith(magic):
+            return decompressor_class
+    if BZ2_HEADER.match(head):
+        return Bz2Decompressor
+    if is_zlib_header(head):
+        return ZLibDecompressor
+    return NoDecompressor
+
+
+class AutoDecompressor(BaseDecompressor):
+    """
+    Detects the format of every stream from its first bytes and decompresses
+    it accordingly, so streams in different formats can be read together.
+    gzip, zlib, zstd, lz4 and bz2 streams are detected, and other streams are
+    taken as uncompressed. Decompressors needing packages which are not
+    installed fail when a stream in their format is found.
+
+    The options are passed on to the decompressors of the detected formats
+    supporting them:
+
+        - threads (int)
+            Number of threads inflating gzip members in parallel. See
+            ZLibDecompressor
+
+        - segment_size (int)
+            Minimum size in bytes of the compressed segments inflated by each
+            thread. See ZLibDecompressor
+    """
+    supported_options = ZLibDecompressor.supported_options
+
+    # Bytes read from every stream to detect its format
+    head_size = 1024
+
+    def __init__(self, *args, **kwargs):
+        super(AutoDecompressor, self).__init__(*args, **kwargs)
+        self.decompressors = {}
+
+    def get_decompressor(self, stream):
+        head = stream.read(self.head_size)
+        stream.unshift(head)
+        decompressor_class = detect_decompressor(head)
+        if decompressor_class not in self.decompressors:
+            options = {name: value for name, value in self.options.items()
+                       if name in decompressor_class.supported_options}
+            self.decompressors[decompressor_class] = decompressor_class(
+                {'options': options}, self.metadata)
+        return self.decompressors[decompressor_class]
+
+    def decompress(self, stream):
+        return self.get_decompressor(stream).decompress(stream)
+
+    def decompress_with_offsets(self, stream):
+        return self.get_decompressor(stream).decompress_with_offsets(stream)
+
 
 class NoDecompressor(BaseDecompressor):
     def decompress(self, stream):
         return stream  # Input already uncompressed
+
+    def decompress_with_offsets(self, stream):
+        # Uncompressed streams can be restarted from any line, so chunks are
+        # split at line ends to report all of them
+        for chunk in stream:
+            chunk_offset = stream.tell() - len(chunk)
+            start = 0
+            end = chunk.find(b'\n') + 1
+            while end:
+                yield chunk[start:end], chunk_offset + end
+                start = end
+                end = chunk.find(b'\n', start) + 1
+            if start < len(chunk):
+                yield chunk[start:], None
@@ -1,20 +1,142 @@
+from importlib import import_module
+from exporters.exceptions import ConfigurationError
 from exporters.pipeline.base_pipeline_item import BasePipelineItem
 from exporters.records.base_record import BaseRecord
-import json
+from exporters.records.lazy_record import LazyRecord
 import csv
+import six
 
 __all__ = ['BaseDeserializer', 'JsonLinesDeserializer', 'CSVDeserializer']
 
 
 class BaseDeserializer(BasePipelineItem):
+    # Whether items can be read from any item boundary of a stream, so
+    # readers can resume reading streams from a byte offset
+    resumable = False
+
     def deserialize(self, stream):
         raise NotImplementedError()
 
+    def deserialize_with_positions(self, stream, line_filter=None):
+        """
+        Like deserialize, but yields (item, position) pairs, where position
+        is the stream position where the item ends.
+
+        line_filter is an optional function telling whether a raw line may
+        hold an item worth deserializing. Deserializers supporting it yield
+        None instead of the items of rejected lines.
+        """
+        for item in self.deserialize(stream):
+            yield item, stream.tell()
+
+
+# JSON libraries that can decode lines, in the order "auto" tries them
+JSON_DECODERS = ['ujson', 'orjson', 'rapidjson', 'simplejson', 'json']
+
+
+def get_json_decoder(name):
+    """
+    Returns the loads function of the given JSON library, or of the first
+    one installed if name is "auto".
+    """
+    if name == 'auto':
+        for decoder in JSON_DECODERS:
+            try:
+                return get_json_decoder(decoder)
+            except ConfigurationError:
+                pass
+    if name not in JSON_DECODERS:
+        raise ConfigurationError('Unknown JSON decoder {}. Use one of: {}'.format(
+            name, ', '.join(JSON_DECODERS + ['auto'])))
+    try:
+        return import_module(name).loads
+    except ImportError:
+        raise ConfigurationError('JSON decoder {} is not installed'.format(name))
+
 
 class JsonLinesDeserializer(BaseDeserializer):
+    """
+    Deserializes streams of JSON objects, one per line.
+
+        - decoder (str)
+            JSON library used to decode lines: json (the standard library),
+            ujson, orjson, rapidjson or simplejson. "auto" uses the first
+            of them that is installed, in that order
+
+        - batch_lines (int)
+            Number of lines to decode at once, as a single JSON array. Decoders
+            with a high cost per call are faster this way. 0 decodes lines one by one
+
+        - lazy_records (bool)
+            Return LazyRecord items, which only decode their line when their fields
+            are accessed, and can be written back as read by JsonExportFormatter
+            if they aren't changed. Records are decoded before being written at
+            the latest, so invalid lines still raise errors
+    """
+    resumable = True
+
+    supported_options = {
+        'decoder': {'type': six.string_types, 'default': 'json'},
+        'batch_lines': {'type': six.integer_types, 'default': 0},
+        'lazy_records': {'type': bool, 'default': False},
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(JsonLinesDeserializer, self).__init__(*args, **kwargs)
+        self.loads = get_json_decoder(self.read_option('decoder'))
+        self.batch_lines = self.read_option('batch_lines')
+        self.lazy_records = self.read_option('lazy_records')
+
     def deserialize(self, stream):
-        for line in stream.iterlines():
-            yield BaseRecord(json.loads(line))
+        for item, _ in self.deserialize_with_positions(stream):
+            yield item
+
+    def deserialize_with_positions(self, stream, line_filter=None):
+        loads = self.loads
+        lines = stream.iterlines()
+        if line_filter is not None:
+            lines = (line if line_filter(line) else None for line in lines)
+        if self.lazy_records:
+            for line in lines:
+                yield None if line is None else LazyRecord(line, loads), stream.tell()
+            return
+        if not self.batch_lines:
+            for line in lines:
+                yield None if line is None else BaseRecord(loads(line)), stream.tell()
+            return
+        batch = []
+        positions = []
+        for line in lines:
+            batch.append(line)
+            positions.append(stream.tell())
+            if len(batch) >= self.batch_lines:
+                for item in zip(self._decode_batch(batch), positions):
+                    yield item
+                batch = []
+                positions = []
+        for item in zip(self._decode_batch(batch), positions):
+            yield item
+
+    def _decode_batch(self, batch):
+        """
+        Decodes a batch of lines, where lines rejected by the line filter
+        are None, returning their records or None.
+        """
+        records = iter(self._decode_lines([line for line in batch if line is not None]))
+        return [None if line is None else next(records) for line in batch]
+
+    def _decode_lines(self, lines):
+        if not lines:
+            return []
+        try:
+            values = self.loads(b'[' + b','.join(lines) + b']')
+        except ValueError:
+            # Decode them one by one to raise the error of the wrong line
+            values = [self.loads(line) for line in lines]
+        if len(values) != len(lines):
+            # Some line didn't hold exactly one value
+            values = [self.loads(line) for line in lines]
+        return [BaseRecord(value) for value in values]
 
 
 class CSVDeserializer(BaseDeserializer):
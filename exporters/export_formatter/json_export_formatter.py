@@ -1,6 +1,8 @@
 import json
 import datetime
+import six
 from exporters.export_formatter.base_export_formatter import BaseExportFormatter
+from exporters.records.lazy_record import LazyRecord
 
 
 def default(o):
@@ -17,6 +19,9 @@ class JsonExportFormatter(BaseExportFormatter):
         - pretty_print(bool)
             If set to True, items will be exported with an ident of 2 and keys sorted, they
             will exported with a text line otherwise.
+
+    Unchanged LazyRecord items are written back as they were read, unless
+    pretty_print is set.
     """
 
     supported_options = {
@@ -35,6 +40,11 @@ class JsonExportFormatter(BaseExportFormatter):
             self.item_separator = ',\n'
 
     def format(self, item):
+        if isinstance(item, LazyRecord):
+            if item.raw is not None and not self.pretty_print:
+                raw = item.raw.rstrip(b'\r\n')
+                return raw if six.PY2 else raw.decode('utf-8')
+            item.decode()
         options = dict(indent=2, sort_keys=True) if self.pretty_print else dict()
         return json.dumps(item, default=default, **options)
 
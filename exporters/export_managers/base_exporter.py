@@ -1,19 +1,25 @@
 import datetime
 import traceback
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from contextlib import closing
+from copy import deepcopy
+from multiprocessing import Pool
 from exporters.default_retries import disable_retries
+from exporters.exceptions import ConfigurationError
+from exporters.export_managers.pipeline_workers import init_worker, process_batch
 from exporters.exporter_config import ExporterConfig
 from exporters.logger.base_logger import ExportManagerLogger
 from exporters.meta import ExportMeta
 from exporters.module_loader import ModuleLoader
 from exporters.notifications.notifiers_list import NotifiersList
 from exporters.notifications.receiver_groups import CLIENTS, TEAM
+from exporters.records.lazy_record import decode_records
 from exporters.writers.base_writer import ItemsLimitReached
 from exporters.readers.base_stream_reader import is_stream_reader
-from six.moves.queue import Queue
-from threading import Thread
-import time
+from exporters.export_managers.pipeline_queue import PipelineQueue, END_OF_QUEUE
+from threading import Event, Thread
+import six
+import sys
 
 
 class BaseExporter(object):
@@ -21,6 +27,10 @@ class BaseExporter(object):
         self.config = ExporterConfig(configuration)
         self.threaded = self.config.exporter_options.get('threaded', False)
         self.queue_size = self.config.exporter_options.get('thread_queue_size', 100)
+        # Number of processes running filters, transform and grouper. Every
+        # process has its own copy of them, so filters keeping state across
+        # items (e.g. DupeFilter) are not supported with more than one
+        self.workers = self.config.exporter_options.get('workers', 0)
         self.logger = ExportManagerLogger(self.config.log_options)
         self.module_loader = ModuleLoader()
         metadata = ExportMeta(configuration)
@@ -36,10 +46,13 @@ class BaseExporter(object):
             self.reader.decompressor = decompressor
         self.filter_before = self.module_loader.load_filter(
             self.config.filter_before_options, metadata)
+        if is_stream_reader(self.reader):
+            self.reader.raw_line_filter = self.filter_before.get_raw_line_filter()
         self.filter_after = self.module_loader.load_filter(
             self.config.filter_after_options, metadata)
         self.transform = self.module_loader.load_transform(
             self.config.transform_options, metadata)
+        self._check_workers_support()
         self.export_formatter = self.module_loader.load_formatter(
             self.config.formatter_options, metadata)
         self.writer = self.module_loader.load_writer(
@@ -55,6 +68,17 @@ class BaseExporter(object):
         self.stats_manager = self.module_loader.load_stats_manager(
             self.config.stats_options, metadata)
         self.bypass_cases = []
+        # Reader positions waiting for the writer uploads they depend on
+        self.uncommitted_positions = deque()
+
+    def _check_workers_support(self):
+        if self.workers <= 1:
+            return
+        for name in ('filter_before', 'filter_after'):
+            if getattr(self, name).stateful:
+                raise ConfigurationError(
+                    '{} {} keeps state across items, so it can not be used with '
+                    'workers'.format(name, getattr(self, name).__class__.__name__))
 
     def _run_pipeline_iteration(self):
         times = OrderedDict([('started', datetime.datetime.now())])
@@ -73,10 +97,11 @@ class BaseExporter(object):
         next_batch = self.grouper.group_batch(next_batch)
         times.update(grouped=datetime.datetime.now())
         try:
-            self.writer.write_batch(batch=next_batch)
+            # Writers may read items as plain dicts, and lazy records
+            # with invalid JSON must fail instead of being written back
+            self.writer.write_batch(batch=decode_records(next_batch))
             times.update(written=datetime.datetime.now())
-            last_position = self._get_last_position()
-            self.persistence.commit_position(last_position)
+            self._commit_position(self._checkpoint_filters(self.reader.get_last_position()))
             times.update(persisted=datetime.datetime.now())
         except ItemsLimitReached:
             # we have written some amount of records up to the limit
@@ -86,11 +111,67 @@ class BaseExporter(object):
         else:
             self._iteration_stats_report(times)
 
-    def _get_last_position(self):
-        last_position = self.reader.get_last_position()
-        last_position['writer_metadata'] = self.writer.get_all_metadata()
+    def _get_last_position(self, reader_position=None, writer_metadata=None):
+        last_position = reader_position
+        if last_position is None:
+            last_position = self.reader.get_last_position()
+        if writer_metadata is None:
+            writer_metadata = self.writer.get_all_metadata()
+        last_position['writer_metadata'] = writer_metadata
         return last_position
 
+    def _checkpoint_filters(self, position):
+        """
+        Store the state of the filters after filtering the items read up to
+        a reader position along with it, to restore them when resuming.
+        """
+        checkpoints = {}
+        for name in ('filter_before', 'filter_after'):
+            checkpoint = getattr(self, name).get_checkpoint()
+            if checkpoint is not None:
+                checkpoints[name] = checkpoint
+        if checkpoints:
+            position['filters_checkpoint'] = checkpoints
+        return position
+
+    def _restore_filters(self, last_position):
+        checkpoints = (last_position or {}).get('filters_checkpoint', {})
+        self.filter_before.restore_checkpoint(checkpoints.get('filter_before'))
+        self.filter_after.restore_checkpoint(checkpoints.get('filter_after'))
+
+    def _commit_position(self, reader_position=None):
+        """
+        Commit a reader position once the files the writer was uploading when
+        it was reached have been written.
+        """
+        if reader_position is None:
+            reader_position = self.reader.get_last_position()
+        writer_metadata = None
+        if self.writer.pending_uploads:
+            # The reader and the writer go on while those files are uploaded,
+            # so the position is stored along with the writer metadata it
+            # was reached with
+            reader_position = deepcopy(reader_position)
+            writer_metadata = deepcopy(self.writer.get_all_metadata())
+        self.uncommitted_positions.append(
+            (self.writer.uploads_submitted, reader_position, writer_metadata))
+        self._commit_uploaded_positions()
+
+    def _commit_uploaded_positions(self):
+        self.writer.reap_uploads()
+        uploaded = None
+        while (self.uncommitted_positions and
+               self.uncommitted_positions[0][0] <= self.writer.uploads_done):
+            uploaded = self.uncommitted_positions.popleft()
+        if uploaded is not None:
+            _, reader_position, writer_metadata = uploaded
+            self.persistence.commit_position(
+                self._get_last_position(reader_position, writer_metadata))
+
+    def _flush_writer(self):
+        self.writer.flush()
+        self._commit_uploaded_positions()
+
     def _init_export_job(self):
         self.notifiers.notify_start_dump(receivers=[CLIENTS, TEAM])
         last_position = self.persistence.get_last_position()
@@ -98,6 +179,7 @@ class BaseExporter(object):
             self.writer.update_metadata(last_position.get('writer_metadata'))
             self.metadata.accurate_items_count = last_position.get('accurate_items_count', False)
         self.reader.set_last_position(last_position)
+        self._restore_filters(last_position)
 
     def _clean_export_job(self):
         try:
@@ -105,7 +187,11 @@ class BaseExporter(object):
         except:
             raise
         finally:
-            self.writer.close()
+            try:
+                self.writer.close()
+            finally:
+                self.filter_before.close()
+                self.filter_after.close()
 
     def _finish_export_job(self):
         self.writer.finish_writing()
@@ -168,51 +254,126 @@ class BaseExporter(object):
             except ItemsLimitReached as e:
                 self.logger.info('{!r}'.format(e))
                 break
-        self.writer.flush()
+        self._flush_writer()
+
+    def _read_batch(self):
+        times = OrderedDict([('started', datetime.datetime.now())])
+        batch = list(self.reader.get_next_batch())
+        # The reader keeps going while this batch is processed, so we keep
+        # the position it had right after reading it to commit it later
+        position = deepcopy(self.reader.get_last_position())
+        times.update(read=datetime.datetime.now())
+        return batch, position, times
+
+    def _process_batch(self, batch):
+        batch = self.filter_before.filter_batch(batch)
+        batch = self.transform.transform_batch(batch)
+        batch = self.filter_after.filter_batch(batch)
+        return list(self.grouper.group_batch(batch))
+
+    def _write_processed_batch(self, batch, position, times):
+        try:
+            self.writer.write_batch(batch=decode_records(batch))
+            times.update(written=datetime.datetime.now())
+            self._commit_position(position)
+            times.update(persisted=datetime.datetime.now())
+        finally:
+            self._iteration_stats_report(times)
+
+    def _write_batch_from_workers(self, result, position, times):
+        batch, filtered_out = result.get()
+        times.update(processed=datetime.datetime.now())
+        for name, count in filtered_out.items():
+            stage = getattr(self, name)
+            stage.set_metadata('filtered_out', stage.get_metadata('filtered_out') + count)
+        self._write_processed_batch(batch, position, times)
+
+    def _run_pipeline_with_workers(self):
+        """
+        Run filters, transform and grouper in a pool of worker processes,
+        while batches are read and written by this process in reading order.
+        Stateful filters are rejected in this mode, as every worker would only
+        see its own items, so there are no filter checkpoints to store.
+        """
+        self.logger.info('Starting pipeline with {} worker processes'.format(self.workers))
+        pool = Pool(self.workers, initializer=init_worker,
+                    initargs=(self.config.configuration,))
+        pending = deque()
+        try:
+            while pending or not self.reader.is_finished():
+                while not self.reader.is_finished() and len(pending) < 2 * self.workers:
+                    batch, position, times = self._read_batch()
+                    result = pool.apply_async(process_batch, (batch,))
+                    pending.append((result, position, times))
+                self._write_batch_from_workers(*pending.popleft())
+        except ItemsLimitReached as e:
+            self.logger.info('{!r}'.format(e))
+        finally:
+            pool.terminate()
+            pool.join()
+        self._flush_writer()
 
     def _reader_thread(self):
         self.logger.info('Starting reader thread')
-        while not self.reader.is_finished():
-            self.process_queue.put(list(self.reader.get_next_batch()))
-            qsize = self.process_queue.qsize()
-            if qsize > 0.5*self.queue_size:
-                # Queues are getting full, throttle the reader so the processor/writer can keep up
-                time.sleep((qsize*10.0 / self.queue_size) - 5)
-        self.reader_finished = True
+        while not self.reader.is_finished() and not self.stop_threads.is_set():
+            self.process_queue.put(self._read_batch())
+        self.process_queue.put(END_OF_QUEUE)
 
     def _process_thread(self):
         self.logger.info('Starting processing thread')
-        while not self.reader_finished or not self.process_queue.empty():
-            next_batch = self.process_queue.get()
-            next_batch = self.filter_before.filter_batch(next_batch)
-            next_batch = self.transform.transform_batch(next_batch)
-            next_batch = self.filter_after.filter_batch(next_batch)
-            next_batch = self.grouper.group_batch(next_batch)
-            self.writer_queue.put(next_batch)
-        self.process_finished = True
+        while True:
+            next_item = self.process_queue.get()
+            if next_item is END_OF_QUEUE:
+                break
+            batch, position, times = next_item
+            batch = self._process_batch(batch)
+            self._checkpoint_filters(position)
+            times.update(processed=datetime.datetime.now())
+            self.writer_queue.put((batch, position, times))
+        self.writer_queue.put(END_OF_QUEUE)
 
     def _writer_thread(self):
         self.logger.info('Starting writer thread')
-        while not self.process_finished or not self.writer_queue.empty():
-            batch = self.writer_queue.get()
-            self.writer.write_batch(batch=batch)
-        self.writer.finish_writing()
-        self.writer.flush()
+        try:
+            while True:
+                next_item = self.writer_queue.get()
+                if next_item is END_OF_QUEUE:
+                    break
+                self._write_processed_batch(*next_item)
+        except ItemsLimitReached as e:
+            self.logger.info('{!r}'.format(e))
+            self.stop_threads.set()
+
+    def _start_thread(self, target):
+        def run():
+            try:
+                target()
+            except Exception:
+                self.thread_errors.append(sys.exc_info())
+                self.stop_threads.set()
+        thread = Thread(target=run, name=target.__name__)
+        thread.start()
+        return thread
+
+    def _queues_stats_report(self):
+        stats = {q.name: q.stats() for q in (self.process_queue, self.writer_queue)}
+        self.metadata.per_module['queues'].update(stats)
+        for name, queue_stats in sorted(stats.items()):
+            self.logger.info('Queue {} occupancy: {}'.format(name, queue_stats))
 
     def _run_threads(self):
-        self.reader_finished = False
-        self.process_finished = False
-        self.process_queue = Queue(self.queue_size)
-        self.writer_queue = Queue(self.queue_size)
-        reader_thread = Thread(target=self._reader_thread)
-        process_thread = Thread(target=self._process_thread)
-        writer_thread = Thread(target=self._writer_thread)
-        reader_thread.start()
-        process_thread.start()
-        writer_thread.start()
-        reader_thread.join()
-        process_thread.join()
-        writer_thread.join()
+        self.stop_threads = Event()
+        self.thread_errors = []
+        self.process_queue = PipelineQueue('process_queue', self.queue_size, self.stop_threads)
+        self.writer_queue = PipelineQueue('writer_queue', self.queue_size, self.stop_threads)
+        threads = [self._start_thread(target)
+                   for target in (self._reader_thread, self._process_thread, self._writer_thread)]
+        for thread in threads:
+            thread.join()
+        self._queues_stats_report()
+        if self.thread_errors:
+            six.reraise(*self.thread_errors[0])
+        self._flush_writer()
 
     def export(self):
         if not self.bypass():
@@ -220,9 +381,11 @@ class BaseExporter(object):
                 self._init_export_job()
                 if self.threaded:
                     self._run_threads()
+                elif self.workers > 1:
+                    self._run_pipeline_with_workers()
                 else:
                     self._run_pipeline()
-                    self._finish_export_job()
+                self._finish_export_job()
                 self._final_stats_report()
                 self.persistence.close()
                 self.notifiers.notify_complete_dump(receivers=[CLIENTS, TEAM])
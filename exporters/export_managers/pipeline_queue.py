@@ -0,0 +1,67 @@
+from six.moves.queue import Queue, Empty, Full
+
+
+# Put into a queue to tell the consuming thread that no more batches will come
+END_OF_QUEUE = object()
+
+
+class PipelineQueue(object):
+    """
+    Bounded queue connecting two threads of the threaded pipeline.
+
+    Puts block while the queue is full, so a slow consumer throttles its
+    producer. Both puts and gets give up when the stop event is set, which
+    happens when any thread of the pipeline stops early. It also keeps
+    occupancy stats, to find out which stage is the bottleneck: a queue that
+    is usually full has a slow consumer, and a queue that is usually empty
+    has a slow producer.
+    """
+    poll_interval = 0.1
+
+    def __init__(self, name, maxsize, stop_event):
+        self.name = name
+        self.maxsize = maxsize
+        self.stop_event = stop_event
+        self._queue = Queue(maxsize)
+        self.puts = 0
+        self.occupancy_sum = 0
+        self.max_occupancy = 0
+        self.full_waits = 0
+        self.empty_waits = 0
+
+    def put(self, item):
+        occupancy = self._queue.qsize()
+        self.puts += 1
+        self.occupancy_sum += occupancy
+        self.max_occupancy = max(self.max_occupancy, occupancy)
+        if occupancy >= self.maxsize:
+            self.full_waits += 1
+        while not self.stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=self.poll_interval)
+                return
+            except Full:
+                pass
+
+    def get(self):
+        """
+        Returns the next item, or END_OF_QUEUE if the pipeline was stopped.
+        """
+        if self._queue.empty():
+            self.empty_waits += 1
+        while not self.stop_event.is_set():
+            try:
+                return self._queue.get(timeout=self.poll_interval)
+            except Empty:
+                pass
+        return END_OF_QUEUE
+
+    def stats(self):
+        average = float(self.occupancy_sum) / self.puts if self.puts else 0.0
+        return {
+            'max_size': self.maxsize,
+            'average_occupancy': round(average, 2),
+            'max_occupancy': self.max_occupancy,
+            'full_waits': self.full_waits,
+            'empty_waits': self.empty_waits,
+        }
@@ -0,0 +1,60 @@
+"""
+Support for running the CPU bound stages of the pipeline (filter_before,
+transform, filter_after and grouper) in a pool of worker processes.
+
+Every worker process builds its own copy of those modules from the export
+configuration when it starts, so only batches of items travel between the
+export manager and the workers. Stateful filters (e.g. DupeFilter) are not
+supported, as they would only see the items processed by their own worker.
+"""
+from copy import deepcopy
+
+from exporters.exporter_config import ExporterConfig
+from exporters.meta import ExportMeta
+from exporters.module_loader import ModuleLoader
+
+
+class PipelineStages(object):
+    """
+    Loads and runs the processing stages of the pipeline over a batch.
+    """
+
+    def __init__(self, config, metadata):
+        module_loader = ModuleLoader()
+        self.metadata = metadata
+        self.filter_before = module_loader.load_filter(config.filter_before_options, metadata)
+        self.transform = module_loader.load_transform(config.transform_options, metadata)
+        self.filter_after = module_loader.load_filter(config.filter_after_options, metadata)
+        self.grouper = module_loader.load_grouper(config.grouper_options, metadata)
+
+    def process_batch(self, batch):
+        """
+        Returns the processed items, and how many items each filter filtered out.
+        """
+        batch = list(batch)
+        kept = list(self.filter_before.filter_batch(batch))
+        filtered_out = {'filter_before': len(batch) - len(kept)}
+        transformed = list(self.transform.transform_batch(kept))
+        kept = list(self.filter_after.filter_batch(transformed))
+        filtered_out['filter_after'] = len(transformed) - len(kept)
+        return list(self.grouper.group_batch(kept)), filtered_out
+
+
+_worker_stages = None
+
+
+def init_worker(configuration):
+    """
+    Pool initializer, building the pipeline stages for this worker process.
+    """
+    global _worker_stages
+    configuration = deepcopy(configuration)
+    _worker_stages = PipelineStages(ExporterConfig(configuration), ExportMeta(configuration))
+
+
+def process_batch(batch):
+    """
+    Run a batch through the worker pipeline stages. Returns the processed
+    items and how many items each filter filtered out.
+    """
+    return _worker_stages.process_batch(batch)
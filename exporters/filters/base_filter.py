@@ -8,6 +8,10 @@ class BaseFilter(BasePipelineItem):
     """
     log_at_every = 1000
 
+    # Whether filtering an item depends on the items filtered before, which
+    # needs all items to go through the same filter instance
+    stateful = False
+
     def __init__(self, options, metadata):
         super(BaseFilter, self).__init__(options, metadata)
         self.check_options()
@@ -41,6 +45,33 @@ class BaseFilter(BasePipelineItem):
         """
         raise NotImplementedError
 
+    def get_raw_line_filter(self):
+        """
+        Returns a function telling whether a raw JSON line may hold an item
+        this filter keeps, so stream readers can skip the lines it rejects
+        without deserializing them, or None. The function must never reject
+        the line of an item the filter would keep.
+        """
+        return None
+
+    def get_checkpoint(self):
+        """
+        Returns the filter state to be stored with the position of the items
+        filtered so far, or None if the filter has no state to keep.
+        """
+        return None
+
+    def restore_checkpoint(self, checkpoint):
+        """
+        Brings the filter state back to the given checkpoint when resuming, or
+        resets it if checkpoint is None.
+        """
+
+    def close(self):
+        """
+        Releases the resources held by the filter once the export is done.
+        """
+
     def set_metadata(self, key, value, module='filter'):
         super(BaseFilter, self).set_metadata(key, value, module)
 
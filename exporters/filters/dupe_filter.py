@@ -1,4 +1,8 @@
+import six
+
+from exporters.exceptions import ConfigurationError
 from exporters.filters.base_filter import BaseFilter
+from exporters.filters.key_sets import HashedKeySet, KeySet, ScalableBloomFilter, SqliteKeySet
 
 
 class DupeFilter(BaseFilter):
@@ -7,18 +11,67 @@ class DupeFilter(BaseFilter):
 
         - key_field (str)
             item's key to be used to identify dupes
+
+        - mode (str)
+            How seen keys are remembered. "set" keeps the keys themselves,
+            "hash" keeps 64 bits hashes of them (exact unless two hashes collide,
+            11 to 22 bytes per key) and "bloom" keeps them in a scalable Bloom filter
+            (a few bytes per key, but new items are filtered out as dupes with a
+            probability of error_rate). "disk" keeps 64 bits hashes of them in a
+            sqlite database in index_path, which is checkpointed with the export
+            position so dupes are still filtered out after resuming. DupeFilter
+            can not be used with the workers exporter option
+
+        - error_rate (float)
+            False positive rate of the "bloom" mode
+
+        - initial_capacity (int)
+            Number of keys the "hash" and "bloom" modes are sized for at start.
+            They grow beyond it as needed
+
+        - index_path (str)
+            Path of the database file of the "disk" mode
+
+        - cache_size (int)
+            Number of recently seen keys the "disk" mode keeps in memory
     """
+    stateful = True
+
     # List of options
     supported_options = {
-        'key_field': {'type': basestring, 'default': '_key'}
+        'key_field': {'type': basestring, 'default': '_key'},
+        'mode': {'type': six.string_types, 'default': 'set'},
+        'error_rate': {'type': float, 'default': 0.001},
+        'initial_capacity': {'type': six.integer_types, 'default': 2**20},
+        'index_path': {'type': six.string_types, 'default': None},
+        'cache_size': {'type': six.integer_types, 'default': 100000},
     }
 
     def __init__(self, *args, **kwargs):
         super(DupeFilter, self).__init__(*args, **kwargs)
         self.key_field = self.read_option('key_field')
-        self.key_set = set()
-        self.logger.info('{} initialized. Key field: "{}"'.format(
-            self.__class__.__name__, self.key_field))
+        self.mode = self.read_option('mode')
+        self.key_set = self._create_key_set()
+        self.logger.info('{} initialized. Key field: "{}". Mode: {}'.format(
+            self.__class__.__name__, self.key_field, self.mode))
+
+    def _create_key_set(self):
+        if self.mode == 'set':
+            return KeySet()
+        if self.mode == 'disk':
+            index_path = self.read_option('index_path')
+            if not index_path:
+                raise ConfigurationError('index_path is needed by the disk mode')
+            return SqliteKeySet(index_path, self.read_option('cache_size'))
+        initial_capacity = self.read_option('initial_capacity')
+        if self.mode == 'hash':
+            return HashedKeySet(initial_capacity)
+        if self.mode == 'bloom':
+            error_rate = self.read_option('error_rate')
+            if not 0 < error_rate < 1:
+                raise ConfigurationError('error_rate should be between 0 and 1')
+            return ScalableBloomFilter(initial_capacity, error_rate)
+        raise ConfigurationError('Unknown DupeFilter mode: {}'.format(self.mode))
 
     def filter(self, item):
         items_key = item.get(self.key_field)
@@ -26,8 +79,24 @@ class DupeFilter(BaseFilter):
             self.logger.warning('Item without "key" found,'
                                 ' unable to filter it.')
             return True
+        return self.key_set.add(items_key)
 
-        if items_key not in self.key_set:
-            self.key_set.add(items_key)
-            return True
-        return False
+    def get_checkpoint(self):
+        if self.mode == 'disk':
+            return self.key_set.checkpoint()
+
+    def restore_checkpoint(self, checkpoint):
+        if self.mode == 'disk':
+            self.key_set.restore(checkpoint)
+
+    def close(self):
+        if self.mode == 'disk':
+            self.key_set.close()
+
+    def _log_progress(self):
+        super(DupeFilter, self)._log_progress()
+        if self.total % self.log_at_every == 0:
+            memory_usage = self.key_set.memory_usage()
+            self.set_metadata('keys_memory_usage', memory_usage)
+            self.logger.info('Remembering %d keys in %d bytes' %
+                             (len(self.key_set), memory_usage))
@@ -0,0 +1,282 @@
+"""
+Sets of item keys used by DupeFilter to remember the keys already seen.
+
+Every key set has an add(key) method returning whether the key was new,
+and a memory_usage() method returning an estimate of the bytes it uses.
+"""
+import hashlib
+import math
+import sqlite3
+import struct
+import sys
+from array import array
+
+import six
+
+
+def _key_bytes(key):
+    if isinstance(key, six.binary_type):
+        return key
+    return six.text_type(key).encode('utf-8')
+
+
+def _key_digest(key):
+    return hashlib.md5(_key_bytes(key)).digest()
+
+
+# array typecode of 64 bits unsigned integers ('Q' is not available on python 2)
+_UINT64 = 'L' if array('L').itemsize == 8 else 'Q'
+
+
+class KeySet(object):
+    """
+    Keeps the keys themselves in a set. Exact, but every key costs its full
+    size plus the set overhead.
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.keys_size = 0
+
+    def add(self, key):
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        self.keys_size += sys.getsizeof(key)
+        return True
+
+    def __len__(self):
+        return len(self.keys)
+
+    def memory_usage(self):
+        return sys.getsizeof(self.keys) + self.keys_size
+
+
+class HashedKeySet(object):
+    """
+    Keeps 64 bits hashes of the keys in an open addressing hash table backed by
+    an array, so every key costs 8 bytes per table slot. The table is kept at
+    most max_load full. Different keys are only taken as the same key when
+    their 64 bits hashes collide, which is unlikely even for billions of keys.
+    """
+
+    max_load = 0.75
+
+    def __init__(self, initial_capacity=1024):
+        size = 1
+        while size * self.max_load < initial_capacity:
+            size *= 2
+        self.table = array(_UINT64, [0]) * size
+        self.mask = size - 1
+        self.count = 0
+
+    def _hash(self, key):
+        # 0 marks empty slots
+        return struct.unpack('<Q', _key_digest(key)[:8])[0] or 1
+
+    def add(self, key):
+        key_hash = self._hash(key)
+        table = self.table
+        mask = self.mask
+        slot = key_hash & mask
+        while table[slot]:
+            if table[slot] == key_hash:
+                return False
+            slot = (slot + 1) & mask
+        table[slot] = key_hash
+        self.count += 1
+        if self.count > len(table) * self.max_load:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old_table = self.table
+        self.table = table = array(_UINT64, [0]) * (len(old_table) * 2)
+        self.mask = mask = len(table) - 1
+        for key_hash in old_table:
+            if key_hash:
+                slot = key_hash & mask
+                while table[slot]:
+                    slot = (slot + 1) & mask
+                table[slot] = key_hash
+
+    def __len__(self):
+        return self.count
+
+    def memory_usage(self):
+        return self.table.itemsize * len(self.table)
+
+
+class BloomFilter(object):
+    """
+    Bloom filter sized to hold capacity keys with the given false positive
+    rate. Bit positions are derived from the md5 digest of the key with
+    double hashing.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.hashes = max(1, int(math.ceil(math.log(1.0 / error_rate, 2))))
+        bits = int(math.ceil(capacity * abs(math.log(error_rate)) / (math.log(2) ** 2)))
+        self.bits = max(8, bits)
+        self.bitmap = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def contains(self, hash1, hash2):
+        bitmap = self.bitmap
+        bits = self.bits
+        for i in range(self.hashes):
+            position = (hash1 + i * hash2) % bits
+            if not bitmap[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, hash1, hash2):
+        bitmap = self.bitmap
+        bits = self.bits
+        for i in range(self.hashes):
+            position = (hash1 + i * hash2) % bits
+            bitmap[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def memory_usage(self):
+        return len(self.bitmap)
+
+
+class ScalableBloomFilter(object):
+    """
+    Scalable Bloom filter: a series of Bloom filters, each one holding growth
+    times more keys than the previous one with an error rate tightened by
+    error_ratio, so the overall false positive rate stays below error_rate
+    however many keys are added. A false positive makes a new key look
+    like an already seen one.
+    """
+
+    growth = 4
+    error_ratio = 0.5
+
+    def __init__(self, initial_capacity=1024, error_rate=0.001):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.filters = []
+        self._add_filter()
+
+    def _add_filter(self):
+        index = len(self.filters)
+        capacity = self.initial_capacity * self.growth ** index
+        error_rate = self.error_rate * (1 - self.error_ratio) * self.error_ratio ** index
+        self.filters.append(BloomFilter(capacity, error_rate))
+
+    def add(self, key):
+        hash1, hash2 = struct.unpack('<QQ', _key_digest(key))
+        for bloom_filter in self.filters:
+            if bloom_filter.contains(hash1, hash2):
+                return False
+        current = self.filters[-1]
+        if current.count >= current.capacity:
+            self._add_filter()
+            current = self.filters[-1]
+        current.add(hash1, hash2)
+        return True
+
+    def __len__(self):
+        return sum(bloom_filter.count for bloom_filter in self.filters)
+
+    def memory_usage(self):
+        return sum(bloom_filter.memory_usage() for bloom_filter in self.filters)
+
+
+class SqliteKeySet(object):
+    """
+    Keeps 64 bits hashes of the keys in a sqlite database, so the keys seen
+    are not limited by memory and outlive the process. Hashes of recently
+    seen keys are cached in memory to skip database lookups for hot keys.
+
+    Hashes are written tagged with the number of the next checkpoint.
+    checkpoint() writes them and returns that number, and restore(checkpoint)
+    drops the hashes written after it, so the set can be brought back to the
+    keys it had when a given checkpoint was taken.
+    """
+
+    flush_size = 10000
+
+    def __init__(self, path, cache_size=100000):
+        # Used from the processing thread when the pipeline is threaded
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS keys '
+                                '(hash INTEGER PRIMARY KEY, checkpoint INTEGER NOT NULL)')
+        self.connection.commit()
+        self.cache_size = cache_size
+        self.cache = set()
+        self.pending = set()
+        self.checkpoint_id = self._query('SELECT MAX(checkpoint) FROM keys') or 0
+        self.count = self._query('SELECT COUNT(*) FROM keys')
+
+    def _query(self, sql, *args):
+        return self.connection.execute(sql, args).fetchone()[0]
+
+    def _hash(self, key):
+        # sqlite integers are signed
+        return struct.unpack('<q', _key_digest(key)[:8])[0]
+
+    def _cache(self, key_hash):
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache.add(key_hash)
+
+    def _stored(self, key_hash):
+        return self._query('SELECT COUNT(*) FROM keys WHERE hash = ?', key_hash) > 0
+
+    def add(self, key):
+        key_hash = self._hash(key)
+        if key_hash in self.cache or key_hash in self.pending:
+            return False
+        self._cache(key_hash)
+        if self._stored(key_hash):
+            return False
+        self.pending.add(key_hash)
+        if len(self.pending) >= self.flush_size:
+            self._flush()
+        return True
+
+    def _flush(self):
+        if not self.pending:
+            return
+        checkpoint = self.checkpoint_id + 1
+        cursor = self.connection.executemany(
+            'INSERT OR IGNORE INTO keys VALUES (?, ?)',
+            ((key_hash, checkpoint) for key_hash in self.pending))
+        self.connection.commit()
+        self.count += cursor.rowcount
+        self.pending.clear()
+
+    def checkpoint(self):
+        """
+        Writes the pending hashes and returns the number of the checkpoint
+        they belong to.
+        """
+        self._flush()
+        self.checkpoint_id += 1
+        return self.checkpoint_id
+
+    def restore(self, checkpoint):
+        """
+        Forgets the keys added after the given checkpoint was taken, or all of
+        them if checkpoint is None.
+        """
+        checkpoint = checkpoint or 0
+        self.connection.execute('DELETE FROM keys WHERE checkpoint > ?', (checkpoint,))
+        self.connection.commit()
+        self.pending.clear()
+        self.cache.clear()
+        self.checkpoint_id = checkpoint
+        self.count = self._query('SELECT COUNT(*) FROM keys')
+
+    def __len__(self):
+        return self.count + len(self.pending)
+
+    def memory_usage(self):
+        return sys.getsizeof(self.cache) + sys.getsizeof(self.pending)
+
+    def close(self):
+        self.connection.close()
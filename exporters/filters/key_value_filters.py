@@ -1,6 +1,7 @@
 import re
 import six
 
+from exporters.exceptions import ConfigurationError
 from exporters.filters.base_filter import BaseFilter
 from exporters.utils import nested_dict_value
 from exporters.utils import dict_list
@@ -22,6 +23,76 @@ OPERATORS = {
 
 DEFAULT_OPERATOR = '=='
 
+# Strings made of these characters are written as they are by JSON encoders
+RAW_SAFE_STRING = re.compile(r'[A-Za-z0-9 _.,:;@#%+=!?*()\[\]{}|~^$-]+\Z')
+
+
+def raw_literal(value):
+    """
+    Returns the bytes a string value is written as in raw JSON, or None if
+    it may be written in several ways.
+    """
+    if isinstance(value, six.string_types) and RAW_SAFE_STRING.match(value):
+        return value.encode('ascii')
+    return None
+
+
+def all_groups_found(groups):
+    """
+    Returns a function telling whether a line holds at least one of the
+    byte strings of every group.
+    """
+    def line_filter(line):
+        for group in groups:
+            for literal in group:
+                if literal in line:
+                    break
+            else:
+                return False
+        return True
+    return line_filter
+
+
+def _compile_regex(pattern):
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise ConfigurationError('Invalid regular expression {!r}: {}'.format(pattern, e))
+
+
+def _compile_in(expected):
+    if not isinstance(expected, (list, tuple, set, frozenset)):
+        return lambda a: a in expected
+    try:
+        values = frozenset(expected)
+    except TypeError:  # unhashable values, can't be looked up in a set
+        return lambda a: a in expected
+
+    def match(a):
+        try:
+            return a in values
+        except TypeError:
+            return a in expected
+    return match
+
+
+def compile_operator(op, expected):
+    """
+    Returns a function telling whether a found value matches the expected
+    one with the given operator, like OPERATORS[op](found, expected) but with
+    regular expressions compiled and value lists turned into sets beforehand.
+    """
+    if op == 'in':
+        return _compile_in(expected)
+    if op == 'contains':
+        return lambda a: expected in a
+    if op == '==':
+        return lambda a: a == expected
+    if op == 're_match':
+        regex = _compile_regex(expected)
+        return lambda a: bool(regex.match(u'%s' % a))
+    raise InvalidOperator('{} operator not valid'.format(op))
+
 
 class KeyValueBaseFilter(BaseFilter):
     "Base class to key-value filters"
@@ -36,6 +107,7 @@ class KeyValueBaseFilter(BaseFilter):
         self.keys = self.read_option('keys')
         self.nested_field_separator = self.read_option('nested_field_separator')
         self._validate_keys_operator()
+        self.compiled_keys = [self._compile_key(key) for key in self.keys]
         self.logger.info('{} has been initiated. Keys: {}'.format(
             self.__class__.__name__, self.keys))
 
@@ -45,20 +117,66 @@ class KeyValueBaseFilter(BaseFilter):
             if op and op not in OPERATORS:
                 raise InvalidOperator('{} operator not valid in key {}'.format(op, key))
 
-    def filter(self, item):
+    def _raw_line_literals(self, key):
+        """
+        Returns byte strings at least one of which is in the raw JSON line of
+        every item matching the key, or None if there are no such strings.
+        Derived classes can override it to enable raw line filtering.
+        """
+        return None
+
+    # Keys allowing more literals than this are left out of raw line filters,
+    # as looking for all of them costs more than deserializing the line
+    max_raw_line_literals = 10
+
+    def get_raw_line_filter(self):
+        groups = []
         for key in self.keys:
-            if self.nested_field_separator:
-                nested_fields = key['name'].split(self.nested_field_separator)
+            literals = self._raw_line_literals(key)
+            if literals and len(literals) <= self.max_raw_line_literals:
+                groups.append(tuple(literals))
+        if groups:
+            return all_groups_found(groups)
+
+    def _compile_key(self, key):
+        """
+        Returns the (name, nested fields, matcher) tuple used to filter items
+        with a key. Nested fields is None when nested fields are disabled.
+        """
+        nested_fields = None
+        if self.nested_field_separator:
+            nested_fields = tuple(key['name'].split(self.nested_field_separator))
+        return key['name'], nested_fields, self._compile_matcher(key)
+
+    def _compile_matcher(self, key):
+        """Return a function telling whether a found value matches the key.
+        Can be overriden by derived classes to prepare their match beforehand.
+        """
+        expected = key['value']
+        op = OPERATORS[key.get('operator', DEFAULT_OPERATOR)]
+        return lambda found: self._match_value(found, expected, op)
+
+    def _nested_value(self, item, nested_fields):
+        value = item
+        for field in nested_fields:
+            if not isinstance(value, dict):
+                # other mappings, or errors for values that aren't mappings
+                return nested_dict_value(item, nested_fields)
+            value = value[field]
+        return value
+
+    def filter(self, item):
+        for name, nested_fields, matcher in self.compiled_keys:
+            if nested_fields is None:
+                value = item[name]
+            else:
                 try:
-                    value = nested_dict_value(item, nested_fields)
+                    value = self._nested_value(item, nested_fields)
                 except KeyError:
                     self.logger.debug('Missing path {} from item. Item dismissed'.format(
-                            nested_fields))
+                            list(nested_fields)))
                     return False
-            else:
-                value = item[key['name']]
-            if not self._match_value(
-                    value, key['value'], OPERATORS[key.get('operator', DEFAULT_OPERATOR)]):
+            if not matcher(value):
                 return False
         return True
 
@@ -78,6 +196,25 @@ class KeyValueFilter(KeyValueBaseFilter):
             The filter will delete those items that do not contain a
             key "key" or, if they do, that key is not the same as "value".
     """
+    def _compile_matcher(self, key):
+        return compile_operator(key.get('operator', DEFAULT_OPERATOR), key['value'])
+
+    def _raw_line_literals(self, key):
+        op = key.get('operator', DEFAULT_OPERATOR)
+        expected = key['value']
+        if op == '==':
+            literal = raw_literal(expected)
+            return literal and [b'"' + literal + b'"']
+        if op == 'contains':
+            # Either a substring of a string or an element of a list
+            literal = raw_literal(expected)
+            return literal and [literal]
+        if op == 'in' and isinstance(expected, (list, tuple)):
+            literals = [raw_literal(value) for value in expected]
+            if literals and all(literals):
+                return [b'"' + value + b'"' for value in literals]
+        return None
+
     def _match_value(self, found, expected, op):
         return op(found, expected)
 
@@ -91,6 +228,10 @@ class KeyValueRegexFilter(KeyValueBaseFilter):
             The filter will delete those items that do not contain a
             key "key" or, if they do, that key value does not match "regex".
     """
+    def _compile_matcher(self, key):
+        match = compile_operator('re_match', key['value'])
+        return lambda found: found is not None and match(found)
+
     def _match_value(self, found, expected, op):
         if found is None:
             return False
@@ -1,6 +1,6 @@
 import six
 from exporters.filters.base_filter import BaseFilter
-from exporters.python_interpreter import Interpreter, create_context
+from exporters.python_interpreter import ExpressionEvaluator
 from importlib import import_module
 
 
@@ -32,14 +32,13 @@ class PythonexpFilter(BaseFilter):
                             ' -- only use it in contained environments')
         self.expression = self.read_option('python_expression')
         self.imports = load_imports(self.read_option('imports'))
-        self.interpreter = Interpreter()
+        self.evaluator = ExpressionEvaluator([self.expression], **self.imports)
         self.logger.info('PythonexpFilter has been initiated.'
                          ' Expression: {!r}'.format(self.expression))
 
     def filter(self, item):
         try:
-            context = create_context(item=item, **self.imports)
-            return self.interpreter.eval(self.expression, context=context)
+            return self.evaluator.eval(item)
         except Exception as ex:
             self.logger.error(str(ex))
             raise
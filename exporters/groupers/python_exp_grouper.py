@@ -1,5 +1,5 @@
 from exporters.groupers.base_grouper import BaseGrouper
-from exporters.python_interpreter import Interpreter, create_context
+from exporters.python_interpreter import ExpressionEvaluator
 from exporters.utils import str_list
 
 
@@ -17,15 +17,11 @@ class PythonExpGrouper(BaseGrouper):
     def __init__(self, *args, **kwargs):
         super(PythonExpGrouper, self).__init__(*args, **kwargs)
         self.expressions = self.read_option('python_expressions', [])
-        self.interpreter = Interpreter()
+        self.evaluator = ExpressionEvaluator(self.expressions)
 
     def _get_membership(self, item):
         try:
-            context = create_context(item=item)
-            return [
-                self.interpreter.eval(expression, context=context)
-                for expression in self.expressions
-            ]
+            return self.evaluator.eval_all(item)
         except Exception as ex:
             self.logger.error(str(ex))
             raise
@@ -12,16 +12,6 @@ def cohere_stream(stream):
     return IterIO(stream)
 
 
-def iterate_chunks(file, chunk_size):
-    """
-    Iterate chunks of size chunk_size from a file-like object
-    """
-    chunk = file.read(chunk_size)
-    while chunk:
-        yield chunk
-        chunk = file.read(chunk_size)
-
-
 class IterIO(object):
     """
     Both an iterator and a file-like object.
@@ -30,19 +20,35 @@ class IterIO(object):
     - chunks: iterator yields chunks that can be of various sizes. If iterator
               is a file-like object, chunks are of size chunk_size
     - lines:  iterator yields lines like standard file-like objects
+
+    Data is kept in a buffer holding the last chunk pulled from the iterator,
+    with an offset to its first unconsumed byte, so consuming data doesn't
+    copy the rest of the chunk. When reading from a file-like object, the
+    chunk size doubles (up to max_chunk_size) every time a line doesn't fit
+    in a single chunk.
     """
-    def __init__(self, iterator, mode="chunks", chunk_size=1024):
-        self._unconsumed = []
+    max_chunk_size = 2**20
+
+    def __init__(self, iterator, mode="chunks", chunk_size=2**16):
         self.mode = mode
+        self._buffer = b''
+        self._offset = 0
         self._pos = 0
         self._file = iterator
+        self.chunk_size = chunk_size
         if callable(getattr(iterator, 'read', None)):  # file-like object
-            self._iterator = iterate_chunks(iterator, chunk_size)
+            self._iterator = self._read_chunks()
         else:
-            self._iterator = iterator
+            self._iterator = iter(iterator)
         self.finished = False
         self.closed = False
 
+    def _read_chunks(self):
+        chunk = self._file.read(self.chunk_size)
+        while chunk:
+            yield chunk
+            chunk = self._file.read(self.chunk_size)
+
     def unshift(self, chunk):
         """
         Pushes a chunk of data back into the internal buffer. This is useful
@@ -53,7 +59,10 @@ class IterIO(object):
         """
         if chunk:
             self._pos -= len(chunk)
-            self._unconsumed.append(chunk)
+            if self._offset < len(self._buffer):
+                chunk += self._buffer[self._offset:]
+            self._buffer = chunk
+            self._offset = 0
 
     def __iter__(self):
         return self
@@ -72,10 +81,12 @@ class IterIO(object):
         Read a chunk of arbitrary size from the underlying iterator. To get a
         chunk of an specific size, use read()
         """
-        if self._unconsumed:
-            data = self._unconsumed.pop()
+        if self._offset < len(self._buffer):
+            data = self._buffer[self._offset:] if self._offset else self._buffer
+            self._buffer = b''
+            self._offset = 0
         else:
-            data = self._iterator.next()  # Might raise StopIteration
+            data = next(self._iterator)  # Might raise StopIteration
         self._pos += len(data)
         return data
 
@@ -86,50 +97,80 @@ class IterIO(object):
         If the size argument is negative or None, read until EOF is reached.
         Return an empty string at EOF.
         """
+        data_chunks = []
         if size is None or size < 0:
-            return "".join(list(self))
-        else:
-            data_chunks = []
-            data_readed = 0
             try:
-                while data_readed < size:
-                    chunk = self.next_chunk()
-                    data_chunks.append(chunk)
-                    data_readed += len(chunk)
+                while True:
+                    data_chunks.append(self.next_chunk())
             except StopIteration:
                 pass
-
-            if data_readed > size:
-                last_chunk = data_chunks.pop()
-                extra_length = data_readed - size
-                last_chunk, extra_data = last_chunk[:-extra_length], last_chunk[-extra_length:]
-                self.unshift(extra_data)
-                data_chunks.append(last_chunk)
-            return "".join(data_chunks)
+            return b''.join(data_chunks)
+
+        missing = size
+        while missing > 0:
+            available = len(self._buffer) - self._offset
+            if not available:
+                try:
+                    self._buffer = next(self._iterator)
+                except StopIteration:
+                    break
+                self._offset = 0
+                continue
+            start = self._offset
+            self._offset += min(available, missing)
+            data_chunks.append(self._buffer[start:self._offset])
+            missing -= self._offset - start
+        data = b''.join(data_chunks)
+        self._pos += len(data)
+        return data
 
     def readline(self):
         """
         Read until a new-line character is encountered
         """
-        line = ""
-        n_pos = -1
-        try:
-            while n_pos < 0:
-                line += self.next_chunk()
-                n_pos = line.find('\n')
-        except StopIteration:
-            pass
-
-        if n_pos >= 0:
-            line, extra = line[:n_pos+1], line[n_pos+1:]
-            self.unshift(extra)
+        buf, start = self._buffer, self._offset
+        end = buf.find('\n', start) + 1
+        if end:
+            self._offset = end
+            self._pos += end - start
+            return buf[start:end]
+
+        # The line continues in the following chunks
+        line_chunks = [buf[start:]] if start < len(buf) else []
+        self._buffer = b''
+        self._offset = 0
+        for chunk in self._iterator:
+            end = chunk.find('\n') + 1
+            if end:
+                line_chunks.append(chunk[:end])
+                self._buffer = chunk
+                self._offset = end
+                break
+            line_chunks.append(chunk)
+        if len(line_chunks) > 2 and self.chunk_size < self.max_chunk_size:
+            self.chunk_size *= 2
+        line = b''.join(line_chunks)
+        self._pos += len(line)
         return line
 
     def iterlines(self):
-        line = self.readline()
-        while line:
-            yield line
-            line = self.readline()
+        """
+        Iterate the lines of the stream. Lines are split straight from the
+        buffered chunk, only falling back to readline() for lines spanning
+        several chunks.
+        """
+        while True:
+            buf, start = self._buffer, self._offset
+            end = buf.find('\n', start) + 1
+            if end:
+                self._offset = end
+                self._pos += end - start
+                yield buf[start:end]
+            else:
+                line = self.readline()
+                if not line:
+                    return
+                yield line
 
     def readlines(self):
         """
@@ -150,9 +191,9 @@ class IterIO(object):
         Disable al operations and close the underlying file-like object, if any
         """
         if callable(getattr(self._file, 'close', None)):
-            self._iterator.close()
+            self._file.close()
         self._iterator = None
-        self._unconsumed = None
+        self._buffer = None
         self.closed = True
 
     def seek(self, offset, from_what=0):
@@ -8,6 +8,9 @@ class BasePersistence(BasePipelineItem):
     Base module for persistence modules
     """
 
+    # Whether append_to_journal() is supported
+    journal_support = False
+
     def __init__(self, options, metadata):
         super(BasePersistence, self).__init__(options, metadata)
         self.set_metadata('commited_positions', 0)
@@ -53,6 +56,22 @@ class BasePersistence(BasePipelineItem):
         """
         raise NotImplementedError
 
+    def append_to_journal(self, entry):
+        """
+        Appends an entry to the journal of the last committed position, to
+        persist progress made since then without committing a new position.
+        Entries must be serializable, and the journal is cleared when a new
+        position is committed. Only available with journal_support.
+        """
+        raise NotImplementedError
+
+    def get_journal(self):
+        """
+        Returns the entries appended to the journal since the last committed
+        position.
+        """
+        return []
+
     def generate_new_job(self):
         """
         Creates and instantiates all that is needed to keep
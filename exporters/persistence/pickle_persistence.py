@@ -1,6 +1,7 @@
 import six
 import os
 import re
+import struct
 import yaml
 from exporters.persistence.base_persistence import BasePersistence
 import pickle
@@ -12,6 +13,14 @@ class PicklePersistence(BasePersistence):
     """
     Manages persistence using pickle module loading and dumping as a backend.
 
+    The pickle file is written to a temporary file first, which is then
+    renamed over it, so it's never left partially written.
+
+    Journal entries are appended to a .journal file next to the pickle file,
+    every entry pickled after its length. Entries are tagged with the
+    journal_id of the position they follow, so the entries of an older
+    position left behind by a crash before clearing the journal are ignored.
+
         - file_path (str)
             Path to store the pickle file
     """
@@ -21,13 +30,55 @@ class PicklePersistence(BasePersistence):
 
     uri_regex = "pickle:(([a-zA-Z\d-]|\/)+)"
 
+    journal_support = True
+
+    _journal_header = struct.Struct('!I')
+
     def __init__(self, *args, **kwargs):
+        self.journal_file = None
+        # Incremented with every committed position
+        self.journal_id = 0
         super(PicklePersistence, self).__init__(*args, **kwargs)
         self.persistence_file_name = self._get_persistence_file_name()
 
     def _get_persistence_file_name(self):
         return os.path.join(self.read_option('file_path'), self.persistence_state_id)
 
+    def _get_journal_file_name(self):
+        return self._get_persistence_file_name() + '.journal'
+
+    def append_to_journal(self, entry):
+        if self.journal_file is None:
+            self.journal_file = open(self._get_journal_file_name(), 'ab')
+        data = pickle.dumps((self.journal_id, entry), pickle.HIGHEST_PROTOCOL)
+        self.journal_file.write(self._journal_header.pack(len(data)) + data)
+        self.journal_file.flush()
+
+    def get_journal(self):
+        entries = []
+        if not os.path.isfile(self._get_journal_file_name()):
+            return entries
+        with open(self._get_journal_file_name(), 'rb') as journal_file:
+            while True:
+                header = journal_file.read(self._journal_header.size)
+                if len(header) < self._journal_header.size:
+                    break
+                length, = self._journal_header.unpack(header)
+                data = journal_file.read(length)
+                # Only the last entry can be incomplete, if appending it failed
+                if len(data) < length:
+                    break
+                journal_id, entry = pickle.loads(data)
+                if journal_id == self.journal_id:
+                    entries.append(entry)
+        return entries
+
+    def _clear_journal(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+        remove_if_exists(self._get_journal_file_name())
+
     def get_last_position(self):
         if not os.path.isfile(self._get_persistence_file_name()):
             raise ValueError(
@@ -40,17 +91,26 @@ class PicklePersistence(BasePersistence):
         persistence_object = pickle.load(persistence_file)
         persistence_file.close()
         self.last_position = persistence_object['last_position']
+        self.journal_id = persistence_object.get('journal_id', 0)
         return self.last_position
 
+    def _write_persistence_object(self, persistence_object):
+        file_name = self._get_persistence_file_name()
+        with open(file_name + '.tmp', 'w') as persistence_file:
+            pickle.dump(persistence_object, persistence_file)
+        os.rename(file_name + '.tmp', file_name)
+
     def commit_position(self, last_position=None):
         self.last_position = last_position
         persistence_object = {
             'persistence_state_id': self.persistence_state_id,
             'last_position': self.last_position,
-            'configuration': str(self.configuration)
+            'configuration': str(self.configuration),
+            'journal_id': self.journal_id + 1,
         }
-        with open(self._get_persistence_file_name(), 'w') as persistence_file:
-            pickle.dump(persistence_object, persistence_file)
+        self._write_persistence_object(persistence_object)
+        self._clear_journal()
+        self.journal_id += 1
         self.logger.debug('Commited batch number ' + str(self.last_position) + ' of job: ' +
                           self.persistence_state_id)
         self.set_metadata('commited_positions',
@@ -63,15 +123,16 @@ class PicklePersistence(BasePersistence):
             'last_position': None,
             'configuration': str(self.configuration)
         }
-        with open(self._get_persistence_file_name(), 'w') as persistence_file:
-            pickle.dump(persistence_object, persistence_file)
+        self._write_persistence_object(persistence_object)
 
         self.logger.debug('Created persistence pickle file in ' +
                           self.read_option('file_path') + self.persistence_state_id)
         return self.persistence_state_id
 
     def close(self):
-        pass
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
 
     @staticmethod
     def configuration_from_uri(uri, uri_regex):
@@ -88,4 +149,5 @@ class PicklePersistence(BasePersistence):
         return configuration
 
     def delete(self):
+        self._clear_journal()
         remove_if_exists(self.persistence_file_name)
@@ -1,30 +1,91 @@
 import six
 import ast
+import calendar
+import datetime
+import itertools
+import math
+import random
+import re
 
 from .exceptions import InvalidExpression
 
 
+CONTEXT_MODULES = dict(
+    datetime=datetime,
+    re=re,
+    itertools=itertools,
+    calendar=calendar,
+    math=math,
+    random=random,
+)
+
+
 def create_context(**kwargs):
-    import datetime
-    import re
-    import itertools
-    import calendar
-    import math
-    import random
     context = dict(kwargs)
-    context.update(
-        dict(
-            datetime=datetime,
-            re=re,
-            itertools=itertools,
-            calendar=calendar,
-            math=math,
-            random=random,
-        ),
-    )
+    context.update(CONTEXT_MODULES)
     return context
 
 
+class CompiledExpression(object):
+    """
+    A python expression that has already been checked and compiled to a code
+    object, so it can be evaluated once per item without parsing it again.
+    """
+
+    def __init__(self, expression, code):
+        self.expression = expression
+        self.code = code
+
+    def eval(self, context):
+        return eval(self.code, context)
+
+    def __repr__(self):
+        return 'CompiledExpression({!r})'.format(self.expression)
+
+
+# Compiled expressions are shared by every module in the process, so
+# the same expression is only parsed and checked once.
+_compiled_expressions = {}
+
+
+def compile_expression(expression, interpreter=None):
+    """
+    Return a CompiledExpression for the given expression, checking and
+    compiling it only the first time it is seen.
+    """
+    try:
+        return _compiled_expressions[expression]
+    except (KeyError, TypeError):
+        pass
+    interpreter = interpreter or Interpreter()
+    compiled = interpreter.compile(expression)
+    _compiled_expressions[expression] = compiled
+    return compiled
+
+
+class ExpressionEvaluator(object):
+    """
+    Evaluates a list of compiled expressions against items. Every item gets a
+    fresh copy of the base context, so names leaked by an expression (e.g. list
+    comprehension variables on python 2) don't carry over to the next item.
+    """
+
+    def __init__(self, expressions, **context_vars):
+        self.expressions = [compile_expression(e) for e in expressions]
+        self.context = create_context(**context_vars)
+
+    def eval_all(self, item):
+        context = dict(self.context, item=item)
+        return [expression.eval(context) for expression in self.expressions]
+
+    def eval(self, item):
+        """
+        Evaluate the first expression only, which is handy for modules
+        configured with a single expression.
+        """
+        return self.expressions[0].eval(dict(self.context, item=item))
+
+
 class Interpreter(object):
 
     ast_allowed_nodes = (
@@ -75,6 +136,14 @@ class Interpreter(object):
 
         self._check_node(start_node)
 
+    def compile(self, expression):
+        """
+        Check the expression and compile it, returning a CompiledExpression
+        """
+        self.check(expression)
+        code = compile(expression, '<python_expression>', 'eval')
+        return CompiledExpression(expression, code)
+
     def eval(self, expression, context=None, check=True):
         if check:
             self.check(expression)
@@ -1,11 +1,152 @@
 import six
+import sys
+from collections import deque
+from threading import Event, Thread
 from exporters.default_retries import retry_generator
+from exporters.export_managers.pipeline_queue import PipelineQueue, END_OF_QUEUE
 from exporters.readers.base_reader import BaseReader
 from exporters.iterio import cohere_stream
 from exporters.decompressors import ZLibDecompressor
 from exporters.deserializers import JsonLinesDeserializer
 
 
+class PrefetchedStream(object):
+    """
+    Downloads and decompresses a stream in a background thread, keeping at
+    most buffer_chunks decompressed chunks in memory until they are read.
+    """
+
+    def __init__(self, reader, stream_data, buffer_chunks):
+        self.stream_data = stream_data
+        self.checkpoint = reader.get_stream_checkpoint(stream_data.filename)
+        self.cancelled = Event()
+        self.chunks = PipelineQueue(stream_data.filename, buffer_chunks, self.cancelled)
+        self.error = None
+        self.thread = Thread(target=self._fill, args=(reader,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _fill(self, reader):
+        try:
+            chunks = reader.open_decompressed(self.stream_data, self.checkpoint[0])
+            try:
+                for chunk in chunks:
+                    if self.cancelled.is_set():
+                        break
+                    self.chunks.put(chunk)
+            finally:
+                chunks.close()
+        except Exception:
+            self.error = sys.exc_info()
+        self.chunks.put(END_OF_QUEUE)
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self.chunks.get()
+                if chunk is END_OF_QUEUE:
+                    break
+                yield chunk
+            if self.error:
+                six.reraise(*self.error)
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    close = cancel
+
+
+class StreamCheckpoints(object):
+    """
+    Iterates decompressed chunks, matching the restart offsets reported by
+    the decompressor with the ends of the deserialized items. This gives the
+    (byte_offset, items) checkpoints a stream can be resumed from: reading
+    from byte_offset of the compressed stream yields the items after the
+    first `items` ones.
+    """
+
+    def __init__(self, chunks, items):
+        self.chunks = chunks
+        self.position = 0
+        self.restart_points = deque()
+        self.last_item_end = 0
+        self.last_item_count = items
+
+    def __iter__(self):
+        for chunk, offset in self.chunks:
+            self.position += len(chunk)
+            if offset is not None:
+                self.restart_points.append((self.position, offset))
+            if chunk:
+                yield chunk
+
+    def item_read(self, position, items):
+        """
+        Called after every deserialized item with the decompressed position
+        where it ends. Returns a new checkpoint, or None.
+        """
+        checkpoint = None
+        while self.restart_points and self.restart_points[0][0] <= position:
+            restart_position, offset = self.restart_points.popleft()
+            # Restart points in the middle of an item are useless. A restart
+            # point at the end of the previous item may be found late, as the
+            # decompressor only reports it when reading the next chunk.
+            if restart_position == position:
+                checkpoint = (offset, items)
+            elif restart_position == self.last_item_end:
+                checkpoint = (offset, self.last_item_count)
+        self.last_item_end = position
+        self.last_item_count = items
+        return checkpoint
+
+
+class StreamPrefetcher(object):
+    """
+    Iterates the streams of a reader, opening up to `size` upcoming streams
+    in advance. Streams are still returned in their original order.
+    """
+
+    buffer_chunks = 64
+
+    def __init__(self, reader, streams, size):
+        self.reader = reader
+        self.streams = iter(streams)
+        self.size = size
+        self.pending = deque()
+
+    def __iter__(self):
+        try:
+            while True:
+                self._fill()
+                if not self.pending:
+                    break
+                stream_data, prefetched = self.pending.popleft()
+                if prefetched is not None:
+                    self.reader.prefetched_streams[stream_data.filename] = prefetched
+                yield stream_data
+        finally:
+            self.close()
+
+    def _fill(self):
+        while len(self.pending) < self.size:
+            stream_data = next(self.streams, None)
+            if stream_data is None:
+                break
+            if stream_data.filename in self.reader.last_position['readed_streams']:
+                prefetched = None  # already read, it will be skipped
+            else:
+                prefetched = PrefetchedStream(self.reader, stream_data, self.buffer_chunks)
+            self.pending.append((stream_data, prefetched))
+
+    def close(self):
+        for _, prefetched in self.pending:
+            if prefetched is not None:
+                prefetched.cancel()
+        self.pending.clear()
+
+
 class StreamBasedReader(BaseReader):
     """
     Abstract readers for storage backends that operate in bytes
@@ -24,41 +165,113 @@ class StreamBasedReader(BaseReader):
         'batch_size': {'type': six.integer_types, 'default': 10000},
     }
 
+    # Number of upcoming streams to download in advance
+    prefetch_streams = 0
+
+    # Function telling whether a raw line may hold an item the pipeline keeps,
+    # used by deserializers to skip the lines that don't. See get_raw_line_filter
+    # of filters.
+    raw_line_filter = None
+
+    # Whether open_stream accepts a byte offset to start reading from. If so,
+    # streams are resumed from the closest checkpoint, instead of reading
+    # and skipping all the items already read.
+    resumable_streams = False
+
     def __init__(self, *args, **kwargs):
         super(StreamBasedReader, self).__init__(*args, **kwargs)
         self.iterator = None
         self.batch_size = self.read_option('batch_size')
+        self.prefetched_streams = {}
+        self.set_metadata('raw_lines_filtered_out', 0)
 
     decompressor = ZLibDecompressor({}, None)
     deserializer = JsonLinesDeserializer({}, None)
 
     @retry_generator
     def iteritems_retrying(self, stream_data):
-        if stream_data.filename in self.last_position['readed_streams']:
+        filename = stream_data.filename
+        if filename in self.last_position['readed_streams']:
             return
-        stream = cohere_stream(self.open_stream(stream_data))
+        prefetched = self.prefetched_streams.pop(filename, None)
+        if prefetched is not None:
+            byte_offset, items_readed = prefetched.checkpoint
+            chunks = prefetched
+        else:
+            byte_offset, items_readed = self.get_stream_checkpoint(filename)
+            chunks = self.open_decompressed(stream_data, byte_offset)
+        checkpoints = StreamCheckpoints(chunks, items_readed)
+        stream = cohere_stream(iter(checkpoints))
+        track_checkpoints = self.resumable_streams and self.deserializer.resumable
+        stream_offset = self.last_position['stream_offset']
+        stream_checkpoint = self.last_position['stream_checkpoint']
         try:
-            stream = self.decompressor.decompress(stream)
-            stream = cohere_stream(stream)
-            items_readed = 0
-            stream_offset = self.last_position['stream_offset']
-            items_offset = stream_offset.get(stream_data.filename, 0)
-            for item in self.deserializer.deserialize(stream):
+            items_offset = stream_offset.get(filename, 0)
+            items = self.deserializer.deserialize_with_positions(stream, self.raw_line_filter)
+            for item, position in items:
+                # Lines skipped by the raw line filter count as items, so
+                # offsets don't depend on it
                 items_readed += 1
+                if track_checkpoints:
+                    checkpoint = checkpoints.item_read(position, items_readed)
+                    if checkpoint is not None:
+                        stream_checkpoint[filename] = list(checkpoint)
                 if items_readed > items_offset:
-                    stream_offset[stream_data.filename] = items_readed
+                    stream_offset[filename] = items_readed
+                    if item is None:
+                        self.set_metadata('raw_lines_filtered_out',
+                                          self.get_metadata('raw_lines_filtered_out') + 1)
+                        continue
                     yield item
         finally:
             stream.close()
-        self.last_position['readed_streams'].append(stream_data.filename)
-        del stream_offset[stream_data.filename]
+            chunks.close()
+        self.last_position['readed_streams'].append(filename)
+        stream_offset.pop(filename, None)
+        stream_checkpoint.pop(filename, None)
+
+    def open_decompressed(self, stream_data, byte_offset=0):
+        """
+        Opens a stream from the given compressed byte offset, returning a
+        generator of (chunk, offset) pairs, where offset is the absolute
+        position the stream can be resumed from after the chunk, or None.
+        """
+        if stream_data.size is not None and byte_offset >= stream_data.size:
+            # Checkpoint at the end of the stream, there is nothing left to
+            # read (and S3 would reject the range request)
+            return
+        if byte_offset:
+            stream = cohere_stream(self.open_stream(stream_data, byte_offset))
+        else:
+            stream = cohere_stream(self.open_stream(stream_data))
+        try:
+            for chunk, offset in self.decompressor.decompress_with_offsets(stream):
+                yield chunk, None if offset is None else byte_offset + offset
+        finally:
+            stream.close()
+
+    def get_stream_checkpoint(self, filename):
+        """
+        Returns the (byte_offset, items) checkpoint to resume a stream from
+        """
+        byte_offset, items = self.last_position['stream_checkpoint'].get(filename, (0, 0))
+        return byte_offset, items
 
     def iteritems(self):
-        for stream in self.get_read_streams():
+        streams = self.get_read_streams()
+        if self.prefetch_streams:
+            streams = StreamPrefetcher(self, streams, self.prefetch_streams)
+        for stream in streams:
             for record in self.iteritems_retrying(stream):
                 yield record
+            self.finish_stream(stream)
         self.finished = True
 
+    def finish_stream(self, stream_data):
+        """
+        Called once all the items of a stream have been read
+        """
+
     def get_next_batch(self):
         """
         This method is called from the manager. It must return a list or a generator
@@ -88,6 +301,7 @@ class StreamBasedReader(BaseReader):
         last_position = last_position or {}
         last_position.setdefault('readed_streams', [])
         last_position.setdefault('stream_offset', {})
+        last_position.setdefault('stream_checkpoint', {})
         self.last_position = last_position
 
 
@@ -130,8 +130,13 @@ class FSReader(StreamBasedReader):
             if all(mf(filepath) for mf in match_funcs)
         ]
 
-    def open_stream(self, stream):
-        return open(stream.filename, 'rb')
+    resumable_streams = True
+
+    def open_stream(self, stream, byte_offset=0):
+        file_obj = open(stream.filename, 'rb')
+        if byte_offset:
+            file_obj.seek(byte_offset)
+        return file_obj
 
     def get_read_streams(self):
         for fpath in sorted(self.files):
@@ -2,7 +2,10 @@ import six
 import httplib
 import re
 import datetime
-from six.moves.urllib.request import urlopen
+import threading
+from collections import deque, namedtuple
+from multiprocessing.pool import ThreadPool
+from six.moves.urllib.request import Request, urlopen
 from exporters.readers.base_stream_reader import StreamBasedReader
 from exporters.default_retries import retry_short
 from exporters.exceptions import ConfigurationError, InvalidDateRangeError
@@ -12,6 +15,9 @@ from exporters.utils import get_bucket_name, get_boto_connection
 
 S3_URL_EXPIRES_IN = 1800  # half an hour should be enough
 
+# Key details taken from the bucket listing, so no extra request is needed to get them
+S3KeyInfo = namedtuple('S3KeyInfo', 'name size etag last_modified')
+
 
 def patch_http_response_read(func):
     def inner(*args):
@@ -37,6 +43,81 @@ def get_bucket(bucket, aws_access_key_id, aws_secret_access_key, **kwargs):
         return connection.get_bucket(bucket, validate=False)
 
 
+class KeysNotDeleted(Exception):
+    """
+    This exception is thrown when S3 could not delete some of the keys
+    """
+
+
+class S3KeysDeleter(object):
+    """
+    Deletes keys of a bucket with multi-object delete requests of up to
+    batch_size keys. Requests are sent from background threads, with up to
+    concurrency of them at the same time, while more keys are queued.
+
+    pending_keys() returns the keys not known to be deleted yet, so they can
+    be persisted and deleted again when resuming.
+    """
+
+    batch_size = 1000
+
+    def __init__(self, bucket, logger, concurrency=2):
+        self.bucket = bucket
+        self.logger = logger
+        self.concurrency = concurrency
+        self.pool = None
+        self.batch = []
+        self.requests = deque()
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def delete(self, key_name):
+        with self.lock:
+            self.pending.add(key_name)
+        self.batch.append(key_name)
+        if len(self.batch) >= self.batch_size:
+            self._send_batch()
+
+    def _send_batch(self):
+        while len(self.requests) >= self.concurrency:
+            self.requests.popleft().get()
+        if self.pool is None:
+            self.pool = ThreadPool(self.concurrency)
+        batch, self.batch = self.batch, []
+        self.requests.append(self.pool.apply_async(self._delete_batch, (batch,)))
+
+    @retry_short
+    def _delete_batch(self, key_names):
+        result = self.bucket.delete_keys(key_names, quiet=True)
+        failed = {error.key: error for error in result.errors}
+        with self.lock:
+            self.pending.difference_update(k for k in key_names if k not in failed)
+        if failed:
+            error = next(six.itervalues(failed))
+            raise KeysNotDeleted('Could not delete {} keys, e.g. {}: {}'.format(
+                len(failed), error.key, error.message))
+        self.logger.info('Deleted {} keys'.format(len(key_names)))
+
+    def flush(self):
+        """
+        Deletes the queued keys, waiting until all of them are deleted.
+        """
+        if self.batch:
+            self._send_batch()
+        while self.requests:
+            self.requests.popleft().get()
+
+    def pending_keys(self):
+        with self.lock:
+            return sorted(self.pending)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
 def format_prefixes(prefixes, start, end):
     import dateparser
     start_date = dateparser.parse(start or 'today')
@@ -107,12 +188,12 @@ class S3BucketKeysFetcher(object):
             for key in self.source_bucket.list(prefix=prefix):
                 if self.pattern:
                     if self._should_add_key(key):
-                        keys.append(key.name)
+                        keys.append(self._key_info(key))
                     else:
                         self.logger.info(
                             'Skipping S3 key {}. No match with pattern'.format(key.name))
                 else:
-                    keys.append(key.name)
+                    keys.append(self._key_info(key))
         if self.pattern and not keys:
             self.logger.warn(
                 'No S3 keys found that match provided pattern: {}'.format(self.pattern))
@@ -121,9 +202,18 @@ class S3BucketKeysFetcher(object):
     def _should_add_key(self, key):
         return bool(re.findall(self.pattern, key.name))
 
-    def pending_keys(self):
+    def _key_info(self, key):
+        return S3KeyInfo(key.name, key.size, key.etag, key.last_modified)
+
+    def pending_keys_info(self):
+        """
+        Returns a S3KeyInfo for every key to be read, in listing order.
+        """
         return self._get_keys_from_bucket()
 
+    def pending_keys(self):
+        return [key_info.name for key_info in self.pending_keys_info()]
+
 
 class S3Reader(StreamBasedReader):
     """
@@ -154,7 +244,13 @@ class S3Reader(StreamBasedReader):
             discarded by the reader.
 
         - delete_keys (bool)
-            Delete keys. Good for bypassing s3 to s3 pipelines
+            Delete keys once they are read. Good for bypassing s3 to s3 pipelines.
+            They are deleted in batches in the background, and the keys still being
+            deleted are kept in the reader position to delete them when resuming.
+
+        - prefetch_keys (int)
+            Number of upcoming keys to download and decompress concurrently while
+            the current one is being read. Items are still read in keys order.
     """
 
     # List of options to set up the reader
@@ -173,12 +269,14 @@ class S3Reader(StreamBasedReader):
         'pattern': {'type': six.string_types, 'default': None},
         'prefix_format_using_date': {'type': six.string_types + (tuple, list), 'default': None},
         'delete_keys': {'type': bool, 'default': False},
+        'prefetch_keys': {'type': six.integer_types, 'default': 0},
     }
 
     def __init__(self, *args, **kwargs):
         super(S3Reader, self).__init__(*args, **kwargs)
         bucket_name = self.read_option('bucket')
         self.delete_keys = self.read_option('delete_keys')
+        self.prefetch_streams = self.read_option('prefetch_keys')
         self.logger.info('Starting S3Reader for bucket: %s' % bucket_name)
 
         self.bucket = get_bucket(bucket_name,
@@ -188,18 +286,65 @@ class S3Reader(StreamBasedReader):
         self.keys_fetcher = S3BucketKeysFetcher(self.options,
                                                 self.read_option('aws_access_key_id'),
                                                 self.read_option('aws_secret_access_key'))
-        self.keys = self.keys_fetcher.pending_keys()
+        self.keys_info = {}
+        self.keys = []
+        for key_info in self.keys_fetcher.pending_keys_info():
+            self.keys_info[key_info.name] = key_info
+            self.keys.append(key_info.name)
+        self.keys_deleter = None
+        if self.delete_keys:
+            self.keys_deleter = S3KeysDeleter(self.bucket, self.logger)
         self.logger.info('S3Reader has been initiated with delete_keys={}'.format(self.delete_keys))
 
-    def open_stream(self, stream):
+    resumable_streams = True
+
+    def open_stream(self, stream, byte_offset=0):
         self.logger.info('Opening {}'.format(stream.filename))
-        return urlopen(self.bucket.get_key(stream.filename).generate_url(S3_URL_EXPIRES_IN))
+        # Signing the url doesn't need any request, so we don't fetch the key
+        key = self.bucket.new_key(stream.filename)
+        request = Request(key.generate_url(S3_URL_EXPIRES_IN))
+        if byte_offset:
+            self.logger.info('Resuming {} from byte {}'.format(stream.filename, byte_offset))
+            request.add_header('Range', 'bytes={}-'.format(byte_offset))
+        return urlopen(request)
 
     def get_read_streams(self):
         from exporters.bypasses.stream_bypass import Stream
         for key_name in self.keys:
-            key = self.bucket.get_key(key_name)
-            yield Stream(key_name, key.size, None)
-            if self.delete_keys:
-                self.logger.info("S3READER: DELETING key {}".format(key_name))
-                key.delete()
+            yield Stream(key_name, self.keys_info[key_name].size, None)
+            # When prefetching, upcoming streams are requested before the
+            # current one is read, so keys are deleted in finish_stream
+            if self.delete_keys and not self.prefetch_streams:
+                self._delete_key(key_name)
+        if self.delete_keys:
+            self.keys_deleter.flush()
+
+    def iteritems(self):
+        for record in super(S3Reader, self).iteritems():
+            yield record
+        if self.delete_keys:
+            self.keys_deleter.flush()
+
+    def finish_stream(self, stream_data):
+        if self.delete_keys and self.prefetch_streams:
+            self._delete_key(stream_data.filename)
+
+    def _delete_key(self, key_name):
+        self.logger.info("S3READER: DELETING key {}".format(key_name))
+        self.keys_deleter.delete(key_name)
+
+    def set_last_position(self, last_position):
+        super(S3Reader, self).set_last_position(last_position)
+        if self.delete_keys:
+            for key_name in self.last_position.get('pending_deletes', []):
+                self._delete_key(key_name)
+
+    def get_last_position(self):
+        if self.delete_keys:
+            self.last_position['pending_deletes'] = self.keys_deleter.pending_keys()
+        return self.last_position
+
+    def close(self):
+        if self.keys_deleter is not None:
+            self.keys_deleter.close()
+        super(S3Reader, self).close()
@@ -0,0 +1,127 @@
+import json
+
+from six.moves import copyreg
+
+from exporters.records.base_record import BaseRecord
+
+
+class LazyRecord(BaseRecord):
+    """
+    A record keeping the raw JSON it was read from, which is only decoded when
+    its fields are first accessed. Until the record may have changed, raw keeps
+    that JSON, so formatters can write it back as it was read without encoding it.
+
+    Nested lists and dicts can be changed in place without the record knowing,
+    so raw is dropped as soon as any of them is handed out, e.g. by
+    record['tags'] or record.items(). Reading other values keeps it.
+
+    Records are decoded by their dict methods. Code reading them through the
+    C API of dicts instead (e.g. json.dumps, or dict(record) on python 2) must
+    call decode() first (see decode_records), and can't change them.
+    """
+    raw = None
+    _decoded = True
+
+    def __init__(self, raw, loads=json.loads):
+        super(LazyRecord, self).__init__()
+        self.raw = raw
+        self._loads = loads
+        self._decoded = False
+
+    def decode(self):
+        """
+        Decodes the raw JSON into the record, if it wasn't yet.
+        """
+        if not self._decoded:
+            self._decoded = True
+            dict.update(self, self._loads(self.raw))
+        return self
+
+    def __reduce_ex__(self, protocol):
+        state = dict(vars(self))
+        if self.raw is not None:
+            # Unchanged records are rebuilt from their raw JSON
+            state['_decoded'] = False
+            return copyreg.__newobj__, (type(self),), state
+        return copyreg.__newobj__, (type(self),), state, None, iter(dict.items(self))
+
+
+def decode_records(batch):
+    """
+    Yields the items of batch, decoding the lazy records among them first.
+    Invalid JSON lines raise here, instead of being written back as read.
+    """
+    for item in batch:
+        if isinstance(item, LazyRecord):
+            item.decode()
+        yield item
+
+
+def _reading(name):
+    method = getattr(dict, name)
+
+    def read(self, *args, **kwargs):
+        if not self._decoded:
+            self.decode()
+        return method(self, *args, **kwargs)
+    read.__name__ = name
+    return read
+
+
+def _mutable(value):
+    return isinstance(value, (dict, list))
+
+
+def _handing_out_value(name):
+    method = getattr(dict, name)
+
+    def read(self, *args, **kwargs):
+        if not self._decoded:
+            self.decode()
+        value = method(self, *args, **kwargs)
+        if self.raw is not None and _mutable(value):
+            self.raw = None
+        return value
+    read.__name__ = name
+    return read
+
+
+def _handing_out_values(name):
+    method = getattr(dict, name)
+
+    def read(self, *args, **kwargs):
+        if not self._decoded:
+            self.decode()
+        if self.raw is not None and any(_mutable(value) for value in dict.values(self)):
+            self.raw = None
+        return method(self, *args, **kwargs)
+    read.__name__ = name
+    return read
+
+
+def _changing(name):
+    method = getattr(dict, name)
+
+    def change(self, *args, **kwargs):
+        if not self._decoded:
+            self.decode()
+        self.raw = None
+        return method(self, *args, **kwargs)
+    change.__name__ = name
+    return change
+
+
+for _name in ['__contains__', '__iter__', '__len__', '__eq__', '__ne__', '__repr__',
+              'keys', 'iterkeys', 'viewkeys', 'has_key']:
+    if hasattr(dict, _name):
+        setattr(LazyRecord, _name, _reading(_name))
+
+for _name in ['__getitem__', 'get']:
+    setattr(LazyRecord, _name, _handing_out_value(_name))
+
+for _name in ['values', 'items', 'itervalues', 'iteritems', 'viewvalues', 'viewitems', 'copy']:
+    if hasattr(dict, _name):
+        setattr(LazyRecord, _name, _handing_out_values(_name))
+
+for _name in ['__setitem__', '__delitem__', 'pop', 'popitem', 'setdefault', 'update', 'clear']:
+    setattr(LazyRecord, _name, _changing(_name))
@@ -1,3 +1,4 @@
+from exporters.records.lazy_record import decode_records
 from exporters.transform.base_transform import BaseTransform
 
 
@@ -26,5 +27,5 @@ class FlatsonTransform(BaseTransform):
                 self.flatson_schema))
 
     def transform_batch(self, batch):
-        for record in batch:
+        for record in decode_records(batch):
             yield self.flatson.flatten_dict(record)
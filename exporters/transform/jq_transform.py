@@ -1,6 +1,7 @@
 import six
 import yaml
 from exporters.records.base_record import BaseRecord
+from exporters.records.lazy_record import decode_records
 from exporters.transform.base_transform import BaseTransform
 
 
@@ -33,7 +34,8 @@ class JQTransform(BaseTransform):
         self.jq_program = _compile_jq(self.jq_expression)
 
     def transform_batch(self, batch):
-        for item in batch:
+        # jq reads items as plain dicts, so lazy records must be decoded
+        for item in decode_records(batch):
             try:
                 transformed_item = self.jq_program.transform(item)
             except StopIteration:
@@ -1,5 +1,5 @@
 from exporters.transform.base_transform import BaseTransform
-from exporters.python_interpreter import Interpreter, create_context
+from exporters.python_interpreter import ExpressionEvaluator
 from exporters.utils import str_list
 
 
@@ -20,16 +20,14 @@ class PythonexpTransform(BaseTransform):
         self.python_expressions = self.read_option('python_expressions')
         if not self.is_valid_python_expression(self.python_expressions):
             raise ValueError('Python expression is not valid')
-        self.interpreter = Interpreter()
+        self.evaluator = ExpressionEvaluator(self.python_expressions)
         self.logger.info('PythonexpTransform has been initiated. Expressions: {!r}'.format(
             self.python_expressions)
         )
 
     def transform_batch(self, batch):
         for item in batch:
-            context = create_context(item=item)
-            for expression in self.python_expressions:
-                self.interpreter.eval(expression, context=context)
+            self.evaluator.eval_all(item)
             yield item
         self.logger.debug('Transformed items')
 
@@ -1,10 +1,7 @@
-import os
-
 from exporters.utils import remove_if_exists
 from exporters.pipeline.base_pipeline_item import BasePipelineItem
 from exporters.writers.filebase_base_writer import FilebasedGroupingBufferFilesTracker
 
-from .utils import hash_for_file
 from .grouping import GroupingBufferFilesTracker
 
 
@@ -44,17 +41,19 @@ class WriteBuffer(BasePipelineItem):
         (by gathering statistics).
         """
         self.finish_buffer_write(key)
-        file_path = self.items_group_files.get_current_buffer_file_for_group(key).path
+        buffer_file = self.items_group_files.get_current_buffer_file_for_group(key)
+        file_path = buffer_file.path
         file_hash = None
         if self.hash_algorithm:
-            file_hash = hash_for_file(file_path, self.hash_algorithm)
+            file_hash = buffer_file.get_hash(self.hash_algorithm)
 
-        file_size = os.path.getsize(file_path)
+        file_size = buffer_file.file_size
         write_info = {
             'number_of_records': self.grouping_info[key]['buffered_items'],
             'file_path': file_path,
             'size': file_size,
             'file_hash': file_hash,
+            'multipart_etag': buffer_file.multipart_etag,
         }
         self.set_metadata_for_file(file_path, **write_info)
         return write_info
@@ -67,9 +66,10 @@ class WriteBuffer(BasePipelineItem):
         remove_if_exists(write_info.get('file_path'))
 
     def should_write_buffer(self, key):
-        if self.size_per_buffer_write and os.path.getsize(
-                self.grouping_info[key]['group_file'][-1].path) >= self.size_per_buffer_write:
-            return True
+        if self.size_per_buffer_write:
+            buffer_file = self.grouping_info[key]['group_file'][-1]
+            if buffer_file.reached_size(self.size_per_buffer_write):
+                return True
         buffered_items = self.grouping_info[key].get('buffered_items', 0)
         return buffered_items >= self.items_per_buffer_write
 
@@ -3,11 +3,12 @@ import shutil
 import tempfile
 import uuid
 import re
+import six
 from six.moves import UserDict
 
-from exporters.compression import get_compress_file
+from exporters.compression import get_compress_file, STREAM_COMPRESSION
 
-from .utils import get_filename
+from .utils import get_filename, hash_for_file, HashingFile
 
 
 class GroupingInfo(UserDict):
@@ -59,41 +60,126 @@ class GroupingInfo(UserDict):
 
 
 class BufferFile(object):
+    """File where items are buffered before being written.
+
+    It counts the uncompressed bytes written to it (size), so checking its
+    size doesn't need to stat the file for every item. Unicode content is
+    written encoded as UTF-8. compressed_size is
+    the size of the file on disk the last time it was checked by reached_size.
+
+    If a hash_algorithm is given, the compressed output is hashed while it is
+    written, so the file hash and its multipart upload ETag are known when
+    the file is finished without reading it again.
+
+    If an output HashingFile is given, the compressed output is written to
+    it instead of to a file in tmp_folder.
+    """
+
+    # Once the uncompressed size is over the limit, the file on disk is
+    # checked every time this fraction of the limit is written
+    size_check_fraction = 32
 
     def __init__(self, formatter, tmp_folder, compression_format,
-                 file_name=None, hash_algorithm='md5'):
+                 file_name=None, hash_algorithm='md5', output=None):
         self.formatter = formatter
         self.tmp_folder = tmp_folder
         self.file_extension = formatter.file_extension
         self.compression_format = compression_format
         self.path = self._get_new_path_name(file_name)
+        self.hash_algorithm = hash_algorithm
+        self.hashing_file = output
         self.file = self._create_file()
+        self.size = 0
+        self.compressed_size = 0
+        self._size_checked = None
         header = self.formatter.format_header()
         if header:
-            self.file.write(header)
+            self._write(header)
 
     def _create_file(self):
+        if self.hashing_file is not None:
+            return STREAM_COMPRESSION[self.compression_format](self.hashing_file)
+        # Zip files are compressed when closed, so they are hashed afterwards
+        if self.hash_algorithm and self.compression_format in STREAM_COMPRESSION:
+            self.hashing_file = HashingFile(self.path, self.hash_algorithm)
+            return STREAM_COMPRESSION[self.compression_format](self.hashing_file)
         return get_compress_file(self.compression_format)(self.path)
 
+    def _close_file(self):
+        self.file.close()
+        if self.hashing_file is not None:
+            self.hashing_file.close()
+
     def _get_new_path_name(self, file_name):
         if not file_name:
             file_name = get_filename(uuid.uuid4(), self.file_extension, self.compression_format)
         return os.path.join(self.tmp_folder, file_name)
 
+    def _write(self, content):
+        # Count bytes, not characters, of unicode content
+        if isinstance(content, six.text_type):
+            content = content.encode('utf-8')
+        self.file.write(content)
+        self.size += len(content)
+
     def add_item_to_file(self, item):
         content = self.formatter.format(item)
         if content:
-            self.file.write(content)
+            self._write(content)
 
     def add_item_separator_to_file(self):
         content = self.formatter.item_separator
-        self.file.write(content)
+        self._write(content)
 
     def end_file(self):
         footer = self.formatter.format_footer()
         if footer:
-            self.file.write(footer)
-        self.file.close()
+            self._write(footer)
+        self._close_file()
+
+    def get_hash(self, algorithm):
+        """Hash of the finished file, only read again if it wasn't hashed while written.
+        """
+        if self.hashing_file is not None and algorithm == self.hash_algorithm:
+            return self.hashing_file.hexdigest()
+        return hash_for_file(self.path, algorithm)
+
+    @property
+    def file_size(self):
+        """Size of the finished file.
+        """
+        if self.hashing_file is not None:
+            return self.hashing_file.size
+        return os.path.getsize(self.path)
+
+    @property
+    def multipart_etag(self):
+        """ETag of the finished file if uploaded to S3 in CHUNK_SIZE parts, if known.
+        """
+        if self.hashing_file is not None:
+            return self.hashing_file.multipart_etag()
+
+    def reached_size(self, max_size):
+        """Whether the file has reached max_size bytes on disk.
+
+        Compressed data is never much bigger than the uncompressed one, so
+        the file on disk is only checked after writing max_size uncompressed
+        bytes, and then on every max_size / size_check_fraction bytes written.
+        Compressors buffer part of their output, so the size on disk lags a
+        bit behind. Hashed files count their compressed bytes, so they are
+        never checked on disk.
+        """
+        if self.size < max_size:
+            return False
+        if self.hashing_file is not None:
+            self.compressed_size = self.hashing_file.size
+        elif self.compression_format == 'none':
+            self.compressed_size = self.size
+        elif (self._size_checked is None or
+                self.size - self._size_checked >= max_size // self.size_check_fraction):
+            self._size_checked = self.size
+            self.compressed_size = os.path.getsize(self.path)
+        return self.compressed_size >= max_size
 
 
 class GroupingBufferFilesTracker(object):
@@ -110,6 +196,7 @@ class GroupingBufferFilesTracker(object):
         self.formatter = formatter
         self.tmp_folder = tempfile.mkdtemp()
         self.compression_format = compression_format
+        self.hash_algorithm = kwargs.get('hash_algorithm')
 
     def add_item_to_file(self, item, key):
         buffer_file = self.get_current_buffer_file_for_group(key)
@@ -143,6 +230,7 @@ class GroupingBufferFilesTracker(object):
     def _create_grouping_info(self):
         return GroupingInfo()
 
-    def _create_buffer_file(self, file_name=None):
-        return BufferFile(self.formatter, self.tmp_folder,
-                          self.compression_format, file_name=file_name)
+    def _create_buffer_file(self, file_name=None, output=None):
+        return BufferFile(self.formatter, self.tmp_folder, self.compression_format,
+                          file_name=file_name, hash_algorithm=self.hash_algorithm,
+                          output=output)
@@ -35,6 +35,8 @@ class InMemoryBufferFile(BufferFile):
         self.file_extension = formatter.file_extension
         self.compression_format = compression_format
         self.path = self._get_new_path_name(file_name)
+        self.hash_algorithm = hash_algorithm
+        self.hashing_file = None
         self.sample_size = sample_size
         self.items = []
 
@@ -63,7 +65,7 @@ class InMemoryBufferFile(BufferFile):
         footer = self.formatter.format_footer()
         if footer:
             self.file.write(footer)
-        self.file.close()
+        self._close_file()
 
     def end_file(self):
         self._dump_items_to_file()
@@ -77,7 +79,8 @@ class ReservoirSamplingGroupingBufferFilesTracker(GroupingBufferFilesTracker):
     def __init__(self, formatter, compression_format, **kwargs):
         self.sample_size = kwargs.get('sample_size', 1000)
         super(ReservoirSamplingGroupingBufferFilesTracker, self).__init__(formatter,
-                                                                          compression_format)
+                                                                          compression_format,
+                                                                          **kwargs)
 
     def add_item_to_file(self, item, key):
         buffer_file = self.get_current_buffer_file_for_group(key)
@@ -96,7 +99,8 @@ class ReservoirSamplingGroupingBufferFilesTracker(GroupingBufferFilesTracker):
 
     def _create_buffer_file(self, file_name=None):
         return InMemoryBufferFile(self.formatter, self.tmp_folder,
-                                  self.compression_format, self.sample_size, file_name=file_name)
+                                  self.compression_format, self.sample_size, file_name=file_name,
+                                  hash_algorithm=self.hash_algorithm)
 
 
 class FilebasedReservoirSamplingBufferFilesTracker(FilebasedGroupingBufferFilesTracker,
@@ -1,5 +1,7 @@
 import hashlib
 
+from exporters.utils import CHUNK_SIZE
+
 
 def get_filename(name_without_ext, file_extension, compression_format):
     if compression_format != 'none':
@@ -14,3 +16,46 @@ def hash_for_file(path, algorithm, block_size=256*128):
         for chunk in iter(lambda: f.read(block_size), b''):
             hash.update(chunk)
     return hash.hexdigest()
+
+
+class HashingFile(object):
+    """File opened for appending that hashes the data written to it.
+
+    Besides hashing the whole content with the given algorithm, it keeps the
+    md5 of every part_size bytes, to get the ETag S3 gives to multipart
+    uploads of the file with that part size.
+
+    If fileobj is given, data is written to it instead of to path.
+    """
+
+    def __init__(self, path, algorithm, part_size=CHUNK_SIZE, fileobj=None):
+        self.name = path
+        self.file = fileobj if fileobj is not None else open(path, 'ab')
+        self.hash = hashlib.new(algorithm)
+        self.part_size = part_size
+        self.part_hashes = []
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.hash.update(data)
+        while data:
+            part_written = self.size % self.part_size
+            if not part_written:
+                self.part_hashes.append(hashlib.md5())
+            part, data = data[:self.part_size - part_written], data[self.part_size - part_written:]
+            self.part_hashes[-1].update(part)
+            self.size += len(part)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+    def multipart_etag(self):
+        digests = b"".join(m.digest() for m in self.part_hashes)
+        return '"%s-%s"' % (hashlib.md5(digests).hexdigest(), len(self.part_hashes))
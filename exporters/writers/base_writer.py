@@ -1,4 +1,7 @@
 import six
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 from exporters.export_formatter import DEFAULT_FORMATTER_CLASS
 from exporters.compression import FILE_COMPRESSION
 from exporters.exceptions import ConfigurationError
@@ -27,6 +30,11 @@ SIZE_PER_BUFFER_WRITE = 4000000000
 class BaseWriter(BasePipelineItem):
     """
     This module receives a batch and writes it where needed.
+
+        - upload_concurrency (int)
+            Number of buffer files to write at the same time, in background
+            threads, while items keep being buffered. 0 writes them in place.
+            Only available for writers with concurrent_uploads.
     """
     supported_options = {
         'items_per_buffer_write': {'type': six.integer_types, 'default': ITEMS_PER_BUFFER_WRITE},
@@ -37,10 +45,14 @@ class BaseWriter(BasePipelineItem):
         'write_buffer': {'type': six.string_types,
                          'default': 'exporters.write_buffers.base.WriteBuffer'},
         'write_buffer_options': {'type': dict, 'default': {}},
+        'upload_concurrency': {'type': six.integer_types, 'default': 0},
     }
 
     hash_algorithm = None
 
+    # Whether write() can be called from several threads at the same time
+    concurrent_uploads = False
+
     def __init__(self, options, metadata, *args, **kwargs):
         super(BaseWriter, self).__init__(options, metadata, *args, **kwargs)
         self.finished = False
@@ -52,8 +64,22 @@ class BaseWriter(BasePipelineItem):
         if self.export_formatter is None:
             self.export_formatter = DEFAULT_FORMATTER_CLASS(options=dict(), metadata=metadata)
         self.compression_format = self._get_compression_format()
+        self.upload_concurrency = self._get_upload_concurrency()
         self.write_buffer = self._get_write_buffer()
         self.set_metadata('items_count', 0)
+        # Held by write() around the state it shares with concurrent uploads
+        self.uploads_lock = Lock()
+        self.upload_pool = None
+        self.pending_uploads = deque()
+        self.uploads_submitted = 0
+        self.uploads_done = 0
+
+    def _get_upload_concurrency(self):
+        upload_concurrency = self.read_option('upload_concurrency')
+        if upload_concurrency and not self.concurrent_uploads:
+            raise ConfigurationError('{} does not support upload_concurrency'
+                                     ''.format(self.__class__.__name__))
+        return upload_concurrency
 
     def _get_compression_format(self):
         compression = self.read_option('compression')
@@ -74,6 +100,7 @@ class BaseWriter(BasePipelineItem):
         }
 
         file_handler = self._items_group_files_handler(write_buffer_class,
+                                                       hash_algorithm=self.hash_algorithm,
                                                        **write_buffer_options['options'])
         kwargs = {
              'items_per_buffer_write': self.read_option('items_per_buffer_write'),
@@ -133,11 +160,16 @@ class BaseWriter(BasePipelineItem):
         for key in self.grouping_info.keys():
             if self._should_flush(key):
                 self._write_current_buffer_for_group_key(key)
+        self.wait_for_uploads()
 
     def close(self):
         """
         Close all buffers, cleaning all temporary files.
         """
+        if self.upload_pool is not None:
+            self.upload_pool.terminate()
+            self.upload_pool.join()
+            self.upload_pool = None
         if self.write_buffer is not None:
             self.write_buffer.close()
 
@@ -167,10 +199,61 @@ class BaseWriter(BasePipelineItem):
         and writes it calling write() method.
         """
         write_info = self.write_buffer.pack_buffer(key)
-        self.write(write_info.get('file_path'),
-                   self.write_buffer.grouping_info[key]['membership'])
-        self.write_buffer.clean_tmp_files(write_info)
         self.write_buffer.add_new_buffer_for_group(key)
+        self._upload_buffer_file(write_info, self.write_buffer.grouping_info[key]['membership'])
+
+    def _upload_buffer_file(self, write_info, group_key):
+        """
+        Writes a packed buffer file, in the upload pool if upload_concurrency
+        is set. Only upload_concurrency files are written at the same time,
+        further files wait for the oldest upload to finish.
+        """
+        self.uploads_submitted += 1
+        if not self.upload_concurrency:
+            written = self._write_buffer_file(write_info, group_key)
+            self._buffer_file_written(write_info, written)
+            return
+        while len(self.pending_uploads) >= self.upload_concurrency:
+            self._wait_for_oldest_upload()
+        if self.upload_pool is None:
+            self.upload_pool = ThreadPool(self.upload_concurrency)
+        result = self.upload_pool.apply_async(self._write_buffer_file, (write_info, group_key))
+        self.pending_uploads.append((write_info, result))
+
+    def _wait_for_oldest_upload(self):
+        write_info, result = self.pending_uploads.popleft()
+        self._buffer_file_written(write_info, result.get())
+
+    def reap_uploads(self):
+        """
+        Process the buffer files whose upload has already finished, in order,
+        without waiting for the rest.
+        """
+        while self.pending_uploads and self.pending_uploads[0][1].ready():
+            self._wait_for_oldest_upload()
+
+    def wait_for_uploads(self):
+        """
+        Wait until all buffer files being uploaded are written. Errors
+        writing them are raised here.
+        """
+        while self.pending_uploads:
+            self._wait_for_oldest_upload()
+
+    def _write_buffer_file(self, write_info, group_key):
+        """
+        Writes a packed buffer file. With upload_concurrency, it runs in the
+        upload pool.
+        """
+        self.write(write_info.get('file_path'), group_key)
+
+    def _buffer_file_written(self, write_info, written):
+        """
+        Called in order once a buffer file has been written, with the value
+        returned by _write_buffer_file.
+        """
+        self.write_buffer.clean_tmp_files(write_info)
+        self.uploads_done += 1
 
     def finish_writing(self):
         """
@@ -180,6 +263,7 @@ class BaseWriter(BasePipelineItem):
         The default implementation calls self._check_write_consistency
         if option check_consistency is True.
         """
+        self.wait_for_uploads()
         if self.read_option('check_consistency'):
             self._check_write_consistency()
 
@@ -4,6 +4,7 @@ import os
 import re
 import uuid
 import six
+import threading
 
 from exporters.write_buffers.grouping import GroupingBufferFilesTracker
 from exporters.write_buffers.utils import get_filename
@@ -81,11 +82,14 @@ class FilebasedGroupingBufferFilesTracker(GroupingBufferFilesTracker):
                 groups=group_info, file_number=current_file_count)
         file_name = get_filename(name_without_ext, self.file_extension, self.compression_format)
         file_name = os.path.join(group_folder, file_name)
-        new_buffer_file = self._create_buffer_file(file_name=file_name)
+        new_buffer_file = self._create_group_buffer_file(key, file_name)
         self.grouping_info.add_buffer_file_to_group(key, new_buffer_file)
         self.grouping_info.reset_key(key)
         return new_buffer_file
 
+    def _create_group_buffer_file(self, key, file_name):
+        return self._create_buffer_file(file_name=file_name)
+
     def _get_group_folder(self, group_files):
         if group_files:
             return os.path.dirname(group_files[0].path)
@@ -111,6 +115,7 @@ class FilebaseBaseWriter(BaseWriter):
     hash_algorithm = 'md5'
 
     def __init__(self, *args, **kwargs):
+        self._uploads_local = threading.local()
         super(FilebaseBaseWriter, self).__init__(*args, **kwargs)
         self.filebase = Filebase(self.read_option('filebase'))
         self.set_metadata('effective_filebase', self.filebase.template)
@@ -151,18 +156,29 @@ class FilebaseBaseWriter(BaseWriter):
             file_name = self.filebase.prefix_template + '.' + extension
         return dirname, file_name
 
-    def _write_current_buffer_for_group_key(self, key):
-        write_info = self.write_buffer.pack_buffer(key)
+    def _write_buffer_file(self, write_info, group_key):
         file_path = write_info['file_path']
-        self.write(file_path,
-                   self.write_buffer.grouping_info[key]['membership'],
-                   file_name=os.path.basename(file_path))
+        self.write(file_path, group_key, file_name=os.path.basename(file_path))
+        return self.last_written_file
+
+    def _buffer_file_written(self, write_info, written_file):
         self.logger.info(
             'Checksum for file {file_path}: {file_hash}'.format(**write_info))
-        self.written_files[self.last_written_file] = write_info
+        self.last_written_file = written_file
+        self.written_files[written_file] = write_info
+        super(FilebaseBaseWriter, self)._buffer_file_written(write_info, written_file)
+
+    @property
+    def last_written_file(self):
+        """
+        Destination of the last file written. Each upload thread sees the
+        file it wrote.
+        """
+        return getattr(self._uploads_local, 'last_written_file', None)
 
-        self.write_buffer.clean_tmp_files(write_info)
-        self.write_buffer.add_new_buffer_for_group(key)
+    @last_written_file.setter
+    def last_written_file(self, value):
+        self._uploads_local.last_written_file = value
 
     def finish_writing(self):
         super(FilebaseBaseWriter, self).finish_writing()
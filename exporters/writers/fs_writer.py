@@ -19,6 +19,8 @@ class FSWriter(FilebaseBaseWriter):
 
     }
 
+    concurrent_uploads = True
+
     def __init__(self, options, *args, **kwargs):
         super(FSWriter, self).__init__(options, *args, **kwargs)
         self.set_metadata('files_written', [])
@@ -54,7 +56,8 @@ class FSWriter(FilebaseBaseWriter):
             group_key = []
         filebase_path, file_name = self.create_filebase_name(group_key, file_name=file_name)
         destination = os.path.join(filebase_path, file_name)
-        self._create_path_if_not_exist(filebase_path)
+        with self.uploads_lock:
+            self._create_path_if_not_exist(filebase_path)
         shutil.copy(dump_path, destination)
         self.last_written_file = destination
         self.logger.info('Saved {}'.format(dump_path))
@@ -38,6 +38,8 @@ class FTPWriter(FilebaseBaseWriter):
         'port': {'type': six.integer_types, 'default': 21},
     }
 
+    concurrent_uploads = True
+
     def __init__(self, options, *args, **kwargs):
         super(FTPWriter, self).__init__(options, *args, **kwargs)
 
@@ -47,7 +49,7 @@ class FTPWriter(FilebaseBaseWriter):
         self.ftp_password = self.read_option('ftp_password')
         self.set_metadata('files_written', [])
 
-    def _create_target_dir_if_needed(self, target, depth_limit=20):
+    def _create_target_dir_if_needed(self, ftp, target, depth_limit=20):
         """Creates the directory for the path given, recursively creating
         parent directories when needed"""
 
@@ -60,7 +62,7 @@ class FTPWriter(FilebaseBaseWriter):
 
         parent_dir_ls = []
         try:
-            parent_dir_ls = self.ftp.nlst(parent_dir)
+            parent_dir_ls = ftp.nlst(parent_dir)
         except:
             # Possibly a microsoft server
             # They throw exceptions when we try to ls non-existing folders
@@ -69,10 +71,10 @@ class FTPWriter(FilebaseBaseWriter):
         parent_dir_files = [os.path.basename(d) for d in parent_dir_ls]
         if dir_name not in parent_dir_files:
             if parent_dir and target_dir != '/':
-                self._create_target_dir_if_needed(target_dir, depth_limit=depth_limit - 1)
+                self._create_target_dir_if_needed(ftp, target_dir, depth_limit=depth_limit - 1)
 
             self.logger.info('Will create dir: %s' % target)
-            self.ftp.mkd(target_dir)
+            ftp.mkd(target_dir)
 
     def build_ftp_instance(self):
         import ftplib
@@ -92,24 +94,25 @@ class FTPWriter(FilebaseBaseWriter):
             group_key = []
         filebase_path, file_name = self.create_filebase_name(group_key, file_name=file_name)
         self.logger.info('Start uploading to {}'.format(dump_path))
-        self.ftp = self.build_ftp_instance()
-        self.ftp.connect(self.ftp_host, self.ftp_port)
-        self.ftp.login(self.ftp_user, self.ftp_password)
+        ftp = self.build_ftp_instance()
+        ftp.connect(self.ftp_host, self.ftp_port)
+        ftp.login(self.ftp_user, self.ftp_password)
         destination = (filebase_path + '/' + file_name)
-        self._create_target_dir_if_needed(destination)
+        with self.uploads_lock:
+            self._create_target_dir_if_needed(ftp, destination)
         progress = FtpUploadProgress(self.logger)
-        self.ftp.storbinary('STOR %s' % destination, open(dump_path), callback=progress)
-        self.ftp.close()
+        ftp.storbinary('STOR %s' % destination, open(dump_path), callback=progress)
+        ftp.close()
         self.last_written_file = destination
         self._update_metadata(dump_path, destination)
         self.logger.info('Saved {}'.format(dump_path))
 
     def _check_write_consistency(self):
-        self.ftp = self.build_ftp_instance()
-        self.ftp.connect(self.ftp_host, self.ftp_port)
-        self.ftp.login(self.ftp_user, self.ftp_password)
+        ftp = self.build_ftp_instance()
+        ftp.connect(self.ftp_host, self.ftp_port)
+        ftp.login(self.ftp_user, self.ftp_password)
         for file_info in self.get_metadata('files_written'):
-            ftp_size = self.ftp.size(file_info['filename'])
+            ftp_size = ftp.size(file_info['filename'])
             if ftp_size < 0:
                 raise InconsistentWriteState(
                     '{} file is not present at destination'.format(file_info['filename']))
@@ -117,5 +120,5 @@ class FTPWriter(FilebaseBaseWriter):
                 raise InconsistentWriteState('Unexpected size for file {}. (expected {} - got {})'
                                              .format(file_info['filename'], file_info['size'],
                                                      ftp_size))
-        self.ftp.close()
+        ftp.close()
         self.logger.info('Consistency check passed')
@@ -1,41 +1,194 @@
 import os
-from collections import Counter
+import threading
+from collections import Counter, deque
 from contextlib import closing, contextmanager
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
 import six
-from exporters.default_retries import retry_long
+from exporters.compression import STREAM_COMPRESSION
+from exporters.default_retries import retry_long, retry_short
+from exporters.exceptions import ConfigurationError
 from exporters.progress_callback import BotoDownloadProgress
-from exporters.utils import CHUNK_SIZE, split_file, calculate_multipart_etag, get_bucket_name, \
-                            get_boto_connection
+from exporters.utils import CHUNK_SIZE, Chunk, split_file, calculate_multipart_etag, \
+                            get_bucket_name, get_boto_connection
+from exporters.write_buffers.utils import HashingFile
 from exporters.writers.base_writer import InconsistentWriteState
-from exporters.writers.filebase_base_writer import FilebaseBaseWriter
+from exporters.writers.filebase_base_writer import Filebase, FilebaseBaseWriter, \
+                                                   FilebasedGroupingBufferFilesTracker
 
 
 DEFAULT_BUCKET_REGION = 'us-east-1'
 
+# S3 doesn't accept smaller multipart upload parts, except for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Biggest key S3 can copy in a single request
+MAX_COPY_SIZE = 5 * 1024 ** 3
+
+# Whether multipart uploads can be completed, by S3 host, access key and
+# bucket name. It's probed once per process for all writers and bypasses.
+_multipart_upload_permissions = {}
+_multipart_upload_permissions_lock = threading.Lock()
+
 
 @contextmanager
 def multipart_upload(bucket, key_name, **kwargs):
     mp = bucket.initiate_multipart_upload(key_name, **kwargs)
     try:
         yield mp
-        mp.complete_upload()
+        complete_multipart_upload(bucket, mp)
     except:
         mp.cancel_upload()
         raise
 
 
-def should_use_multipart_upload(path, bucket):
+def complete_multipart_upload(bucket, mp):
+    try:
+        mp.complete_upload()
+    except:
+        forget_multipart_upload_permissions(bucket)
+        raise
+
+
+def _permissions_cache_key(bucket):
+    return bucket.connection.host, bucket.connection.aws_access_key_id, bucket.name
+
+
+@retry_short
+def _probe_multipart_upload_permissions(bucket):
     from boto.exception import S3ResponseError
     # We need to check if we have READ permissions on this bucket, as they are
     # needed to perform the complete_upload operation.
+    # Only a denied request tells we lack them. Other errors (e.g. throttling)
+    # are retried, and raised without being cached if they persist.
     try:
         acl = bucket.get_acl()
         for grant in acl.acl.grants:
             if grant.permission == 'READ':
                 break
-    except S3ResponseError:
-        return False
-    return os.path.getsize(path) > CHUNK_SIZE
+    except S3ResponseError as e:
+        if e.status == 403 or e.error_code == 'AccessDenied':
+            return False
+        raise
+    return True
+
+
+def can_complete_multipart_upload(bucket):
+    cache_key = _permissions_cache_key(bucket)
+    with _multipart_upload_permissions_lock:
+        if cache_key not in _multipart_upload_permissions:
+            _multipart_upload_permissions[cache_key] = _probe_multipart_upload_permissions(bucket)
+        return _multipart_upload_permissions[cache_key]
+
+
+def forget_multipart_upload_permissions(bucket):
+    """
+    Probe the bucket permissions again next time, e.g. after a multipart
+    upload couldn't be completed.
+    """
+    with _multipart_upload_permissions_lock:
+        _multipart_upload_permissions.pop(_permissions_cache_key(bucket), None)
+
+
+def should_use_multipart_upload(path, bucket, part_size=CHUNK_SIZE):
+    return can_complete_multipart_upload(bucket) and os.path.getsize(path) > part_size
+
+
+class MultipartUploadStream(object):
+    """
+    Write only file uploading what is written to it as a multipart upload.
+
+    Every part_size bytes written are uploaded as a part by upload_chunk in
+    the given pool while writing goes on, with at most max_pending_parts of
+    them being uploaded at the same time. The upload is only started with
+    its first part. Closing the stream uploads the last part, and complete()
+    finishes the upload once all its parts are uploaded.
+    """
+
+    def __init__(self, bucket, key_name, part_size, upload_chunk, pool, max_pending_parts):
+        self.bucket = bucket
+        self.key_name = key_name
+        self.part_size = part_size
+        self.upload_chunk = upload_chunk
+        self.pool = pool
+        self.max_pending_parts = max_pending_parts
+        self.mp = None
+        self.parts = 0
+        self.closed = False
+        self._pending = deque()
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.part_size:
+            data = b''.join(self._buffer)
+            offset = 0
+            while len(data) - offset >= self.part_size:
+                self._upload_part(data[offset:offset + self.part_size])
+                offset += self.part_size
+            self._buffer = [data[offset:]]
+            self._buffered = len(data) - offset
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, data):
+        while len(self._pending) >= self.max_pending_parts:
+            self._pending.popleft().get()
+        if self.mp is None:
+            self.mp = self.bucket.initiate_multipart_upload(self.key_name)
+        chunk = Chunk(BytesIO(data), self.parts * self.part_size, len(data), self.parts + 1)
+        self._pending.append(self.pool.apply_async(self.upload_chunk, (self.mp, chunk)))
+        self.parts += 1
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # An upload needs at least one part, even if it's empty
+        if self._buffered or not self.parts:
+            self._upload_part(b''.join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+
+    def complete(self):
+        try:
+            self.close()
+            while self._pending:
+                self._pending.popleft().get()
+            complete_multipart_upload(self.bucket, self.mp)
+        except:
+            self.cancel()
+            raise
+
+    def cancel(self):
+        self._pending.clear()
+        if self.mp is not None:
+            self.mp.cancel_upload()
+            self.mp = None
+
+
+class S3StreamingBufferFilesTracker(FilebasedGroupingBufferFilesTracker):
+    """
+    Writes every group buffer file to an upload stream opened by
+    open_upload(key, path), instead of to a file in the temporary folder.
+    Buffer files get no stream if open_upload returns None.
+    """
+
+    def __init__(self, formatter, filebase, compression_format, open_upload, **kwargs):
+        super(S3StreamingBufferFilesTracker, self).__init__(formatter, filebase,
+                                                            compression_format, **kwargs)
+        self.open_upload = open_upload
+
+    def _create_group_buffer_file(self, key, file_name):
+        path = os.path.join(self.tmp_folder, file_name)
+        upload = self.open_upload(key, path)
+        if upload is None:
+            return self._create_buffer_file(file_name=file_name)
+        output = HashingFile(path, self.hash_algorithm, upload.part_size, fileobj=upload)
+        return self._create_buffer_file(file_name=file_name, output=output)
 
 
 class S3Writer(FilebaseBaseWriter):
@@ -61,6 +214,20 @@ class S3Writer(FilebaseBaseWriter):
         - save_metadata (bool)
             Save key's items count as metadata. Default: True
 
+        - multipart_part_size (int)
+            Size in bytes of the parts big files are uploaded in. Default: 50MB
+
+        - multipart_concurrency (int)
+            Number of parts of a file uploaded at the same time. Default: 4
+
+        - stream_upload (bool)
+            Upload buffer files while they are written, as multipart uploads
+            of multipart_part_size parts, instead of writing them to a
+            temporary folder first. Every group being written keeps up to
+            multipart_part_size bytes in memory, plus the parts being
+            uploaded. Only available with the default write buffer and
+            stream compression formats (gz, bz2 or none). Default: False
+
         - filebase
             Path to store the exported files
     """
@@ -77,10 +244,18 @@ class S3Writer(FilebaseBaseWriter):
         'aws_region': {'type': six.string_types, 'default': None},
         'host': {'type': six.string_types, 'default': None},
         'save_pointer': {'type': six.string_types, 'default': None},
-        'save_metadata': {'type': bool, 'default': True, 'required': False}
+        'save_metadata': {'type': bool, 'default': True, 'required': False},
+        'multipart_part_size': {'type': six.integer_types, 'default': CHUNK_SIZE},
+        'multipart_concurrency': {'type': six.integer_types, 'default': 4},
+        'stream_upload': {'type': bool, 'default': False},
     }
 
+    concurrent_uploads = True
+
     def __init__(self, options, *args, **kwargs):
+        # Multipart uploads of buffer files being streamed, by buffer path
+        self.stream_uploads = {}
+        self.stream_upload_pool = None
         super(S3Writer, self).__init__(options, *args, **kwargs)
         access_key = self.read_option('aws_access_key_id')
         secret_key = self.read_option('aws_secret_access_key')
@@ -97,9 +272,47 @@ class S3Writer(FilebaseBaseWriter):
                                         bucket_name, self.host)
         self.bucket = self.conn.get_bucket(bucket_name, validate=False)
         self.save_metadata = self.read_option('save_metadata')
+        self.part_size = self.read_option('multipart_part_size')
+        if self.part_size < MIN_PART_SIZE:
+            raise ConfigurationError('multipart_part_size must be at least {} bytes'
+                                     ''.format(MIN_PART_SIZE))
+        self.multipart_concurrency = max(1, self.read_option('multipart_concurrency'))
+        self.stream_upload = self.read_option('stream_upload')
+        if self.stream_upload and not can_complete_multipart_upload(self.bucket):
+            self.logger.warning('Multipart uploads cannot be completed in this bucket, '
+                                'buffer files will be uploaded after they are written')
+            self.stream_upload = False
         self.set_metadata('files_counter', Counter())
         self.set_metadata('keys_written', [])
 
+    def _items_group_files_handler(self, write_buffer_class, **kwargs):
+        if not self.read_option('stream_upload'):
+            return super(S3Writer, self)._items_group_files_handler(write_buffer_class, **kwargs)
+        if write_buffer_class.filebased_group_files_tracker_class \
+                is not FilebasedGroupingBufferFilesTracker:
+            raise ConfigurationError('stream_upload is not supported by {}'
+                                     ''.format(write_buffer_class.__name__))
+        if self.read_option('compression') not in STREAM_COMPRESSION:
+            raise ConfigurationError('stream_upload does not support {} compression'
+                                     ''.format(self.read_option('compression')))
+        return S3StreamingBufferFilesTracker(self.export_formatter,
+                                             filebase=Filebase(self.read_option('filebase')),
+                                             start_file_count=self.read_option('start_file_count'),
+                                             compression_format=self.read_option('compression'),
+                                             open_upload=self._open_stream_upload,
+                                             **kwargs)
+
+    def _open_stream_upload(self, group_key, path):
+        if not self.stream_upload:
+            return None
+        if self.stream_upload_pool is None:
+            self.stream_upload_pool = ThreadPool(self.multipart_concurrency)
+        key_name = self._get_key_name(group_key, os.path.basename(path))
+        upload = MultipartUploadStream(self.bucket, key_name, self.part_size, self._upload_chunk,
+                                       self.stream_upload_pool, self.multipart_concurrency)
+        self.stream_uploads[path] = upload
+        return upload
+
     def _get_bucket_location(self, access_key, secret_key, bucket):
         try:
             conn = get_boto_connection(access_key, secret_key, bucketname=bucket, host=self.host)
@@ -162,38 +375,101 @@ class S3Writer(FilebaseBaseWriter):
 
     @retry_long
     def _upload_chunk(self, mp, chunk):
+        # Retries must send the part from its start again
+        chunk.bytes.seek(0)
         mp.upload_part_from_file(chunk.bytes, part_num=chunk.number)
 
+    def _upload_chunks(self, mp, dump_path):
+        """
+        Upload the parts of a file, multipart_concurrency of them at the same
+        time. Each part is retried on its own.
+        """
+        pool = ThreadPool(self.multipart_concurrency)
+        pending = deque()
+        try:
+            for chunk in split_file(dump_path, self.part_size):
+                if len(pending) >= 2 * self.multipart_concurrency:
+                    self._wait_for_chunk(*pending.popleft())
+                pending.append((chunk, pool.apply_async(self._upload_chunk, (mp, chunk))))
+            while pending:
+                self._wait_for_chunk(*pending.popleft())
+        finally:
+            pool.terminate()
+            pool.join()
+            for chunk, _ in pending:
+                chunk.bytes.close()
+
+    def _wait_for_chunk(self, chunk, result):
+        try:
+            result.get()
+        finally:
+            chunk.bytes.close()
+        self.logger.debug('Uploaded chunk number {}'.format(chunk.number))
+
+    def _get_multipart_etag(self, dump_path):
+        # The write buffer computes it for the default part size while writing
+        md5 = None
+        if self.part_size == CHUNK_SIZE:
+            md5 = self.write_buffer.get_metadata_for_file(dump_path, 'multipart_etag')
+        return md5 or calculate_multipart_etag(dump_path, self.part_size)
+
     def _upload_large_file(self, dump_path, key_name):
         self.logger.debug('Using multipart S3 uploader')
         md5 = None
         if self.save_metadata:
-            md5 = calculate_multipart_etag(dump_path, CHUNK_SIZE)
+            md5 = self._get_multipart_etag(dump_path)
         metadata = self._create_key_metadata(dump_path, md5=md5)
         with multipart_upload(self.bucket, key_name, metadata=metadata) as mp:
-            for chunk in split_file(dump_path):
-                self._upload_chunk(mp, chunk)
-                self.logger.debug(
-                        'Uploaded chunk number {}'.format(chunk.number))
+            self._upload_chunks(mp, dump_path)
+
+    def _complete_stream_upload(self, upload, dump_path):
+        self.logger.debug('Completing streamed S3 upload of {} parts'.format(upload.parts))
+        upload.complete()
+        if self.save_metadata:
+            self._save_metadata_for_stream_upload(upload.key_name, dump_path)
+
+    def _save_metadata_for_stream_upload(self, key_name, dump_path):
+        # Metadata is only known once the upload is complete, and S3 can only
+        # change it by copying the key onto itself
+        from boto.exception import S3ResponseError
+        if self.write_buffer.get_metadata_for_file(dump_path, 'size') > MAX_COPY_SIZE:
+            self.logger.warning('Key {} is too big to add metadata info'.format(key_name))
+            return
+        md5 = self.write_buffer.get_metadata_for_file(dump_path, 'multipart_etag')
+        metadata = self._create_key_metadata(dump_path, md5=md5)
+        try:
+            self.bucket.copy_key(key_name, self.bucket.name, key_name, metadata=metadata)
+        except S3ResponseError:
+            self.logger.warning(
+                    'We have no permissions to copy key {}, '
+                    'so we could not add metadata info'.format(key_name))
 
     def _write_s3_key(self, dump_path, key_name):
         destination = 's3://{}/{}'.format(self.bucket.name, key_name)
         self.logger.info('Start uploading {} to {}'.format(dump_path, destination))
-        if should_use_multipart_upload(dump_path, self.bucket):
+        upload = self.stream_uploads.pop(dump_path, None)
+        if upload is not None:
+            self._complete_stream_upload(upload, dump_path)
+        elif should_use_multipart_upload(dump_path, self.bucket, self.part_size):
             self._upload_large_file(dump_path, key_name)
         else:
             self._upload_small_file(dump_path, key_name)
         self.last_written_file = destination
         self.logger.info('Saved {}'.format(destination))
 
+    def _get_key_name(self, group_key, file_name):
+        filebase_path, file_name = self.create_filebase_name(group_key, file_name=file_name)
+        return filebase_path + '/' + file_name
+
     def write(self, dump_path, group_key=None, file_name=None):
         if group_key is None:
             group_key = []
         filebase_path, file_name = self.create_filebase_name(group_key, file_name=file_name)
         key_name = filebase_path + '/' + file_name
         self._write_s3_key(dump_path, key_name)
-        self._update_metadata(dump_path, key_name)
-        self.get_metadata('files_counter')[filebase_path] += 1
+        with self.uploads_lock:
+            self._update_metadata(dump_path, key_name)
+            self.get_metadata('files_counter')[filebase_path] += 1
 
     @retry_long
     def _write_s3_pointer(self, save_pointer, filebase):
@@ -210,8 +486,18 @@ class S3Writer(FilebaseBaseWriter):
         """
         if self.read_option('save_pointer'):
             self._update_last_pointer()
+        self._cancel_stream_uploads()
         super(S3Writer, self).close()
 
+    def _cancel_stream_uploads(self):
+        if self.stream_upload_pool is not None:
+            self.stream_upload_pool.terminate()
+            self.stream_upload_pool.join()
+            self.stream_upload_pool = None
+        while self.stream_uploads:
+            _, upload = self.stream_uploads.popitem()
+            upload.cancel()
+
     def get_file_suffix(self, path, prefix):
         number_of_keys = self.get_metadata('files_counter').get(path, 0)
         suffix = '{}'.format(str(number_of_keys))
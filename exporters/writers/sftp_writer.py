@@ -35,6 +35,8 @@ class SFTPWriter(FilebaseBaseWriter):
         'port': {'type': six.integer_types, 'default': 22},
     }
 
+    concurrent_uploads = True
+
     def __init__(self, options, *args, **kwargs):
         super(SFTPWriter, self).__init__(options, *args, **kwargs)
         self.sftp_host = self.read_option('host')
@@ -64,8 +66,9 @@ class SFTPWriter(FilebaseBaseWriter):
         with pysftp.Connection(self.sftp_host, port=self.sftp_port,
                                username=self.sftp_user,
                                password=self.sftp_password) as sftp:
-            if not sftp.exists(filebase_path):
-                sftp.makedirs(filebase_path)
+            with self.uploads_lock:
+                if not sftp.exists(filebase_path):
+                    sftp.makedirs(filebase_path)
             progress = SftpUploadProgress(self.logger)
             sftp.put(dump_path, destination, callback=progress)
         self.last_written_file = destination
@@ -22,7 +22,7 @@ setup(
     author = 'Scrapinghub',
     author_email = 'info@scrapinghub',
     license = 'BSD',
-    packages = find_packages(exclude=['tests']),
+    packages = find_packages(exclude=['tests', 'benchmarks']),
     install_requires = ['six', 'retrying', 'requests', 'PyYAML', 'decorator', 'kafka-scanner==0.3.4', 'dateparser', 'boto'],
     dependency_links = [
         'git@github.com:scrapinghub/collection-scanner.git@0.1.5#egg=collection_scanner',
@@ -45,5 +45,7 @@ setup(
         'mysql': ['mysql-python', 'SQLAlchemy'],
         'azure': ['azure'],
         'xml': ['dicttoxml'],
+        'zstd': ['zstandard>=0.18'],
+        'lz4': ['lz4>=0.19'],
     },
 )
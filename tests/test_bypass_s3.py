@@ -1,6 +1,7 @@
 import datetime
 import json
 import shutil
+import time
 import unittest
 from contextlib import closing
 import boto
@@ -11,9 +12,11 @@ from freezegun import freeze_time
 
 from tests.utils import environment
 from boto.utils import compute_md5
+from exporters.bypasses.s3_bypass_state import S3BypassState
+from exporters.persistence.pickle_persistence import PicklePersistence
 from exporters.bypasses.s3_to_s3_bypass import S3Bypass
 from exporters.exporter_config import ExporterConfig
-from exporters.utils import remove_if_exists, TmpFile
+from exporters.utils import remove_if_exists, TmpFile, calculate_multipart_etag
 from .utils import meta
 
 
@@ -127,6 +130,7 @@ class S3BypassTest(unittest.TestCase):
     def tearDown(self):
         self.mock_s3.stop()
         remove_if_exists(self.tmp_bypass_resume_file)
+        remove_if_exists(self.tmp_bypass_resume_file + '.journal')
 
     def test_copy_bypass_s3(self):
         # given
@@ -144,6 +148,25 @@ class S3BypassTest(unittest.TestCase):
         self.assertEqual(self.data, json.loads(key.get_contents_as_string()))
         self.assertEqual(bypass.total_items, 2, 'Bypass got an incorrect number of total items')
 
+    def test_copy_bypass_s3_deleting_keys(self):
+        # given
+        self.s3_conn.create_bucket('dest_bucket')
+        options = create_s3_bypass_simple_config()
+        options.reader_options['options']['delete_keys'] = True
+        self._create_and_populate_bucket('source_bucket')
+
+        # when:
+        with closing(S3Bypass(options, meta())) as bypass:
+            bypass.execute()
+            pending_deletes = bypass.bypass_state._get_state()['pending_deletes']
+
+        # then:
+        self.assertEqual(pending_deletes, [])
+        self.assertIsNone(bypass.keys_deleter.pool)
+        self.assertEqual(list(self.source_bucket.list('some_prefix/')), [])
+        dest_keys = [k.name for k in self.s3_conn.get_bucket('dest_bucket').list()]
+        self.assertEqual(len(dest_keys), 4)
+
     @mock.patch('boto.s3.bucket.Bucket.copy_key', autospec=True)
     def test_copy_mode_bypass(self, copy_key_mock):
         copy_key_mock.side_effect = S3ResponseError(None, meta())
@@ -189,6 +212,60 @@ class S3BypassTest(unittest.TestCase):
             key.metadata = {'total': 2}
             key.set_contents_from_string(json.dumps(data))
 
+    def _copy_keys_concurrently(self, copy_key):
+        self._create_and_populate_bucket('concurrent_bucket', number_of_items=6)
+        self.s3_conn.create_bucket('dest_bucket')
+        options = create_s3_bypass_simple_config(exporter_options={'bypass_concurrency': 3})
+        options.reader_options['options']['bucket'] = 'concurrent_bucket'
+        with closing(S3Bypass(options, meta())) as bypass:
+            with mock.patch.object(bypass, '_copy_key', side_effect=copy_key):
+                bypass.execute()
+            return bypass, list(bypass.bypass_state.done), bypass.bypass_state.pending_keys()
+
+    def test_copy_keys_concurrently(self):
+        # given
+        copying = []
+
+        def copy_key(source_bucket, key_name):
+            copying.append(key_name)
+            # Later keys finish first
+            time.sleep(0.05 * (7 - int(key_name[-1])))
+            return '2'
+
+        # when:
+        bypass, done, pending = self._copy_keys_concurrently(copy_key)
+
+        # then:
+        expected_keys = ['some_prefix/key{}'.format(i) for i in range(1, 7)]
+        self.assertEqual(sorted(copying), expected_keys)
+        self.assertEqual(done, expected_keys)
+        self.assertEqual(pending, [])
+        self.assertEqual(bypass.total_items, 12)
+
+    def test_failed_concurrent_copy_keeps_ordered_state(self):
+        # given
+        states = []
+
+        def copy_key(source_bucket, key_name):
+            if key_name == 'some_prefix/key3':
+                time.sleep(0.1)
+                raise ValueError('Copy failed')
+            return '2'
+
+        original_commit = S3BypassState.commit_copied_key
+
+        def commit_copied_key(state, key):
+            original_commit(state, key)
+            states.append(list(state.done))
+
+        # when:
+        with mock.patch.object(S3BypassState, 'commit_copied_key', commit_copied_key):
+            with self.assertRaisesRegexp(ValueError, 'Copy failed'):
+                self._copy_keys_concurrently(copy_key)
+
+        # then:
+        self.assertEqual(states[-1], ['some_prefix/key1', 'some_prefix/key2'])
+
     def test_resume_bypass(self):
         # given
         options = create_s3_bypass_simple_config()
@@ -223,6 +300,25 @@ class S3BypassTest(unittest.TestCase):
         self.assertEquals(expected_final_keys, bucket_keynames)
         self.assertEquals(bypass.total_items, 6, 'Wrong number of items written')
 
+    def test_resume_journal_without_deleting_keys(self):
+        options = create_s3_bypass_simple_config()
+        options.reader_options['options']['bucket'] = 'resume_bucket'
+        options.persistence_options.update(
+            resume=True,
+            persistence_state_id='tmp_s3_bypass_resume_persistence.pickle'
+        )
+        options.persistence_options['options']['file_path'] = 'tests/data/'
+        self._create_and_populate_bucket('resume_bucket')
+        persistence = PicklePersistence(options.persistence_options, meta())
+        persistence.append_to_journal(('some_prefix/key2', {'total_count': 4}))
+        persistence.close()
+
+        bypass_state = S3BypassState(options, meta(), None, None)
+        state = bypass_state._get_state()
+        self.assertEqual(state['pending'], ['some_prefix/key3'])
+        self.assertEqual(state['pending_deletes'], [])
+        self.assertEqual(state['stats'], {'total_count': 4})
+
     def test_filebase_format_bypass(self):
         # given
         writer = {
@@ -417,3 +513,70 @@ class S3BypassTest(unittest.TestCase):
         key = next(iter(bucket.list('other_prefix/2010-01-01/')))
         file_name = key.name.split('/')[-1]
         self.assertEquals('test_key', file_name)
+
+
+class S3BypassPartsTest(unittest.TestCase):
+
+    def setUp(self):
+        options = create_s3_bypass_simple_config()
+        options.writer_options['options']['multipart_concurrency'] = 2
+        self.bypass = S3Bypass(options, meta())
+        self.bypass.part_size = 4
+        self.data = 'abcdefghij'
+        self.key = mock.Mock(size=len(self.data), metadata={'total': '7'})
+        self.key.name = 'some_prefix/big_key'
+        self.key.bucket.name = 'source_bucket'
+        self.dest_bucket = mock.Mock()
+        self.mp = self.dest_bucket.initiate_multipart_upload.return_value
+
+    def test_copy_key_in_parts(self):
+        # when:
+        self.bypass._copy_key_in_parts(self.dest_bucket, 'dest/big_key', self.key)
+
+        # then:
+        self.dest_bucket.initiate_multipart_upload.assert_called_once_with(
+            'dest/big_key', metadata={'total': '7'})
+        self.assertEqual(sorted(c[0] for c in self.mp.copy_part_from_key.call_args_list), [
+            ('source_bucket', 'some_prefix/big_key', 1, 0, 3),
+            ('source_bucket', 'some_prefix/big_key', 2, 4, 7),
+            ('source_bucket', 'some_prefix/big_key', 3, 8, 9),
+        ])
+        self.mp.complete_upload.assert_called_once_with()
+
+    @mock.patch('time.sleep')
+    @mock.patch('exporters.default_retries._retry_init', None)
+    def test_copy_part_retried_on_server_errors(self, sleep):
+        self.mp.copy_part_from_key.side_effect = [S3ResponseError(500, 'Internal Error'), None]
+        self.bypass._copy_part(self.mp, self.key, 1, 0, 3)
+        self.assertEqual(self.mp.copy_part_from_key.call_count, 2)
+
+    @mock.patch('time.sleep')
+    @mock.patch('exporters.default_retries._retry_init', None)
+    def test_copy_part_not_retried_when_denied(self, sleep):
+        self.mp.copy_part_from_key.side_effect = S3ResponseError(403, 'Forbidden')
+        with self.assertRaises(S3ResponseError):
+            self.bypass._copy_part(self.mp, self.key, 1, 0, 3)
+        self.assertEqual(self.mp.copy_part_from_key.call_count, 1)
+
+    def test_upload_key_in_parts_through_memory(self):
+        # given
+        def get_range(headers):
+            start, end = headers['Range'][len('bytes='):].split('-')
+            return self.data[int(start):int(end) + 1]
+        self.key.bucket.new_key.return_value.get_contents_as_string.side_effect = get_range
+        uploaded = {}
+
+        def upload_part_from_file(fp, part_num):
+            uploaded[part_num] = fp.read()
+        self.mp.upload_part_from_file.side_effect = upload_part_from_file
+
+        # when:
+        etag = self.bypass._upload_key_in_parts(self.dest_bucket, 'dest/big_key', self.key)
+
+        # then:
+        self.assertEqual(uploaded, {1: 'abcd', 2: 'efgh', 3: 'ij'})
+        self.mp.complete_upload.assert_called_once_with()
+        with TmpFile() as tmp_filename:
+            with open(tmp_filename, 'w') as f:
+                f.write(self.data)
+            self.assertEqual(etag, calculate_multipart_etag(tmp_filename, 4))
@@ -4,7 +4,7 @@ from contextlib import closing
 
 import mock
 from six import BytesIO
-from exporters.bypasses.stream_bypass import StreamBypass, Stream
+from exporters.bypasses.stream_bypass import StreamBypass, StreamBypassState, Stream
 from exporters.exporter_config import ExporterConfig
 from exporters.utils import remove_if_exists
 from exporters.iterio import IterIO
@@ -148,3 +148,29 @@ class StreamBypassTest(unittest.TestCase):
         write_stream_mock.assert_called_once_with(stream_b, file_obj_b)
         assert bypass.bypass_state.stats['bytes_copied'] == 100,\
             'Wrong number of bytes written'
+
+    def test_resume_state_from_journal(self):
+        # given
+        options = create_stream_bypass_simple_config()
+        options.persistence_options['options']['file_path'] = self.data_dir
+        streams = [Stream('file_{}'.format(i), 50, None) for i in range(5)]
+        state = StreamBypassState(options, meta())
+        state.compact_every = 2
+        try:
+            for stream in streams[:4]:
+                state.commit_copied(stream)
+            compacted = state.state.get_last_position()
+
+            # when:
+            options.persistence_options.update(
+                resume=True, persistence_state_id=state.state.persistence_state_id)
+            resumed = StreamBypassState(options, meta())
+        finally:
+            state.delete()
+
+        # then:
+        self.assertEqual(compacted['done'], streams[:3])
+        self.assertEqual(resumed.skipped, streams[:4])
+        self.assertTrue(resumed.is_skipped(streams[3]))
+        self.assertFalse(resumed.is_skipped(streams[4]))
+        self.assertEqual(resumed.stats['bytes_copied'], 200)
@@ -1,6 +1,12 @@
+import bz2
+import gzip
+import mock
 import unittest
 import zlib
-from exporters.decompressors import ZLibDecompressor, NoDecompressor
+from exporters import decompressors
+from exporters.decompressors import (ZLibDecompressor, NoDecompressor, Bz2Decompressor,
+                                     ZstdDecompressor, LZ4Decompressor, AutoDecompressor)
+from exporters.exceptions import ConfigurationError
 from exporters.iterio import IterIO
 from io import BytesIO
 import random
@@ -33,3 +39,173 @@ class DecompressorsTest(unittest.TestCase):
         decompressor = NoDecompressor({}, None)
         compressed = IterIO(BytesIO('helloworld'))
         assert IterIO(decompressor.decompress(compressed)).read() == 'helloworld'
+
+    def test_zlib_decompressor_offsets(self):
+        decompressor = ZLibDecompressor({}, None)
+        members = [zlib.compress('hello'), zlib.compress('world'), zlib.compress('foobar')]
+        compressed = IterIO(BytesIO("".join(members)))
+        chunks = list(decompressor.decompress_with_offsets(compressed))
+        assert "".join(chunk for chunk, _ in chunks) == 'helloworldfoobar'
+        offsets = [offset for _, offset in chunks if offset is not None]
+        assert offsets == [len(members[0]), len(members[0]) + len(members[1])]
+
+    def test_no_compression_offsets(self):
+        decompressor = NoDecompressor({}, None)
+        stream = IterIO(iter(['hello\nwor', 'ld\nfoo\nbar']))
+        chunks = list(decompressor.decompress_with_offsets(stream))
+        assert chunks == [('hello\n', 6), ('wor', None), ('ld\n', 12), ('foo\n', 16),
+                          ('bar', None)]
+
+
+def gzip_member(data, compresslevel=9):
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=compresslevel) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+class ParallelZLibDecompressorTest(unittest.TestCase):
+    def decompress(self, compressed, **options):
+        decompressor = ZLibDecompressor({'options': options}, None)
+        stream = IterIO(iter([compressed[i:i + 100] for i in range(0, len(compressed), 100)]))
+        return list(decompressor.decompress_with_offsets(stream))
+
+    def assert_same_as_serial(self, compressed):
+        serial = self.decompress(compressed)
+        parallel = self.decompress(compressed, threads=3, segment_size=300)
+        self.assertEqual(''.join(chunk for chunk, _ in parallel),
+                         ''.join(chunk for chunk, _ in serial))
+        self.assertEqual([offset for _, offset in parallel if offset is not None],
+                         [offset for _, offset in serial if offset is not None])
+        return parallel
+
+    def test_multiple_members(self):
+        parts = [randbytes(random.randint(0, 500)) for _ in range(40)]
+        members = [gzip_member(part) for part in parts]
+        chunks = self.assert_same_as_serial(''.join(members))
+        self.assertEqual(''.join(chunk for chunk, _ in chunks), ''.join(parts))
+        offsets = [offset for _, offset in chunks if offset is not None]
+        self.assertEqual(offsets, [sum(len(member) for member in members[:i + 1])
+                                   for i in range(len(members) - 1)])
+
+    def test_header_inside_member(self):
+        # Stored members keep the gzip header in their data as is
+        parts = [randbytes(200) + gzip_member('hello') + randbytes(200) for _ in range(10)]
+        self.assert_same_as_serial(''.join(gzip_member(part, 0) for part in parts))
+
+    def test_header_inside_member_after_whole_segments(self):
+        parts = [randbytes(300) for _ in range(6)]
+        parts[3] = randbytes(250) + gzip_member('hello') + randbytes(20)
+        compressed = ''.join(gzip_member(part, 0 if i == 3 else 9)
+                             for i, part in enumerate(parts))
+        for segment_size in [100, 200]:
+            chunks = self.decompress(compressed, threads=2, segment_size=segment_size)
+            self.assertEqual(''.join(chunk for chunk, _ in chunks), ''.join(parts))
+
+    def test_member_bigger_than_segments(self):
+        parts = [randbytes(100), randbytes(5000), randbytes(100), randbytes(100)]
+        self.assert_same_as_serial(''.join(gzip_member(part) for part in parts))
+
+    def test_zlib_members(self):
+        parts = [randbytes(500) for _ in range(10)]
+        self.assert_same_as_serial(''.join(zlib.compress(part) for part in parts))
+
+    def test_invalid_data(self):
+        decompressor = ZLibDecompressor({'options': {'threads': 2}}, None)
+        with self.assertRaisesRegexp(zlib.error, 'NoDecompressor'):
+            list(decompressor.decompress(IterIO(iter(['not compressed']))))
+
+
+def decompress_chunks(decompressor, compressed, chunk_size=100):
+    chunks = [compressed[i:i + chunk_size] for i in range(0, len(compressed), chunk_size)]
+    return list(decompressor.decompress_with_offsets(IterIO(iter(chunks))))
+
+
+class MembersDecompressorsTest(unittest.TestCase):
+    def assert_members_decompressed(self, decompressor, compress):
+        parts = [randbytes(300), 'hello', 'world', randbytes(1000)]
+        members = [compress(part) for part in parts]
+        for chunk_size in [100, len(members[0])]:
+            chunks = decompress_chunks(decompressor, ''.join(members), chunk_size)
+            self.assertEqual(''.join(chunk for chunk, _ in chunks), ''.join(parts))
+            offsets = [offset for _, offset in chunks if offset is not None]
+            ends = [sum(len(member) for member in members[:i + 1])
+                    for i in range(len(members))]
+            # Only decompressors with eof tell where the last member ends
+            self.assertIn(sorted(set(offsets)), [ends[:-1], ends])
+
+    def test_bz2_decompressor(self):
+        self.assert_members_decompressed(Bz2Decompressor({}, None), bz2.compress)
+
+    @unittest.skipUnless(decompressors.zstandard and hasattr(
+        decompressors.zstandard.ZstdDecompressor().decompressobj(), 'unused_data'),
+        'zstandard 0.18 or later is not installed')
+    def test_zstd_decompressor(self):
+        compressor = decompressors.zstandard.ZstdCompressor()
+        self.assert_members_decompressed(ZstdDecompressor({}, None), compressor.compress)
+
+    @unittest.skipUnless(decompressors.lz4_frame, 'lz4 is not installed')
+    def test_lz4_decompressor(self):
+        self.assert_members_decompressed(LZ4Decompressor({}, None),
+                                         decompressors.lz4_frame.compress)
+
+    def test_missing_packages(self):
+        with mock.patch.object(decompressors, 'zstandard', None):
+            with self.assertRaisesRegexp(ConfigurationError, 'zstandard'):
+                ZstdDecompressor({}, None)
+        with mock.patch.object(decompressors, 'lz4_frame', None):
+            with self.assertRaisesRegexp(ConfigurationError, 'lz4'):
+                LZ4Decompressor({}, None)
+
+    def test_old_packages(self):
+        # Their decompressors don't tell where frames end
+        zstandard = mock.Mock(__version__='0.14.1')
+        del zstandard.ZstdDecompressor.return_value.decompressobj.return_value.unused_data
+        with mock.patch.object(decompressors, 'zstandard', zstandard):
+            with self.assertRaisesRegexp(ConfigurationError, 'zstandard 0.18'):
+                ZstdDecompressor({}, None)
+        lz4_frame = mock.Mock()
+        del lz4_frame.LZ4FrameDecompressor.return_value.unused_data
+        with mock.patch.object(decompressors, 'lz4_frame', lz4_frame):
+            with self.assertRaisesRegexp(ConfigurationError, 'lz4 0.19'):
+                LZ4Decompressor({}, None)
+
+    def test_auto_decompressor(self):
+        decompressor = AutoDecompressor({}, None)
+        for compress in [zlib.compress, gzip_member, bz2.compress, lambda data: data]:
+            compressed = compress('hello') + compress('world')
+            chunks = decompress_chunks(decompressor, compressed, 3)
+            self.assertEqual(''.join(chunk for chunk, _ in chunks), 'helloworld')
+
+    def test_auto_decompressor_passes_options_on(self):
+        decompressor = AutoDecompressor(
+            {'options': {'threads': 2, 'segment_size': 64}}, None)
+        data = ''.join('%d\n' % i for i in range(100))
+        chunks = decompress_chunks(decompressor, gzip_member(data[:150]) + gzip_member(data[150:]))
+        self.assertEqual(''.join(chunk for chunk, _ in chunks), data)
+        zlib_decompressor = decompressor.decompressors[ZLibDecompressor]
+        self.assertEqual(zlib_decompressor.threads, 2)
+        self.assertEqual(zlib_decompressor.segment_size, 64)
+        decompress_chunks(decompressor, bz2.compress(data))
+        self.assertIn(Bz2Decompressor, decompressor.decompressors)
+
+    def test_detect_decompressor(self):
+        self.assertIs(decompressors.detect_decompressor(gzip_member('x')), ZLibDecompressor)
+        self.assertIs(decompressors.detect_decompressor(zlib.compress('x', 1)),
+                      ZLibDecompressor)
+        self.assertIs(decompressors.detect_decompressor(bz2.compress('x')), Bz2Decompressor)
+        self.assertIs(decompressors.detect_decompressor(b'(\xb5/\xfd\x00'), ZstdDecompressor)
+        self.assertIs(decompressors.detect_decompressor(b'\x04"M\x18'), LZ4Decompressor)
+        self.assertIs(decompressors.detect_decompressor(b'{"a": 1}'), NoDecompressor)
+        self.assertIs(decompressors.detect_decompressor(b''), NoDecompressor)
+
+    def test_detect_plain_text(self):
+        for head in [b'H,id\n1,2\n', b'hbase,region,rows\nt1,r1,10\n', b'x y,z\n1 2,3\n',
+                     b'80,1\n81,2\n', b'BZh,BZi\n1,2\n', b'BZh9 is a bz2 header\n']:
+            self.assertIs(decompressors.detect_decompressor(head), NoDecompressor, head)
+
+    def test_auto_decompressor_plain_csv(self):
+        decompressor = AutoDecompressor({}, None)
+        data = 'H,id\n' + ''.join('%d,%d\n' % (i, i * 2) for i in range(500))
+        chunks = decompress_chunks(decompressor, data)
+        self.assertEqual(''.join(chunk for chunk, _ in chunks), data)
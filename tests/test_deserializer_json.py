@@ -0,0 +1,109 @@
+import json
+import pickle
+import unittest
+from copy import deepcopy
+from io import BytesIO
+
+from exporters.deserializers import JsonLinesDeserializer
+from exporters.exceptions import ConfigurationError
+from exporters.iterio import IterIO
+from exporters.records.lazy_record import LazyRecord, decode_records
+
+
+ITEMS = [{'id': i, 'name': 'item%d' % i, 'tags': ['x'] * i} for i in range(5)]
+
+
+def make_stream(lines):
+    return IterIO(BytesIO(b''.join(lines)))
+
+
+class JsonLinesDeserializerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = [json.dumps(item) + '\n' for item in ITEMS]
+
+    def _deserialize(self, **options):
+        deserializer = JsonLinesDeserializer({'options': options}, None)
+        return list(deserializer.deserialize_with_positions(make_stream(self.lines)))
+
+    def test_deserialize(self):
+        deserializer = JsonLinesDeserializer({}, None)
+        self.assertEqual(list(deserializer.deserialize(make_stream(self.lines))), ITEMS)
+
+    def test_batch_lines_keep_item_positions(self):
+        expected = self._deserialize()
+        self.assertEqual([position for _, position in expected],
+                         [len(''.join(self.lines[:i + 1])) for i in range(len(ITEMS))])
+        self.assertEqual(self._deserialize(batch_lines=2), expected)
+        self.assertEqual(self._deserialize(batch_lines=100), expected)
+
+    def test_batch_lines_with_invalid_line(self):
+        self.lines[3] = '{"id": 3,\n'
+        with self.assertRaises(ValueError):
+            self._deserialize(batch_lines=2)
+        self.lines[3] = '3, 4\n'
+        with self.assertRaises(ValueError):
+            self._deserialize(batch_lines=2)
+
+    def test_auto_decoder(self):
+        self.assertEqual([item for item, _ in self._deserialize(decoder='auto')], ITEMS)
+
+    def test_unknown_decoder(self):
+        with self.assertRaisesRegexp(ConfigurationError, 'Unknown JSON decoder'):
+            JsonLinesDeserializer({'options': {'decoder': 'yaml'}}, None)
+
+    def test_lazy_records(self):
+        self.lines[3] = 'not json\n'
+        items = [item for item, _ in self._deserialize(lazy_records=True)]
+        self.assertEqual([item.raw for item in items], self.lines)
+        self.assertEqual(items[0], ITEMS[0])
+        self.assertEqual(items[1]['name'], 'item1')
+        self.assertEqual(sorted(items[2]), ['id', 'name', 'tags'])
+        with self.assertRaises(ValueError):
+            items[3].get('id')
+
+
+class LazyRecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.line = json.dumps(ITEMS[1]) + '\n'
+
+    def test_decode_records(self):
+        records = list(decode_records([LazyRecord(self.line), dict(ITEMS[2])]))
+        self.assertEqual(records[0].raw, self.line)
+        self.assertEqual(dict(records[0]), ITEMS[1])
+        self.assertEqual(json.loads(json.dumps(records)), [ITEMS[1], ITEMS[2]])
+        with self.assertRaises(ValueError):
+            list(decode_records([LazyRecord('not json\n')]))
+
+    def test_changes_drop_raw_json(self):
+        record = LazyRecord(self.line)
+        self.assertEqual(record.get('id'), 1)
+        self.assertEqual(record.raw, self.line)
+        record['id'] = 2
+        self.assertIsNone(record.raw)
+        self.assertEqual(record, dict(ITEMS[1], id=2))
+
+    def test_nested_values_drop_raw_json(self):
+        record = LazyRecord(self.line)
+        self.assertEqual(record['name'], 'item1')
+        self.assertEqual(sorted(record.keys()), ['id', 'name', 'tags'])
+        self.assertEqual(record.raw, self.line)
+        record['tags'].append('y')
+        self.assertIsNone(record.raw)
+        record = LazyRecord(self.line)
+        for _, value in record.items():
+            pass
+        self.assertIsNone(record.raw)
+
+    def test_copies(self):
+        record = LazyRecord(self.line)
+        record.group_key = ['id']
+        for copy in [pickle.loads(pickle.dumps(record)), deepcopy(record)]:
+            self.assertEqual(copy.raw, self.line)
+            self.assertEqual(copy.group_key, ['id'])
+            self.assertEqual(copy, ITEMS[1])
+        record.pop('tags')
+        for copy in [pickle.loads(pickle.dumps(record, 2)), deepcopy(record)]:
+            self.assertIsNone(copy.raw)
+            self.assertEqual(copy, {'id': 1, 'name': 'item1'})
@@ -1,6 +1,7 @@
 import os
 import pickle
 import shutil
+import sqlite3
 import tempfile
 import unittest
 
@@ -10,6 +11,8 @@ from mock import DEFAULT
 from exporters.bypasses.base import BaseBypass
 from exporters.export_managers.base_exporter import BaseExporter
 from exporters.export_managers.basic_exporter import BasicExporter
+from exporters.filters.dupe_filter import DupeFilter
+from exporters.exceptions import ConfigurationError
 from exporters.readers.random_reader import RandomReader
 from exporters.transform.no_transform import NoTransform
 from exporters.utils import TmpFile, TemporaryDirectory
@@ -543,6 +546,358 @@ class BaseExportManagerTest(unittest.TestCase):
             last_read = [args[0]['last_read'] for name, args, kwargs in m.mock_calls]
             self.assertEqual(last_read, [2, 5, 8, 11, 14, 16])
 
+    @mock.patch("mock.MagicMock", new=CopyingMagicMock)
+    def test_persisted_positions_with_workers(self):
+        options = {
+            'reader': {
+                'name': 'exporters.readers.random_reader.RandomReader',
+                'options': {
+                    'number_of_items': 17,
+                    'batch_size': 3
+                }
+            },
+            'writer': {
+                'name': 'tests.utils.NullWriter'
+            },
+            'persistence': {
+                'name': 'tests.utils.NullPersistence',
+            },
+            'exporter_options': {
+                'workers': 2
+            }
+        }
+        self.exporter = exporter = BaseExporter(options)
+        with mock.patch.object(exporter.persistence, 'commit_position') as m:
+            exporter.export()
+            last_read = [args[0]['last_read'] for name, args, kwargs in m.mock_calls]
+            self.assertEqual(last_read, [2, 5, 8, 11, 14, 16])
+        self.assertEqual(exporter.writer.get_metadata('items_count'), 17)
+
+    def _export_with_disk_dupe_filter(self, index_path, **exporter_options):
+        options = {
+            'reader': {
+                'name': 'exporters.readers.random_reader.RandomReader',
+                'options': {
+                    'number_of_items': 17,
+                    'batch_size': 3
+                }
+            },
+            'filter': {
+                'name': 'exporters.filters.dupe_filter.DupeFilter',
+                'options': {'key_field': 'key', 'mode': 'disk', 'index_path': index_path}
+            },
+            'writer': {
+                'name': 'tests.utils.NullWriter'
+            },
+            'persistence': {
+                'name': 'tests.utils.NullPersistence',
+            },
+            'exporter_options': exporter_options
+        }
+        self.exporter = exporter = BaseExporter(options)
+        with mock.patch.object(exporter.persistence, 'commit_position') as m:
+            exporter.export()
+            return [args[0]['filters_checkpoint'] for name, args, kwargs in m.mock_calls]
+
+    @mock.patch("mock.MagicMock", new=CopyingMagicMock)
+    def test_dupe_filter_checkpoints_persisted(self):
+        with TmpFile() as index_path:
+            checkpoints = self._export_with_disk_dupe_filter(index_path)
+        self.assertEqual(checkpoints, [{'filter_before': i} for i in range(1, 7)])
+
+    @mock.patch("mock.MagicMock", new=CopyingMagicMock)
+    def test_dupe_filter_checkpoints_persisted_when_threaded(self):
+        with TmpFile() as index_path:
+            checkpoints = self._export_with_disk_dupe_filter(
+                index_path, threaded=True, thread_queue_size=2)
+        self.assertEqual(checkpoints, [{'filter_before': i} for i in range(1, 7)])
+
+    @mock.patch("mock.MagicMock", new=CopyingMagicMock)
+    def test_resume_dupe_filter_from_checkpoint(self):
+        with TmpFile() as index_path:
+            self._export_with_disk_dupe_filter(index_path)
+            exporter = self.exporter
+            # The index is closed with the export, resume with a new filter
+            with self.assertRaises(sqlite3.ProgrammingError):
+                exporter.filter_before.key_set.connection.execute("SELECT 1")
+            exporter.filter_before = DupeFilter(
+                {'options': {'key_field': 'key', 'mode': 'disk', 'index_path': index_path}},
+                exporter.metadata)
+            self.assertEqual(len(exporter.filter_before.key_set), 16)
+            exporter._restore_filters({'last_read': 5, 'filters_checkpoint': {'filter_before': 2}})
+            # keys 1 to 5 (key 0 can't be filtered)
+            self.assertEqual(len(exporter.filter_before.key_set), 5)
+            exporter._restore_filters(None)
+            self.assertEqual(len(exporter.filter_before.key_set), 0)
+
+    def test_positions_committed_after_uploads(self):
+        options = {
+            'reader': {
+                'name': 'exporters.readers.random_reader.RandomReader',
+                'options': {
+                    'number_of_items': 17,
+                    'batch_size': 3
+                }
+            },
+            'writer': {
+                'name': 'tests.utils.NullWriter'
+            },
+            'persistence': {
+                'name': 'tests.utils.NullPersistence',
+            },
+        }
+        self.exporter = exporter = BaseExporter(options)
+        writer = exporter.writer
+        with mock.patch.object(exporter.persistence, 'commit_position') as m:
+            writer.uploads_submitted = 1
+            writer.pending_uploads.append(({}, mock.Mock(**{'ready.return_value': False})))
+            exporter._commit_position({'last_read': 2})
+            writer.uploads_submitted = 2
+            exporter._commit_position({'last_read': 5})
+            self.assertFalse(m.called)
+            writer.uploads_done = 1
+            exporter._commit_position({'last_read': 8})
+            self.assertEqual([args[0]['last_read'] for _, args, _ in m.mock_calls], [2])
+            writer.uploads_done = 2
+            writer.pending_uploads.clear()
+            exporter._commit_uploaded_positions()
+            last_read = [args[0]['last_read'] for name, args, kwargs in m.mock_calls]
+            self.assertEqual(last_read, [2, 8])
+
+    def test_positions_committed_with_writer_metadata_once_uploaded(self):
+        options = {
+            'reader': {
+                'name': 'exporters.readers.random_reader.RandomReader',
+                'options': {
+                    'number_of_items': 17,
+                    'batch_size': 3
+                }
+            },
+            'writer': {
+                'name': 'tests.utils.NullWriter'
+            },
+            'persistence': {
+                'name': 'tests.utils.NullPersistence',
+            },
+        }
+        self.exporter = exporter = BaseExporter(options)
+        writer = exporter.writer
+        upload = mock.Mock(**{'ready.return_value': False})
+        with mock.patch.object(exporter.persistence, 'commit_position') as m:
+            writer.set_metadata('items_count', 3)
+            writer.uploads_submitted = 1
+            writer.pending_uploads.append(({}, upload))
+            exporter._commit_position({'last_read': 2})
+            writer.set_metadata('items_count', 6)
+            exporter._commit_uploaded_positions()
+            self.assertFalse(m.called)
+            # The upload finishes in the background
+            upload.ready.return_value = True
+            exporter._commit_uploaded_positions()
+            self.assertEqual(writer.uploads_done, 1)
+            self.assertEqual(len(m.mock_calls), 1)
+            committed = m.mock_calls[0][1][0]
+            self.assertEqual(committed['last_read'], 2)
+            self.assertEqual(committed['writer_metadata']['items_count'], 3)
+
+    def test_filter_and_group_with_workers(self):
+        options = {
+            'reader': {
+                'name': 'exporters.readers.random_reader.RandomReader',
+                'options': {
+                    'number_of_items': 100,
+                    'batch_size': 10
+                }
+            },
+            'writer': {
+                'name': 'tests.utils.NullWriter'
+            },
+            'persistence': {
+                'name': 'tests.utils.NullPersistence',
+            },
+            'filter_before': {
+                'name': 'exporters.filters.pythonexp_filter.PythonexpFilter',
+                'options': {'python_expression': "item['key'] % 2 == 0"}
+            },
+            'grouper': {
+                'name': 'exporters.groupers.file_key_grouper.FileKeyGrouper',
+                'options': {'keys': ['country_code']}
+            },
+            'exporter_options': {
+                'workers': 3
+            }
+        }
+        self.exporter = exporter = BaseExporter(options)
+        exporter.export()
+        self.assertEqual(exporter.writer.get_metadata('items_count'), 50)
+        self.assertEqual(exporter.filter_before.get_metadata('filtered_out'), 50)
+        self.assertEqual(set(key[0] for key in exporter.writer.grouping_info.keys()),
+                         set(['es', 'uk', 'us']))
+
+    def test_filter_metadata_with_workers_matches_serial_export(self):
+        def export(exporter_options):
+            options = {
+                'reader': {
+                    'name': 'exporters.readers.random_reader.RandomReader',
+                    'options': {
+                        'number_of_items': 100,
+                        'batch_size': 10
+                    }
+                },
+                'writer': {
+                    'name': 'tests.utils.NullWriter'
+                },
+                'persistence': {
+                    'name': 'tests.utils.NullPersistence',
+                },
+                'filter_before': {
+                    'name': 'exporters.filters.pythonexp_filter.PythonexpFilter',
+                    'options': {'python_expression': "item['key'] % 2 == 0"}
+                },
+                'filter_after': {
+                    'name': 'exporters.filters.pythonexp_filter.PythonexpFilter',
+                    'options': {'python_expression': "item['key'] % 4 == 0"}
+                },
+                'exporter_options': exporter_options
+            }
+            exporter = BaseExporter(options)
+            exporter.export()
+            return exporter
+
+        serial = export({})
+        self.exporter = with_workers = export({'workers': 2})
+        self.assertEqual(with_workers.metadata.per_module['filter'],
+                         serial.metadata.per_module['filter'])
+        self.assertEqual(with_workers.filter_after.get_metadata('filtered_out'), 75)
+        self.assertEqual(with_workers.writer.get_metadata('items_count'),
+                         serial.writer.get_metadata('items_count'))
+
+    def test_invalid_lazy_records_not_written(self):
+        path = os.path.join(self.tmp_dir, 'items.jl')
+        with open(path, 'w') as f:
+            f.write('{"key": 1}\n{"key": \n')
+        options = {
+            'reader': {
+                'name': 'exporters.readers.fs_reader.FSReader',
+                'options': {'input': path}
+            },
+            'decompressor': {
+                'name': 'exporters.decompressors.NoDecompressor',
+            },
+            'deserializer': {
+                'name': 'exporters.deserializers.JsonLinesDeserializer',
+                'options': {'lazy_records': True}
+            },
+            'writer': {
+                'name': 'tests.utils.NullWriter'
+            },
+            'persistence': {
+                'name': 'tests.utils.NullPersistence',
+            },
+        }
+        self.exporter = exporter = BaseExporter(options)
+        with self.assertRaises(ValueError):
+            exporter.export()
+        self.assertEqual(exporter.writer.get_metadata('items_count'), 1)
+
+    def test_stateful_filters_with_workers(self):
+        options = {
+            'reader': {
+                'name': 'exporters.readers.random_reader.RandomReader',
+                'options': {'number_of_items': 10}
+            },
+            'writer': {
+                'name': 'tests.utils.NullWriter'
+            },
+            'filter_after': {
+                'name': 'exporters.filters.dupe_filter.DupeFilter',
+                'options': {'key_field': 'key'}
+            },
+            'exporter_options': {
+                'workers': 2
+            }
+        }
+        with self.assertRaisesRegexp(ConfigurationError, 'DupeFilter'):
+            BaseExporter(options)
+
+    @mock.patch("mock.MagicMock", new=CopyingMagicMock)
+    def test_threaded_export_commits_positions(self):
+        options = {
+            'reader': {
+                'name': 'exporters.readers.random_reader.RandomReader',
+                'options': {
+                    'number_of_items': 17,
+                    'batch_size': 3
+                }
+            },
+            'writer': {
+                'name': 'tests.utils.NullWriter'
+            },
+            'persistence': {
+                'name': 'tests.utils.NullPersistence',
+            },
+            'exporter_options': {
+                'threaded': True,
+                'thread_queue_size': 2
+            }
+        }
+        self.exporter = exporter = BaseExporter(options)
+        with mock.patch.object(exporter.persistence, 'commit_position') as m:
+            exporter.export()
+            last_read = [args[0]['last_read'] for name, args, kwargs in m.mock_calls]
+            self.assertEqual(last_read, [2, 5, 8, 11, 14, 16])
+        self.assertEqual(exporter.writer.get_metadata('items_count'), 17)
+        queues = exporter.metadata.per_module['queues']
+        self.assertEqual(sorted(queues.keys()), ['process_queue', 'writer_queue'])
+        self.assertEqual(queues['process_queue']['max_size'], 2)
+        self.assertLessEqual(queues['process_queue']['max_occupancy'], 2)
+
+    def test_threaded_export_items_limit(self):
+        options = {
+            'reader': {
+                'name': 'exporters.readers.random_reader.RandomReader',
+                'options': {
+                    'number_of_items': 1000,
+                    'batch_size': 3
+                }
+            },
+            'writer': {
+                'name': 'tests.utils.NullWriter',
+                'options': {
+                    'items_limit': 5
+                }
+            },
+            'persistence': {
+                'name': 'tests.utils.NullPersistence',
+            },
+            'exporter_options': {
+                'threaded': True,
+                'thread_queue_size': 1
+            }
+        }
+        self.exporter = exporter = BaseExporter(options)
+        exporter.export()
+        self.assertEqual(exporter.writer.get_metadata('items_count'), 5)
+
+    def test_threaded_export_reader_error(self):
+        options = {
+            'reader': {
+                'name': 'tests.utils.ErrorReader',
+            },
+            'writer': {
+                'name': 'tests.utils.NullWriter'
+            },
+            'persistence': {
+                'name': 'tests.utils.NullPersistence',
+            },
+            'exporter_options': {
+                'threaded': True
+            }
+        }
+        self.exporter = exporter = BaseExporter(options)
+        with self.assertRaisesRegexp(RuntimeError, 'ErrorReader error'):
+            exporter.export()
+
     def test_disabling_retries(self):
         count_holder = [0]
         options = {
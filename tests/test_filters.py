@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
+import json
 import random
 import unittest
+from exporters.exceptions import ConfigurationError
 from exporters.filters.base_filter import BaseFilter
 from exporters.filters.dupe_filter import DupeFilter
+from exporters.filters.key_sets import SqliteKeySet
 from exporters.filters.key_value_filter import KeyValueFilter
 from exporters.filters.key_value_filters import InvalidOperator
 from exporters.filters.key_value_regex_filter import KeyValueRegexFilter
 from exporters.filters.no_filter import NoFilter
 from exporters.records.base_record import BaseRecord
+from exporters.utils import TmpFile
 
 from .utils import meta
 
@@ -321,6 +325,62 @@ class KeyValueFiltersTest(unittest.TestCase):
         with self.assertRaisesRegexp(InvalidOperator, 'operator not valid'):
             KeyValueFilter({'options': {'keys': keys}}, meta())
 
+    def test_filter_in_with_unhashable_values(self):
+        keys = [
+            {'name': 'tags', 'value': [['a'], 'b'], 'operator': 'in'},
+            {'name': 'country_code', 'value': ['es', 'us'], 'operator': 'in'},
+        ]
+        items = [
+            {'name': 'item1', 'country_code': 'es', 'tags': ['a']},
+            {'name': 'item2', 'country_code': 'us', 'tags': 'b'},
+            {'name': 'item3', 'country_code': ['es'], 'tags': 'b'},
+            {'name': 'item4', 'country_code': 'es', 'tags': ['c']},
+        ]
+        filter = KeyValueFilter({'options': {'keys': keys}}, meta())
+        batch = list(filter.filter_batch(BaseRecord(item) for item in items))
+        self.assertEqual(['item1', 'item2'], [item['name'] for item in batch])
+
+    def test_filter_with_invalid_regex(self):
+        keys = [{'name': 'country_code', 'value': '(es', 'operator': 're_match'}]
+        with self.assertRaisesRegexp(ConfigurationError, 'Invalid regular expression'):
+            KeyValueFilter({'options': {'keys': keys}}, meta())
+
+    def test_raw_line_filter(self):
+        keys = [
+            {'name': 'country_code', 'value': ['es', 'us'], 'operator': 'in'},
+            {'name': 'address.city', 'value': 'New York'},
+            {'name': 'tags', 'value': 'new', 'operator': 'contains'},
+            {'name': 'name', 'value': 'item.+', 'operator': 're_match'},
+        ]
+        filter = KeyValueFilter({'options': {'keys': keys}}, meta())
+        line_filter = filter.get_raw_line_filter()
+        items = [
+            {'name': 'item1', 'country_code': 'es', 'address': {'city': 'New York'},
+             'tags': ['new']},
+            {'name': 'item2', 'country_code': 'us', 'address': {'city': 'New York'},
+             'tags': 'brand new'},
+            {'name': 'item3', 'country_code': 'uk', 'address': {'city': 'New York'},
+             'tags': ['new']},
+            {'name': 'item4', 'country_code': 'es', 'address': {'city': 'York'},
+             'tags': ['new']},
+            {'name': 'item5', 'country_code': 'es', 'address': {'city': 'New York'}},
+        ]
+        self.assertEqual([line_filter(json.dumps(item)) for item in items],
+                         [True, True, False, False, False])
+
+    def test_no_raw_line_filter_for_unsafe_values(self):
+        keys = [
+            {'name': 'url', 'value': 'http://example.com/'},
+            {'name': 'name', 'value': u'caf\xe9'},
+            {'name': 'price', 'value': 10},
+            {'name': 'name', 'value': ['item%d' % i for i in range(11)], 'operator': 'in'},
+            {'name': 'name', 'value': 'item.+', 'operator': 're_match'},
+        ]
+        filter = KeyValueFilter({'options': {'keys': keys}}, meta())
+        self.assertIsNone(filter.get_raw_line_filter())
+        filter = KeyValueRegexFilter({'options': {'keys': [{'name': 'a', 'value': 'b'}]}}, meta())
+        self.assertIsNone(filter.get_raw_line_filter())
+
 
 class DupeFilterTest(unittest.TestCase):
 
@@ -403,3 +463,66 @@ class DupeFilterTest(unittest.TestCase):
         batch = filter.filter_batch(batch)
         batch = list(batch)
         self.assertEqual(3, len(batch))
+
+    def _filter_duplicates(self, options):
+        items = [{'_key': 'http://example.com/%d' % (i % 1000)} for i in range(3000)]
+        filter = DupeFilter({'options': options}, meta())
+        batch = list(filter.filter_batch(BaseRecord(item) for item in items))
+        return filter, batch
+
+    def test_filter_duplicates_with_hashed_keys(self):
+        filter, batch = self._filter_duplicates({'mode': 'hash', 'initial_capacity': 10})
+        self.assertEqual([item['_key'] for item in batch],
+                         ['http://example.com/%d' % i for i in range(1000)])
+        self.assertEqual(len(filter.key_set), 1000)
+        self.assertEqual(filter.get_metadata('keys_memory_usage'), 8 * 2048)
+
+    def test_filter_duplicates_with_bloom_filter(self):
+        filter, batch = self._filter_duplicates(
+            {'mode': 'bloom', 'initial_capacity': 100, 'error_rate': 0.01})
+        # some new keys may be taken as dupes, but no dupe passes
+        self.assertEqual(len(set(item['_key'] for item in batch)), len(batch))
+        self.assertGreater(len(batch), 980)
+        self.assertGreater(len(filter.key_set.filters), 1)
+        self.assertLess(filter.get_metadata('keys_memory_usage'), 8 * 1000)
+
+    def test_invalid_mode(self):
+        with self.assertRaisesRegexp(ConfigurationError, 'Unknown DupeFilter mode'):
+            DupeFilter({'options': {'mode': 'unknown'}}, meta())
+
+    def test_disk_mode_needs_index_path(self):
+        with self.assertRaisesRegexp(ConfigurationError, 'index_path'):
+            DupeFilter({'options': {'mode': 'disk'}}, meta())
+
+    def test_filter_duplicates_with_disk_index(self):
+        with TmpFile() as index_path:
+            filter, batch = self._filter_duplicates(
+                {'mode': 'disk', 'index_path': index_path, 'cache_size': 10})
+        self.assertEqual([item['_key'] for item in batch],
+                         ['http://example.com/%d' % i for i in range(1000)])
+
+
+class SqliteKeySetTest(unittest.TestCase):
+
+    def test_restore_checkpoint(self):
+        with TmpFile() as index_path:
+            key_set = SqliteKeySet(index_path, cache_size=2)
+            self.assertTrue(key_set.add('a'))
+            self.assertTrue(key_set.add('b'))
+            self.assertEqual(key_set.checkpoint(), 1)
+            self.assertTrue(key_set.add('c'))
+            self.assertFalse(key_set.add('a'))
+            self.assertEqual(key_set.checkpoint(), 2)
+            self.assertTrue(key_set.add('d'))
+            key_set.close()
+
+            # d was added after the last checkpoint
+            key_set = SqliteKeySet(index_path)
+            key_set.restore(1)
+            self.assertEqual(len(key_set), 2)
+            self.assertFalse(key_set.add('b'))
+            self.assertTrue(key_set.add('c'))
+            self.assertEqual(key_set.checkpoint(), 2)
+            key_set.restore(None)
+            self.assertEqual(len(key_set), 0)
+            key_set.close()
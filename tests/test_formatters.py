@@ -8,6 +8,7 @@ from exporters.export_formatter.base_export_formatter import BaseExportFormatter
 from exporters.export_formatter.csv_export_formatter import CSVExportFormatter
 from exporters.export_formatter.json_export_formatter import JsonExportFormatter
 from exporters.records.base_record import BaseRecord
+from exporters.records.lazy_record import LazyRecord
 from tests.utils import meta
 
 
@@ -39,6 +40,29 @@ class JsonFormatterTest(unittest.TestCase):
         item = self.export_formatter.format(item)
         self.assertIsInstance(json.loads(item), dict)
 
+    def test_format_unchanged_lazy_record(self):
+        line = '{"value": 1,  "key": "\xc3\xa9"}\n'
+        item = LazyRecord(line)
+        self.assertEqual(item['key'], u'\xe9')
+        self.assertEqual(self.export_formatter.format(item), line[:-1])
+
+    def test_format_changed_lazy_record(self):
+        item = LazyRecord('{"value": 1,  "key": 0}\n')
+        item['value'] = 2
+        self.assertEqual(json.loads(self.export_formatter.format(item)), {'value': 2, 'key': 0})
+
+    def test_format_lazy_record_changed_in_place(self):
+        item = LazyRecord('{"a": {"b": 1}, "t": [1]}\n')
+        item['a']['b'] = 2
+        item['t'].append(5)
+        self.assertEqual(json.loads(self.export_formatter.format(item)),
+                         {'a': {'b': 2}, 't': [1, 5]})
+
+    def test_pretty_print_lazy_record(self):
+        export_formatter = JsonExportFormatter({'options': {'pretty_print': True}}, meta())
+        item = LazyRecord('{"value": 1,  "key": 0}\n')
+        self.assertEqual(export_formatter.format(item), '{\n  "key": 0, \n  "value": 1\n}')
+
 
 class CSVFormatterTest(unittest.TestCase):
 
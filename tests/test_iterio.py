@@ -1,4 +1,5 @@
 import unittest
+from io import BytesIO
 from exporters.iterio import IterIO
 
 
@@ -36,3 +37,27 @@ class IterIOTest(unittest.TestCase):
     def test_line_mode(self):
         io = IterIO(iter(['he\n\nllo', '\nworl\nd']), mode="lines")
         assert list(io) == ['he\n', '\n', 'llo\n', 'worl\n', 'd']
+
+    def test_read_lines_spanning_chunks(self):
+        io = IterIO(iter(['he', 'll', 'o\nwor', 'ld\n', 'foo']))
+        assert list(io.iterlines()) == ['hello\n', 'world\n', 'foo']
+        assert io.tell() == len('hello\nworld\nfoo')
+
+    def test_mixed_reads(self):
+        io = IterIO(iter(['hello\nwor', 'ld\nfoo\nbar']))
+        assert io.readline() == 'hello\n'
+        assert io.read(2) == 'wo'
+        io.unshift('wo')
+        assert io.tell() == len('hello\n')
+        assert io.next_chunk() == 'wor'
+        lines = io.iterlines()
+        assert next(lines) == 'ld\n'
+        assert io.tell() == len('hello\nworld\n')
+        assert io.read(2) == 'fo'
+        assert list(lines) == ['o\n', 'bar']
+
+    def test_file_chunk_size_grows_with_long_lines(self):
+        line = 'x' * 100 + '\n'
+        io = IterIO(BytesIO(line * 3), chunk_size=16)
+        assert io.readlines() == [line] * 3
+        assert io.chunk_size > 16
@@ -1,3 +1,4 @@
+import os
 import unittest
 from mock import patch
 from exporters.exporter_config import ExporterConfig
@@ -74,11 +75,13 @@ class PicklePersistenceTest(unittest.TestCase):
         finally:
             remove_if_exists('/tmp/'+file_name)
 
+    @patch('os.rename', autospec=True)
     @patch('os.path.isfile', autospec=True)
     @patch('__builtin__.open', autospec=True)
     @patch('pickle.dump', autospec=True)
     @patch('pickle.load', autospec=True)
-    def test_get_last_position(self, mock_load_pickle, mock_dump_pickle, mock_open, mock_is_file):
+    def test_get_last_position(self, mock_load_pickle, mock_dump_pickle, mock_open, mock_is_file,
+                               mock_rename):
         mock_dump_pickle.return_value = True
         mock_is_file.return_value = True
         mock_load_pickle.return_value = {'last_position': {'last_key': 10}}
@@ -86,13 +89,60 @@ class PicklePersistenceTest(unittest.TestCase):
         persistence = PicklePersistence(exporter_config.persistence_options, meta())
         self.assertEqual({'last_key': 10}, persistence.get_last_position())
 
+    @patch('os.rename', autospec=True)
     @patch('__builtin__.open', autospec=True)
     @patch('pickle.dump', autospec=True)
     @patch('uuid.uuid4', autospec=True)
-    def test_commit(self, mock_uuid, mock_dump_pickle, mock_open):
+    def test_commit(self, mock_uuid, mock_dump_pickle, mock_open, mock_rename):
         mock_dump_pickle.return_value = True
         mock_uuid.return_value = 1
         exporter_config = ExporterConfig(self.config)
         persistence = PicklePersistence(exporter_config.persistence_options, meta())
         self.assertEqual(None, persistence.commit_position(10))
         self.assertEqual(persistence.get_metadata('commited_positions'), 1)
+
+    def test_journal(self):
+        exporter_config = ExporterConfig(self.config)
+        persistence = PicklePersistence(exporter_config.persistence_options, meta())
+        try:
+            persistence.commit_position({'done': ['a']})
+            persistence.append_to_journal('b')
+            persistence.append_to_journal(('c', {'total': 3}))
+            persistence.close()
+            # A failed append leaves an incomplete entry
+            with open(persistence._get_journal_file_name(), 'ab') as f:
+                f.write('\x00\x00\x00\x10trunc')
+
+            exporter_config.persistence_options.update(
+                resume=True, persistence_state_id=persistence.persistence_state_id)
+            resumed = PicklePersistence(exporter_config.persistence_options, meta())
+            self.assertEqual(resumed.get_last_position(), {'done': ['a']})
+            self.assertEqual(resumed.get_journal(), ['b', ('c', {'total': 3})])
+
+            resumed.commit_position({'done': ['a', 'b', 'c']})
+            self.assertEqual(resumed.get_journal(), [])
+        finally:
+            persistence.delete()
+
+    def test_journal_of_older_position_ignored(self):
+        exporter_config = ExporterConfig(self.config)
+        persistence = PicklePersistence(exporter_config.persistence_options, meta())
+        try:
+            persistence.commit_position({'done': ['a']})
+            persistence.append_to_journal('b')
+            # Crash after writing the new position, before clearing the journal
+            with patch.object(persistence, '_clear_journal'):
+                persistence.commit_position({'done': ['a', 'b']})
+            persistence.close()
+            self.assertFalse(os.path.exists(persistence._get_persistence_file_name() + '.tmp'))
+
+            exporter_config.persistence_options.update(
+                resume=True, persistence_state_id=persistence.persistence_state_id)
+            resumed = PicklePersistence(exporter_config.persistence_options, meta())
+            self.assertEqual(resumed.get_last_position(), {'done': ['a', 'b']})
+            self.assertEqual(resumed.get_journal(), [])
+            resumed.append_to_journal('c')
+            self.assertEqual(resumed.get_journal(), ['c'])
+            resumed.close()
+        finally:
+            persistence.delete()
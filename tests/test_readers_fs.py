@@ -1,6 +1,14 @@
+import json
 from gzip import GzipFile
+from io import BytesIO
+from threading import Event
 
+import mock
+
+from exporters.bypasses.stream_bypass import Stream
+from exporters.decompressors import NoDecompressor
 from exporters.readers import FSReader
+from exporters.readers.base_stream_reader import PrefetchedStream
 from exporters.exceptions import ConfigurationError
 
 from .utils import meta
@@ -48,6 +56,17 @@ class FSReaderTest(object):
         batch = list(reader.get_next_batch())
         assert expected == batch
 
+    def test_read_from_folder_prefetching_streams(self):
+        expected = [
+            {u'item': u'value1'}, {u'item': u'value2'}, {u'item': u'value3'},
+            {u'item2': u'value1'}, {u'item2': u'value2'}, {u'item2': u'value3'},
+        ]
+        reader = self._make_fs_reader(self.options)
+        reader.prefetch_streams = 2
+        batch = list(reader.get_next_batch())
+        assert expected == batch
+        assert reader.prefetched_streams == {}
+
     def test_read_from_pointer(self):
         expected = [
             {u'item': u'value1'}, {u'item': u'value2'}, {u'item': u'value3'},
@@ -153,6 +172,123 @@ class FSReaderTest(object):
         }})
         assert list(reader.get_next_batch()) == [{"foo": 1}, {"bar": 1}]
 
+    def test_read_records_stream_checkpoints(self, gzip_members_file):
+        path, members = gzip_members_file
+        reader = self._make_fs_reader({'input': path, 'batch_size': 3})
+        assert len(list(reader.get_next_batch())) == 3
+        position = reader.get_last_position()
+        assert position['stream_offset'] == {path: 3}
+        assert position['stream_checkpoint'] == {path: [len(members[0]), 2]}
+        assert len(list(reader.get_next_batch())) == 3
+        assert reader.get_last_position()['stream_checkpoint'] == {
+            path: [len(members[0]) + len(members[1]), 4]}
+
+    def test_resume_stream_from_checkpoint(self, gzip_members_file):
+        path, members = gzip_members_file
+        reader = self._make_fs_reader({'input': path})
+        reader.set_last_position({
+            'stream_offset': {path: 3},
+            'stream_checkpoint': {path: [len(members[0]), 2]},
+        })
+        offsets = []
+        open_stream = reader.open_stream
+
+        def open_stream_spy(stream, byte_offset=0):
+            offsets.append(byte_offset)
+            return open_stream(stream, byte_offset)
+        reader.open_stream = open_stream_spy
+        assert list(reader.get_next_batch()) == [{'n': 4}, {'n': 5}, {'n': 6}]
+        assert offsets == [len(members[0])]
+        position = reader.get_last_position()
+        assert position['readed_streams'] == [path]
+        assert position['stream_offset'] == {}
+        assert position['stream_checkpoint'] == {}
+
+    def test_uncompressed_stream_checkpoints(self, tmpdir):
+        lines = [json.dumps({'n': n}) + '\n' for n in range(1, 7)]
+        path = tmpdir.join('items.jl').strpath
+        with open(path, 'wb') as f:
+            f.write(''.join(lines))
+        reader = self._make_fs_reader({'input': path, 'batch_size': 4})
+        reader.decompressor = NoDecompressor({}, None)
+        assert len(list(reader.get_next_batch())) == 4
+        assert reader.get_last_position()['stream_checkpoint'] == {
+            path: [len(''.join(lines[:4])), 4]}
+
+    def test_resume_stream_from_checkpoint_at_end(self, gzip_members_file):
+        path, members = gzip_members_file
+        reader = self._make_fs_reader({'input': path})
+        reader.set_last_position({
+            'stream_offset': {path: 6},
+            'stream_checkpoint': {path: [len(''.join(members)), 6]},
+        })
+        reader.open_stream = mock.Mock(side_effect=AssertionError('stream reopened'))
+        assert list(reader.get_next_batch()) == []
+        assert reader.get_last_position()['readed_streams'] == [path]
+
+    def test_skip_lines_rejected_by_raw_line_filter(self, gzip_members_file):
+        path, members = gzip_members_file
+        reader = self._make_fs_reader({'input': path, 'batch_size': 2})
+        reader.raw_line_filter = lambda line: b' 2}' in line or b' 5}' in line
+        assert list(reader.get_next_batch()) == [{'n': 2}, {'n': 5}]
+        position = reader.get_last_position()
+        # skipped lines still count as items
+        assert position['stream_offset'] == {path: 5}
+        assert position['stream_checkpoint'] == {
+            path: [len(members[0]) + len(members[1]), 4]}
+        assert reader.get_metadata('raw_lines_filtered_out') == 3
+
+
+def gzip_member(items):
+    data = BytesIO()
+    with GzipFile(fileobj=data, mode='w') as zf:
+        for item in items:
+            zf.write(json.dumps(item) + '\n')
+    return data.getvalue()
+
+
+class EndlessChunksReader(object):
+    """
+    Reader whose streams never end, counting the chunks pulled from them.
+    """
+
+    def __init__(self):
+        self.chunks_read = 0
+        self.stream_closed = Event()
+
+    def get_stream_checkpoint(self, filename):
+        return 0, 0
+
+    def open_decompressed(self, stream_data, byte_offset=0):
+        try:
+            while True:
+                self.chunks_read += 1
+                yield 'chunk', None
+        finally:
+            self.stream_closed.set()
+
+
+class PrefetchedStreamTest(object):
+    def test_cancel_stops_download(self):
+        reader = EndlessChunksReader()
+        prefetched = PrefetchedStream(reader, Stream('endless', None, None), 4)
+        chunks = iter(prefetched)
+        assert next(chunks) == ('chunk', None)
+        chunks.close()
+        assert reader.stream_closed.wait(5)
+        prefetched.thread.join(5)
+        assert not prefetched.thread.is_alive()
+        assert reader.chunks_read < 10
+
+
+@pytest.fixture
+def gzip_members_file(tmpdir):
+    members = [gzip_member([{'n': n}, {'n': n + 1}]) for n in (1, 3, 5)]
+    path = tmpdir.join('members.jl.gz').strpath
+    with open(path, 'wb') as f:
+        f.write(''.join(members))
+    return path, members
+
 
 @pytest.fixture
 def tmpdir_with_dotfiles(tmpdir):
@@ -1,5 +1,6 @@
 import gzip
 import json
+import threading
 import unittest
 import StringIO
 from contextlib import closing
@@ -10,11 +11,27 @@ import datetime
 
 import dateparser
 import moto
-from exporters.readers.s3_reader import S3Reader, S3BucketKeysFetcher, get_bucket
+from exporters.default_retries import disabled_retries
+from exporters.readers.s3_reader import (S3Reader, S3BucketKeysFetcher, S3KeysDeleter,
+                                         KeysNotDeleted, get_bucket)
 from exporters.exceptions import ConfigurationError
 
 from .utils import meta
 
+
+def serialize_open_stream(reader):
+    """
+    The mocked S3 mixes up responses of concurrent requests, so prefetching
+    threads download their keys one at a time.
+    """
+    open_stream = reader.open_stream
+    lock = threading.Lock()
+
+    def open_stream_serialized(*args, **kwargs):
+        with lock:
+            return StringIO.StringIO(open_stream(*args, **kwargs).read())
+    reader.open_stream = open_stream_serialized
+
 NO_KEYS = ['test_list/test_key_1', 'test_list/test_key_2', 'test_list/test_key_3',
            'test_list/test_key_4', 'test_list/test_key_5', 'test_list/test_key_6',
            'test_list/test_key_7', 'test_list/test_key_8', 'test_list/test_key_9']
@@ -262,6 +279,84 @@ class S3ReaderTest(unittest.TestCase):
         expected_batch = [{u'name': u'test_list/dump_p1_ES_a'}]
         self.assertEqual(batch, expected_batch)
 
+    def test_read_with_prefetch_keys(self):
+        options = dict(self.options_no_pattern, options=dict(
+            self.options_no_pattern['options'], batch_size=100, prefetch_keys=3))
+        reader = S3Reader(options, meta())
+        serialize_open_stream(reader)
+        reader.set_last_position({'readed_streams': ['test_list/dump_p1_UK_a'],
+                                  'stream_offset': {}})
+        names = [item['name'] for item in reader.get_next_batch()]
+        expected = ['test_list/dump_p1_ES_a', 'test_list/dump_p1_FR_a',
+                    'test_list/dump_p1_US_a', 'test_list/dump_p1_US_b',
+                    'test_list/dump_p2_US_a', 'test_list/dump_p_US_a']
+        self.assertEqual(names, expected)
+        self.assertTrue(reader.is_finished())
+        self.assertEqual(reader.get_last_position()['readed_streams'],
+                         ['test_list/dump_p1_UK_a'] + expected)
+
+    def test_delete_keys_with_prefetch_keys(self):
+        options = dict(self.options_valid, options=dict(
+            self.options_valid['options'], delete_keys=True, prefetch_keys=2))
+        reader = S3Reader(options, meta())
+        serialize_open_stream(reader)
+        reader.set_last_position(None)
+        self.assertEqual(len(list(reader.get_next_batch())), 4)
+        bucket = self.s3_conn.get_bucket('valid_keys_bucket')
+        self.assertEqual(sorted(k.name for k in bucket.list()),
+                         ['test_list/dump_p1_ES_a', 'test_list/dump_p1_FR_a',
+                          'test_list/dump_p1_UK_a'])
+
+    def test_delete_keys_in_batches(self):
+        options = dict(self.options_valid, options=dict(
+            self.options_valid['options'], delete_keys=True))
+        reader = S3Reader(options, meta())
+        reader.set_last_position(None)
+        with mock.patch.object(reader.bucket, 'delete_keys',
+                               wraps=reader.bucket.delete_keys) as delete_keys:
+            self.assertEqual(len(list(reader.get_next_batch())), 4)
+        reader.close()
+        self.assertEqual(delete_keys.call_count, 1)
+        self.assertEqual(reader.get_last_position()['pending_deletes'], [])
+        bucket = self.s3_conn.get_bucket('valid_keys_bucket')
+        self.assertEqual(sorted(k.name for k in bucket.list()),
+                         ['test_list/dump_p1_ES_a', 'test_list/dump_p1_FR_a',
+                          'test_list/dump_p1_UK_a'])
+
+    def test_resume_pending_deletes(self):
+        options = dict(self.options_valid, options=dict(
+            self.options_valid['options'], delete_keys=True))
+        reader = S3Reader(options, meta())
+        reader.set_last_position({'pending_deletes': ['test_list/dump_p1_ES_a']})
+        self.assertEqual(reader.get_last_position()['pending_deletes'],
+                         ['test_list/dump_p1_ES_a'])
+        self.assertEqual(len(list(reader.get_next_batch())), 4)
+        reader.close()
+        bucket = self.s3_conn.get_bucket('valid_keys_bucket')
+        self.assertEqual(sorted(k.name for k in bucket.list()),
+                         ['test_list/dump_p1_FR_a', 'test_list/dump_p1_UK_a'])
+
+    def test_read_keys_without_fetching_them(self):
+        reader = S3Reader(self.options_valid, meta())
+        reader.set_last_position(None)
+        bucket = self.s3_conn.get_bucket('valid_keys_bucket')
+        keys = [bucket.get_key(key_name) for key_name in reader.keys]
+        with mock.patch.object(reader.bucket, 'get_key') as get_key:
+            streams = list(reader.get_read_streams())
+            self.assertEqual(len(list(reader.get_next_batch())), 4)
+        self.assertFalse(get_key.called)
+        self.assertEqual([s.size for s in streams], [key.size for key in keys])
+        self.assertEqual([reader.keys_info[key.name].etag for key in keys],
+                         [key.etag for key in keys])
+
+    def test_open_stream_from_byte_offset(self):
+        reader = S3Reader(self.options_valid, meta())
+        reader.set_last_position(None)
+        stream = next(reader.get_read_streams())
+        content = self.s3_conn.get_bucket('valid_keys_bucket').get_key(
+            stream.filename).get_contents_as_string()
+        self.assertEqual(reader.open_stream(stream, 10).read(), content[10:])
+
     def test_date_prefix(self):
         reader = S3Reader(self.options_date_prefix, meta())
         expected = [datetime.datetime.now().strftime('test_prefix/%Y-%m-%d')]
@@ -378,6 +473,38 @@ class TestS3BucketKeysFetcher(unittest.TestCase):
         self.assertEqual(set(POINTER_KEYS), set(fetcher.pending_keys()))
 
 
+class S3KeysDeleterTest(unittest.TestCase):
+
+    def _deleter(self, bucket):
+        deleter = S3KeysDeleter(bucket, mock.Mock())
+        deleter.batch_size = 2
+        return deleter
+
+    def test_delete_keys_in_batches(self):
+        bucket = mock.Mock()
+        bucket.delete_keys.return_value.errors = []
+        deleter = self._deleter(bucket)
+        for key_name in ['a', 'b', 'c']:
+            deleter.delete(key_name)
+        deleter.flush()
+        deleter.close()
+        self.assertEqual([c[0][0] for c in bucket.delete_keys.call_args_list],
+                         [['a', 'b'], ['c']])
+        self.assertEqual(deleter.pending_keys(), [])
+
+    def test_keys_not_deleted_stay_pending(self):
+        error = mock.Mock(key='b', message='InternalError')
+        bucket = mock.Mock()
+        bucket.delete_keys.return_value.errors = [error]
+        deleter = self._deleter(bucket)
+        deleter.delete('a')
+        deleter.delete('b')
+        with disabled_retries(), self.assertRaises(KeysNotDeleted):
+            deleter.flush()
+        deleter.close()
+        self.assertEqual(deleter.pending_keys(), ['b'])
+
+
 class GetBucketTest(unittest.TestCase):
     def setUp(self):
         self.mock_s3 = moto.mock_s3()
@@ -1,5 +1,6 @@
 import unittest
 from exporters.records.base_record import BaseRecord
+from exporters.records.lazy_record import LazyRecord
 from exporters.transform.jq_transform import JQTransform
 
 
@@ -30,6 +31,13 @@ class JqTransformTest(unittest.TestCase):
         expected = [{'country': 'es'}, {'country': 'uk'}]
         self.assertEqual(expected, list(transform.transform_batch(self.batch)))
 
+    def test_transform_lazy_records(self):
+        transform = JQTransform({'options': {'jq_filter': '{country: .country_code}'}})
+        batch = [LazyRecord('{"name": "item1", "country_code": "es"}\n'),
+                 LazyRecord('{"name": "item2", "country_code": "uk"}\n')]
+        expected = [{'country': 'es'}, {'country': 'uk'}]
+        self.assertEqual(expected, list(transform.transform_batch(batch)))
+
     def test_transform_with_filter(self):
         for country in ['es', 'uk']:
             jq_filter = 'select(.country_code == "%s") | {country_code}' % country
@@ -11,9 +11,10 @@ from exporters.groupers.base_grouper import BaseGrouper
 from exporters.logger.base_logger import CategoryLogger
 from exporters.module_loader import ModuleLoader
 from exporters.pipeline.base_pipeline_item import BasePipelineItem
-from exporters.python_interpreter import Interpreter
+from exporters.python_interpreter import Interpreter, ExpressionEvaluator, compile_expression
 from exporters.utils import nested_dict_value, TmpFile, split_file, \
     calculate_multipart_etag, str_list, dict_list, int_list, maybe_cast_list
+from exporters.write_buffers.utils import HashingFile, hash_for_file
 from .utils import environment
 from .utils import valid_config_with_updates
 
@@ -299,6 +300,30 @@ class PythonInterpreterTest(unittest.TestCase):
         with self.assertRaises(InvalidExpression):
             self.interpreter.check('2+2; 5+6')
 
+    def test_compile(self):
+        compiled = self.interpreter.compile("item['a'] + 1")
+        self.assertEqual(compiled.eval({'item': {'a': 1}}), 2)
+        with self.assertRaises(InvalidExpression):
+            self.interpreter.compile('lambda: 1')
+
+    def test_compiled_expressions_are_cached(self):
+        self.assertIs(compile_expression("item['a'] * 2"), compile_expression("item['a'] * 2"))
+        with self.assertRaises(InvalidExpression):
+            compile_expression(['not', 'a', 'string'])
+
+    def test_evaluator_rebinds_item(self):
+        evaluator = ExpressionEvaluator(["item['a']", "math.sqrt(item['b'])"])
+        self.assertEqual(evaluator.eval_all({'a': 1, 'b': 4}), [1, 2.0])
+        self.assertEqual(evaluator.eval_all({'a': 2, 'b': 9}), [2, 3.0])
+        self.assertEqual(evaluator.eval({'a': 3, 'b': 0}), 3)
+
+    def test_evaluator_context_not_shared_between_items(self):
+        # List comprehensions leak their variable on python 2
+        evaluator = ExpressionEvaluator(["x if not item['xs'] else [x for x in item['xs']]"])
+        self.assertEqual(evaluator.eval({'xs': [1]}), [1])
+        with self.assertRaises(NameError):
+            evaluator.eval({'xs': []})
+
 
 class BaseByPassTest(unittest.TestCase):
     def test_not_implemented(self):
@@ -400,6 +425,17 @@ class FileSplit(unittest.TestCase):
             expected = '"728d2dbdd842b6a145cc3f3284d66861-4"'
             self.assertEqual(md5, expected, 'Wrong calculated md5 for multipart upload')
 
+    def test_hashing_file(self):
+        with TmpFile() as tmp_filename:
+            hashing_file = HashingFile(tmp_filename, 'md5', part_size=3333)
+            for size in (1000, 5000, 4000):
+                hashing_file.write('\0' * size)
+            hashing_file.close()
+            self.assertEqual(hashing_file.size, 10000)
+            self.assertEqual(hashing_file.hexdigest(), hash_for_file(tmp_filename, 'md5'))
+            self.assertEqual(hashing_file.multipart_etag(),
+                             calculate_multipart_etag(tmp_filename, 3333))
+
 
 class HomogeneusListTest(unittest.TestCase):
     def test_homogeneus_lists(self):
@@ -2,11 +2,13 @@ import bz2
 import csv
 import datetime
 import gzip
+import hashlib
 import json
 import os
 import random
 import shutil
 import tempfile
+import threading
 import unittest
 import mock
 from contextlib import closing
@@ -16,7 +18,7 @@ from exporters.export_formatter.csv_export_formatter import CSVExportFormatter
 from exporters.export_formatter.xml_export_formatter import XMLExportFormatter
 from exporters.records.base_record import BaseRecord
 from exporters.write_buffers.base import WriteBuffer
-from exporters.write_buffers.grouping import GroupingBufferFilesTracker
+from exporters.write_buffers.grouping import BufferFile, GroupingBufferFilesTracker
 from exporters.writers import FSWriter
 from exporters.writers.base_writer import BaseWriter, InconsistentWriteState
 from exporters.writers.console_writer import ConsoleWriter
@@ -24,6 +26,7 @@ from exporters.writers.filebase_base_writer import Filebase
 from exporters.export_formatter.json_export_formatter import JsonExportFormatter
 from exporters.groupers import PythonExpGrouper
 from exporters.writers.filebase_base_writer import FilebaseBaseWriter
+from exporters.utils import calculate_multipart_etag, CHUNK_SIZE
 from .utils import meta
 
 RESERVOIR_SAMPLING_BUFFER_CLASS = \
@@ -63,6 +66,22 @@ class FakeWriter(BaseWriter):
         self.fake_files_already_written.append(path)
 
 
+class FakeConcurrentWriter(FakeWriter):
+    """FakeWriter whose uploads wait until the test lets them go
+    """
+    concurrent_uploads = True
+
+    def __init__(self, options, *args, **kwargs):
+        super(FakeConcurrentWriter, self).__init__(options, *args, **kwargs)
+        self.uploads_allowed = threading.Event()
+
+    def write(self, path, key):
+        self.uploads_allowed.wait()
+        if key == ('fail',):
+            raise RuntimeError('Upload failed')
+        super(FakeConcurrentWriter, self).write(path, key)
+
+
 class FakeFilebaseWriter(FilebaseBaseWriter):
     """CustomWriter writing records to self.custom_output
     to test BaseWriter extensibility
@@ -127,6 +146,46 @@ class CustomWriterTest(unittest.TestCase):
         finally:
             writer.close()
 
+    def test_upload_concurrency(self):
+        # given:
+        writer = FakeConcurrentWriter({'options': {'upload_concurrency': 2}})
+        writer.write_buffer.items_per_buffer_write = 1
+
+        # when:
+        try:
+            writer.write_batch(self.batch[:2])
+            # then:
+            self.assertEqual(writer.fake_files_already_written, [])
+            self.assertEqual((writer.uploads_submitted, writer.uploads_done), (2, 0))
+            writer.uploads_allowed.set()
+            writer.write_batch(self.batch[2:])
+            writer.flush()
+            self.assertEqual((writer.uploads_submitted, writer.uploads_done), (3, 3))
+            self.assertEqual(len(writer.fake_files_already_written), 3)
+            for f in writer.fake_files_already_written:
+                self.assertFalse(os.path.exists(f))
+        finally:
+            writer.close()
+
+    def test_upload_concurrency_errors_raised_on_flush(self):
+        # given:
+        writer = FakeConcurrentWriter({'options': {'upload_concurrency': 2}})
+        writer.uploads_allowed.set()
+        item = BaseRecord({u'key1': u'value11'})
+        item.group_membership = ('fail',)
+
+        # when:
+        try:
+            writer.write_batch([item])
+            with self.assertRaisesRegexp(RuntimeError, 'Upload failed'):
+                writer.flush()
+        finally:
+            writer.close()
+
+    def test_upload_concurrency_not_supported(self):
+        with self.assertRaisesRegexp(ConfigurationError, 'upload_concurrency'):
+            FakeWriter({'options': {'upload_concurrency': 2}})
+
     def test_custom_writer_with_csv_formatter(self):
         # given:
 
@@ -325,6 +384,75 @@ class WriteBufferTest(unittest.TestCase):
                          'Wrong metadata')
         self.assertIsNone(self.write_buffer.get_metadata('somekey').get('nokey'))
 
+    def test_should_write_buffer_counts_bytes(self):
+        # given:
+        def random_item():
+            return BaseRecord({'key': random.getrandbits(1024)})
+        key = self.write_buffer.get_key_from_item(random_item())
+
+        # when:
+        with mock.patch('os.path.getsize', wraps=os.path.getsize) as getsize:
+            self.write_buffer.buffer(random_item())
+            self.assertFalse(self.write_buffer.should_write_buffer(key))
+            buffered = 1
+            while not self.write_buffer.should_write_buffer(key):
+                self.write_buffer.buffer(random_item())
+                buffered += 1
+
+        # then:
+        buffer_file = self.write_buffer.grouping_info[key]['group_file'][-1]
+        self.assertGreaterEqual(buffer_file.size, 1000)
+        self.assertGreaterEqual(buffer_file.compressed_size, 1000)
+        self.assertLess(getsize.call_count, buffered)
+
+    def test_buffer_file_counts_unicode_bytes(self):
+        # given:
+        formatter = mock.Mock(file_extension='jl', item_separator=u'\n')
+        formatter.format_header.return_value = formatter.format_footer.return_value = None
+        formatter.format.return_value = u'{"city": "M\xfcnchen \u6771\u4eac"}'
+        tmp_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_folder)
+        buffer_file = BufferFile(formatter, tmp_folder, 'none', hash_algorithm=None)
+
+        # when:
+        buffer_file.add_item_to_file({})
+        buffer_file.add_item_separator_to_file()
+        buffer_file.end_file()
+
+        # then:
+        self.assertEqual(buffer_file.size, os.path.getsize(buffer_file.path))
+        with open(buffer_file.path, 'rb') as f:
+            self.assertEqual(f.read().decode('utf-8'), u'{"city": "M\xfcnchen \u6771\u4eac"}\n')
+
+    def test_pack_buffer_hashes_while_writing(self):
+        # given:
+        item_writer = GroupingBufferFilesTracker(JsonExportFormatter({}, meta()), 'gz',
+                                                 hash_algorithm='md5')
+        write_buffer = WriteBuffer({}, meta(),
+                                   items_per_buffer_write=1000,
+                                   size_per_buffer_write=1000,
+                                   items_group_files_handler=item_writer,
+                                   hash_algorithm='md5')
+        item = BaseRecord({'key': 'value'})
+        key = write_buffer.get_key_from_item(item)
+        for _ in range(10):
+            write_buffer.buffer(item)
+
+        # when:
+        with mock.patch('exporters.write_buffers.grouping.hash_for_file') as hash_for_file:
+            write_info = write_buffer.pack_buffer(key)
+
+        # then:
+        self.assertFalse(hash_for_file.called)
+        with open(write_info['file_path'], 'rb') as f:
+            content = f.read()
+        self.assertEqual(write_info['file_hash'], hashlib.md5(content).hexdigest())
+        self.assertEqual(write_info['multipart_etag'],
+                         calculate_multipart_etag(write_info['file_path'], CHUNK_SIZE))
+        with gzip.open(write_info['file_path']) as f:
+            self.assertEqual(len(f.read().splitlines()), 10)
+        write_buffer.close()
+
 
 class ReservoirSamplingWriterTest(unittest.TestCase):
     def setUp(self):
@@ -499,6 +627,24 @@ class FSWriterTest(unittest.TestCase):
         expected_file = '{}/exporter_test0000.jl.gz'.format(self.tmp_dir)
         self.assertTrue(expected_file in writer.written_files)
 
+    def test_upload_concurrency(self):
+        writer_config = self.get_writer_config()
+        writer_config['options'].update({'upload_concurrency': 2,
+                                         'items_per_buffer_write': 1})
+        writer = FSWriter(writer_config, meta())
+        try:
+            writer.write_batch(self.get_batch() * 2)
+            writer.flush()
+        finally:
+            writer.close()
+        expected_files = ['{}/exporter_test{:04d}.jl.gz'.format(self.tmp_dir, i)
+                          for i in range(4)]
+        self.assertEqual(sorted(writer.written_files), expected_files)
+        self.assertEqual(writer.last_written_file, expected_files[-1])
+        self.assertEqual(len(writer.get_metadata('files_written')), 4)
+        for expected_file in expected_files:
+            self.assertTrue(os.path.exists(expected_file))
+
     def test_compression_gzip_format(self):
         writer_config = self.get_writer_config()
         writer_config['options'].update({'compression': 'gz'})
@@ -1,14 +1,24 @@
+import gzip
+import json
+import os
+import threading
+import time
 import unittest
+from multiprocessing.pool import ThreadPool
 
 import boto
 import moto
 import mock
+import six
+from boto.exception import S3ResponseError
 
+from exporters.exceptions import ConfigurationError
 from exporters.meta import ExportMeta
 from exporters.records.base_record import BaseRecord
 from exporters.utils import TmpFile
 from exporters.writers.base_writer import InconsistentWriteState
-from exporters.writers.s3_writer import S3Writer
+from exporters.writers.s3_writer import (S3Writer, MultipartUploadStream, MIN_PART_SIZE,
+                                         can_complete_multipart_upload, multipart_upload)
 
 from .utils import meta
 
@@ -110,6 +120,78 @@ class S3WriterTest(unittest.TestCase):
         self.assertEquals(1, len(saved_keys))
         self.assertEqual(saved_keys[0].name, 'tests/0.jl.gz')
 
+    def test_upload_big_file_parts_concurrently(self):
+        # given
+        options = self.get_writer_config()
+        options['options'].update(multipart_part_size=MIN_PART_SIZE, multipart_concurrency=3)
+        uploaded = []
+        in_flight = [0, 0]
+        lock = threading.Lock()
+
+        def upload_part_from_file(fp, part_num):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.1)
+            with lock:
+                in_flight[0] -= 1
+                uploaded.append((part_num, len(fp.read())))
+        mp = mock.Mock(upload_part_from_file=upload_part_from_file)
+
+        # when:
+        writer = S3Writer(options, meta())
+        try:
+            with TmpFile() as tmp_filename:
+                with open(tmp_filename, 'w') as f:
+                    f.truncate(3 * MIN_PART_SIZE + 10)
+                writer._upload_chunks(mp, tmp_filename)
+        finally:
+            writer.close()
+
+        # then:
+        self.assertEqual(sorted(uploaded), [
+            (1, MIN_PART_SIZE), (2, MIN_PART_SIZE), (3, MIN_PART_SIZE), (4, 10)])
+        self.assertEqual(in_flight[1], 3)
+
+    def test_small_multipart_part_size_rejected(self):
+        options = self.get_writer_config()
+        options['options']['multipart_part_size'] = 1024
+        with self.assertRaisesRegexp(ConfigurationError, 'multipart_part_size'):
+            S3Writer(options, meta())
+
+    def test_stream_upload(self):
+        # given
+        items_to_write = self.get_batch()
+        options = self.get_writer_config()
+        options['options'].update(stream_upload=True, multipart_concurrency=1,
+                                  check_consistency=True)
+
+        # when:
+        writer = S3Writer(options, meta())
+        try:
+            writer.write_batch(items_to_write)
+            tmp_folder = writer.write_buffer.items_group_files.tmp_folder
+            writer.flush()
+            writer.finish_writing()
+            tmp_files = [f for _, _, files in os.walk(tmp_folder) for f in files]
+        finally:
+            writer.close()
+
+        # then:
+        self.assertEqual(tmp_files, [])
+        bucket = self.s3_conn.get_bucket('fake_bucket')
+        key = bucket.get_key('tests/0.jl.gz')
+        self.assertEqual(key.get_metadata('total'), '2')
+        content = gzip.GzipFile(fileobj=six.BytesIO(key.get_contents_as_string())).read()
+        self.assertEqual([json.loads(l)['name'] for l in content.splitlines()],
+                         ['Roberto', 'Claudia'])
+
+    def test_stream_upload_not_supported_for_zip(self):
+        options = self.get_writer_config()
+        options['options'].update(stream_upload=True, compression='zip')
+        with self.assertRaisesRegexp(ConfigurationError, 'zip'):
+            S3Writer(options, meta())
+
     def test_connect_to_specific_region(self):
         # given:
         conn = boto.connect_s3()
@@ -288,3 +370,123 @@ class S3WriterTest(unittest.TestCase):
         content = saved_keys[0].get_contents_as_string()
         self.assertEquals(len(content.strip().splitlines()), sample_size)
         self.assertNotEquals(content.strip().splitlines(), items_to_write[:sample_size])
+
+
+class MultipartUploadStreamTest(unittest.TestCase):
+
+    def test_upload_parts_while_writing(self):
+        # given
+        bucket = mock.Mock()
+        uploaded = {}
+
+        def upload_chunk(mp, chunk):
+            uploaded[chunk.number] = chunk.bytes.read()
+        pool = ThreadPool(2)
+        stream = MultipartUploadStream(bucket, 'tests/0.jl', 10, upload_chunk, pool, 2)
+
+        # when:
+        try:
+            for data in ['abc', 'defghijklmnopqrstuvwx', '', 'yz']:
+                stream.write(data)
+            parts_while_writing = stream.parts
+            stream.complete()
+        finally:
+            pool.terminate()
+
+        # then:
+        self.assertEqual(parts_while_writing, 2)
+        self.assertEqual(uploaded, {1: 'abcdefghij', 2: 'klmnopqrst', 3: 'uvwxyz'})
+        bucket.initiate_multipart_upload.assert_called_once_with('tests/0.jl')
+        bucket.initiate_multipart_upload.return_value.complete_upload.assert_called_once_with()
+
+    def test_cancel_upload_if_a_part_fails(self):
+        # given
+        bucket = mock.Mock()
+
+        def upload_chunk(mp, chunk):
+            raise ValueError('part failed')
+        pool = ThreadPool(1)
+        stream = MultipartUploadStream(bucket, 'tests/0.jl', 10, upload_chunk, pool, 1)
+
+        # when:
+        try:
+            stream.write('abc')
+            with self.assertRaisesRegexp(ValueError, 'part failed'):
+                stream.complete()
+        finally:
+            pool.terminate()
+
+        # then:
+        mp = bucket.initiate_multipart_upload.return_value
+        mp.cancel_upload.assert_called_once_with()
+        self.assertFalse(mp.complete_upload.called)
+
+
+class MultipartUploadPermissionsTest(unittest.TestCase):
+
+    def get_bucket(self, name):
+        bucket = mock.Mock()
+        bucket.name = name
+        bucket.connection.host = 's3.amazonaws.com'
+        bucket.connection.aws_access_key_id = 'FAKE_ACCESS_KEY'
+        bucket.get_acl.return_value.acl.grants = []
+        return bucket
+
+    def test_permissions_probed_once_per_bucket(self):
+        # given
+        bucket = self.get_bucket('probed_bucket')
+        same_bucket = self.get_bucket('probed_bucket')
+        other_bucket = self.get_bucket('other_probed_bucket')
+
+        # when:
+        for b in [bucket, same_bucket, bucket, other_bucket]:
+            self.assertTrue(can_complete_multipart_upload(b))
+
+        # then:
+        self.assertEqual(bucket.get_acl.call_count, 1)
+        self.assertFalse(same_bucket.get_acl.called)
+        self.assertEqual(other_bucket.get_acl.call_count, 1)
+
+    def test_denied_permissions_cached(self):
+        bucket = self.get_bucket('denied_bucket')
+        bucket.get_acl.side_effect = S3ResponseError(403, 'Forbidden')
+        self.assertFalse(can_complete_multipart_upload(bucket))
+        self.assertFalse(can_complete_multipart_upload(bucket))
+        self.assertEqual(bucket.get_acl.call_count, 1)
+
+    @mock.patch('time.sleep')
+    @mock.patch('exporters.default_retries._retry_init', None)
+    def test_permissions_probe_errors_retried(self, sleep):
+        bucket = self.get_bucket('throttled_bucket')
+        bucket.get_acl.side_effect = [S3ResponseError(503, 'Slow Down'),
+                                      bucket.get_acl.return_value]
+        self.assertTrue(can_complete_multipart_upload(bucket))
+        self.assertEqual(bucket.get_acl.call_count, 2)
+
+    @mock.patch('time.sleep')
+    @mock.patch('exporters.default_retries._retry_init', None)
+    def test_permissions_probe_errors_not_cached(self, sleep):
+        bucket = self.get_bucket('unavailable_bucket')
+        bucket.get_acl.side_effect = [S3ResponseError(503, 'Slow Down')] * 10 + [
+            bucket.get_acl.return_value]
+        with self.assertRaises(S3ResponseError):
+            can_complete_multipart_upload(bucket)
+        self.assertTrue(can_complete_multipart_upload(bucket))
+        self.assertEqual(bucket.get_acl.call_count, 11)
+
+    def test_permissions_probed_again_after_failed_completion(self):
+        # given
+        bucket = self.get_bucket('failing_bucket')
+        mp = bucket.initiate_multipart_upload.return_value
+        mp.complete_upload.side_effect = ValueError('Access denied')
+        can_complete_multipart_upload(bucket)
+
+        # when:
+        with self.assertRaisesRegexp(ValueError, 'Access denied'):
+            with multipart_upload(bucket, 'tests/0.jl'):
+                pass
+        can_complete_multipart_upload(bucket)
+
+        # then:
+        self.assertEqual(bucket.get_acl.call_count, 2)
+        mp.cancel_upload.assert_called_once_with()